@@ -10,17 +10,96 @@ The remote device used for testing is a BC127 board.
 The local devices configuration (COM port, baudrate etc..) is
 extracted by the DeviceManager from the devices.json example file.
 
+Set the SR_EMULATOR environment variable to 1 to run the tests against the
+board emulators (sr_framework.emulator, Linux only) instead of the devices.
+Set the SR_DISCOVER environment variable to 1 to discover the devices on the
+serial ports instead (sr_framework.utils.device_discovery), kept in the
+inventory.json file for the next runs. With pytest-xdist, the devices are
+discovered by the controller process, and read from inventory.json by the
+workers.
+
+The tests requesting the ble_link_pool fixture share a DUT-remote BLE link
+(BleLinkPool): the boards are not reset between two tests reusing the link.
+The link is released after a failed test or a test marked link_destructive.
+
+The boards of a test (dut and remote fixtures requested) are opened and reset
+concurrently (BoardGroup) by the first test using them, and set up and torn
+down concurrently before and after each test.
+
+The DUT is leased for the test process, and the remote device from the rig
+of the DUT ("rig" of the devices in devices.json, optional) by the first test
+requesting the remote fixture: the tests can be run in parallel on several
+rigs with pytest-xdist, e.g. 'py -3 -m pytest -n auto --dist loadscope' (one
+worker per DUT). Set SR_LEASE_TIMEOUT to the time to wait for the devices
+leased by other processes (in seconds), e.g. when the DUTs of a rig share a
+remote device.
+
 """
 
 import os
 import pytest
 from sr_framework import DeviceManager, Eddington, Euler, Melody
-
-DM = DeviceManager(os.getcwd() + "\\devices.json")
+from sr_framework.device.ble_link_pool import BleLinkPool
+from sr_framework.device.board_group import BoardGroup
+
+USE_EMULATORS = os.environ.get('SR_EMULATOR') == '1'
+USE_DISCOVERY = os.environ.get('SR_DISCOVER') == '1'
+LEASE_TIMEOUT = float(os.environ.get('SR_LEASE_TIMEOUT', '0'))
+
+def pytest_configure(config):
+    """Register the markers."""
+    config.addinivalue_line(
+        'markers', 'link_destructive: the test modifies the BLE link of the ble_link_pool '
+        'fixture, which is not reused by the next tests.')
+    config.addinivalue_line(
+        'markers', 'always_reset: the boards are reset before and after the test, even if '
+        'their state is clean (see Board.dirty_state).')
+
+@pytest.hookimpl(hookwrapper=True)
+def pytest_runtest_makereport(item, call):
+    """Keep the reports of the test phases on the test item (item.rep_setup, rep_call...)."""
+    outcome = yield
+    report = outcome.get_result()
+    setattr(item, 'rep_' + report.when, report)
+
+@pytest.hookimpl(optionalhook=True)
+def pytest_xdist_auto_num_workers(config):
+    """Number of pytest-xdist workers of '-n auto': one per DUT (the remote devices
+    are leased by the workers running the tests requesting them)."""
+    if USE_EMULATORS:
+        # each worker runs its own emulators
+        return None
+    return max(1, DM.count_device_sets([DUT_SPEC]))
+
+def _create_device_manager():
+    """Returns the DeviceManager, with the devices of devices.json or the emulated devices."""
+    if USE_DISCOVERY:
+        inventory_file = os.path.join(os.getcwd(), "inventory.json")
+        if os.environ.get('PYTEST_XDIST_WORKER') and os.path.exists(inventory_file):
+            # discovered by the controller process
+            return DeviceManager(inventory_file)
+        device_manager = DeviceManager()
+        device_manager.discover_devices(inventory_file)
+        return device_manager
+    if not USE_EMULATORS:
+        return DeviceManager(os.path.join(os.getcwd(), "devices.json"))
+    from sr_framework.emulator import Air, EddingtonEmulator, MelodyEmulator
+    device_manager = DeviceManager()
+    air = Air()
+    # the scans of the emulated BC127 last a tenth of their duration
+    for emulator in (EddingtonEmulator(air=air), MelodyEmulator(air=air, time_scale=0.1)):
+        emulator.start()
+        device_manager.add_device_to_list(emulator.device())
+    return device_manager
+
+DM = _create_device_manager()
 DUT_MODEL = 'BC310X'
 DUT_REVISION = 'Beta.1.0'
 REMOTE_MODEL = 'BC127'
 REMOTE_REVISION = 'Melody Audio V7.2'
+DUT_SPEC = (DUT_MODEL, DUT_REVISION)
+REMOTE_SPEC = (REMOTE_MODEL, REMOTE_REVISION)
+POOL = BleLinkPool()
 
 def _get_class_from_model(model_string):
     """Return Object Class from model string."""
@@ -31,69 +110,136 @@ def _get_class_from_model(model_string):
     }
     return class_dict[model_string]
 
-def _acquire_device(model_string, revision_string):
-    """Acquire a device matching the model string.
+def _acquire_device(device):
+    """Acquire a device leased by the _dut_device or _remote_device fixture.
     Returns the device (Eddington, Euler or Melody object)."""
-    device = DM.get_device(model_string, revision_string)
-    assert device
-    cls = _get_class_from_model(model_string)
+    cls = _get_class_from_model(device.model)
     board = cls(device)
     return board
 
-def _board_session_setup(board):
-    """Generic board test setup (scope=session)."""
-    assert board.open_serial_port()
+def _reset(board):
+    """Reset the board, with a 2nd attempt."""
     if board.common_reset() is False:
         # 2nd attempt
         assert board.common_reset()
 
+def _must_reset(request):
+    """Returns True if the boards are reset whatever their state: test marked
+    always_reset, or failed (the state of the boards is unknown)."""
+    if request.node.get_closest_marker('always_reset'):
+        return True
+    return any(getattr(request.node, 'rep_' + when, None) is not None and
+               getattr(request.node, 'rep_' + when).failed for when in ('setup', 'call'))
+
+def _board_session_setup(board):
+    """Generic board test setup (scope=session)."""
+    assert board.open_serial_port()
+    _reset(board)
+
 def _board_session_teardown(board):
     """Generic board test teardown (scope=session)."""
     board.__del__()
 
+def _release_device(device):
+    """Release the lease of a device leased by the _dut_device or _remote_device fixture."""
+    if not device.is_acquired():
+        # not used by a board
+        device.release()
+
+@pytest.fixture(scope='session')
+def _dut_device():
+    """DUT device (Device object), leased for the test process."""
+    devices = DM.get_devices([DUT_SPEC], timeout=LEASE_TIMEOUT)
+    assert devices, 'No DUT available (leased by other processes?)'
+    yield devices[0]
+    _release_device(devices[0])
+
 @pytest.fixture(scope='session')
-def _dut_session():
-    """Dut session fixture."""
-    dev = _acquire_device(DUT_MODEL, DUT_REVISION)
-    _board_session_setup(dev)
-    yield dev
-    _board_session_teardown(dev)
+def _remote_device(_dut_device):
+    """Remote device (Device object) of the rig of the DUT, leased for the test
+    process by the first test requesting the remote fixture."""
+    devices = DM.get_devices([REMOTE_SPEC], timeout=LEASE_TIMEOUT, rig=_dut_device.rig)
+    assert devices, 'No remote device available for the DUT (leased by other processes?)'
+    yield devices[0]
+    _release_device(devices[0])
 
 @pytest.fixture(scope='session')
-def _remote_session():
-    """Remote session fixture."""
-    dev = _acquire_device(REMOTE_MODEL, REMOTE_REVISION)
-    _board_session_setup(dev)
-    yield dev
-    _board_session_teardown(dev)
+def _dut_session(_dut_device):
+    """Dut session fixture (brought up by the _boards fixture)."""
+    board = _acquire_device(_dut_device)
+    yield board
+    _board_session_teardown(board)
+
+@pytest.fixture(scope='session')
+def _remote_session(_remote_device, _dut_session):
+    """Remote session fixture (brought up by the _boards fixture)."""
+    board = _acquire_device(_remote_device)
+    yield board
+    # the link is released while both boards are open
+    POOL.release()
+    _board_session_teardown(board)
+
+@pytest.fixture(scope='session')
+def _boards_session():
+    """Boards brought up for the session (see _board_session_setup)."""
+    return set()
+
+@pytest.fixture(scope='function')
+def ble_link_pool(request):
+    """BLE link pool, shared by the tests requesting it (see BleLinkPool.acquire)."""
+    yield POOL
+    report = getattr(request.node, 'rep_call', None)
+    if report is None or report.failed or request.node.get_closest_marker('link_destructive'):
+        POOL.release()
 
 def _board_function_setup(request, board):
     """Generic board test setup (scope=function)."""
-    board.logger.info('------------------------------------------------')
-    board.logger.info('module      : %s' % request.module.__name__)
-    board.logger.info('function    : %s' % request.function.__name__)
-    board.logger.info('description : %s' % request.function.__doc__)
-    board.logger.info('------------------------------------------------')
-    if board.common_reset() is False:
-        # 2nd attempt
-        assert board.common_reset()
+    dirty = board.dirty_state()
+    if dirty or _must_reset(request):
+        board.logger.info('reset, dirty state: %s' % sorted(dirty))
+        _reset(board)
 
-def _board_function_teardown(board):
+def _board_function_teardown(request, board):
     """Generic board test teardown (scope=function)."""
-    if board.common_reset() is False:
+    if _must_reset(request):
+        _reset(board)
+    elif board.restore_clean_state() is False:
         # 2nd attempt
         assert board.common_reset()
 
 @pytest.fixture(scope='function')
-def dut(request, _dut_session):
+def _boards(request, _boards_session):
+    """Boards of the test (BoardGroup of the dut and remote fixtures requested),
+    brought up if not yet, set up and torn down concurrently."""
+    boards = BoardGroup(request.getfixturevalue('_%s_session' % name)
+                        for name in ('dut', 'remote') if name in request.fixturenames)
+
+    def session_setup(board):
+        _board_session_setup(board)
+        _boards_session.add(board)
+
+    BoardGroup(board for board in boards if board not in _boards_session).run(session_setup)
+    for board in boards:
+        board.logger.info('------------------------------------------------')
+        board.logger.info('module      : %s' % request.module.__name__)
+        board.logger.info('function    : %s' % request.function.__name__)
+        board.logger.info('description : %s' % request.function.__doc__)
+        board.logger.info('------------------------------------------------')
+    if POOL.link is None or 'ble_link_pool' not in request.fixturenames:
+        POOL.release()
+        boards.run(lambda board: _board_function_setup(request, board))
+    # else the boards are kept with the link, validated by the pool
+    yield boards
+    # if a link is kept for the next test, it is released by its setup if not reused
+    if POOL.link is None:
+        boards.run(lambda board: _board_function_teardown(request, board))
+
+@pytest.fixture(scope='function')
+def dut(_boards, _dut_session):
     """Device Under Test."""
-    _board_function_setup(request, _dut_session)
-    yield _dut_session
-    _board_function_teardown(_dut_session)
+    return _dut_session
 
 @pytest.fixture(scope='function')
-def remote(request, _remote_session):
+def remote(_boards, _remote_session):
     """Remote Device."""
-    _board_function_setup(request, _remote_session)
-    yield _remote_session
-    _board_function_teardown(_remote_session)
+    return _remote_session
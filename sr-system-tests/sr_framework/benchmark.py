@@ -0,0 +1,312 @@
+#!/usr/bin/python
+
+""" Benchmarks of the serial and command stack.
+
+The benchmarks run against the board emulators (sr_framework.emulator,
+Linux only), or against a board for the command benchmarks (--port), and
+the results are written as JSON to track the regressions across framework
+versions:
+
+    python -m sr_framework.benchmark --output benchmark.json
+    python -m sr_framework.benchmark --port /dev/ttyUSB0 --baudrate 115200 --only command
+
+The emulators run in a child process, so that the CPU time measured
+(time.process_time) is the CPU time of the framework only.
+"""
+
+import argparse
+import datetime
+import json
+import logging
+import multiprocessing
+import platform
+import sys
+import time
+import sr_framework
+from sr_framework.device.eddington import Eddington, EDD_RESULT_SUCCESS
+from sr_framework.device.melody import Melody
+from sr_framework.emulator import EddingtonEmulator, MelodyEmulator, virtual_advertisers
+from sr_framework.emulator.eddington import EDD_BAUDRATES
+from sr_framework.emulator.pty_device import PtyDevice
+from sr_framework.utils.device_manager import Device
+from sr_framework.utils.logger import Logger
+from sr_framework.utils.serial_port import SerialPort, SerialSearchCursor
+
+# Baudrates of the RX throughput benchmark (same as test_hw_uart.py).
+BENCHMARK_BAUDRATES = EDD_BAUDRATES
+
+# Length of the lines streamed by the RX benchmarks (in bytes, end of line included).
+BENCHMARK_LINE_LENGTH = 64
+
+# Number of lines in the serial rx buffer for the regex search benchmark.
+BENCHMARK_SEARCH_SIZES = (100, 1000, 10000, 50000)
+
+BENCHMARKS = ('command', 'rx_throughput', 'regex_search', 'scan')
+
+# Log level of the boards during the benchmarks (DEBUG logs every line received).
+BENCHMARK_LOG_LEVEL = logging.WARNING
+
+_MEGABYTE = 1024 * 1024
+
+
+class LineSource(PtyDevice):
+    """ Emulated device streaming lines, paced to a baudrate.
+
+        Command: 'STREAM <lines> <baudrate>' (baudrate 0: not paced).
+        The lines are '<index> XXX...\\r\\n', BENCHMARK_LINE_LENGTH bytes long.
+    """
+
+    MODEL = 'LINE_SOURCE'
+
+    # Interval between two writes of a paced stream (in seconds).
+    TICK = 0.01
+
+    def handle_command(self, command):
+        """ Start a stream. """
+        words = command.split()
+        if words[0] == 'STREAM':
+            self._stream(0, int(words[1]), int(words[2]), time.monotonic())
+
+    @staticmethod
+    def line(index):
+        """ Returns the line index of the stream (bytes). """
+        prefix = '{:08d} '.format(index).encode('ascii')
+        return prefix + b'X' * (BENCHMARK_LINE_LENGTH - len(prefix) - 2) + b'\r\n'
+
+    def _stream(self, index, count, baudrate, start):
+        if baudrate:
+            # lines fully transmitted at baudrate, 10 bits per byte (start and stop bits)
+            elapsed = time.monotonic() - start
+            due = min(count, int(elapsed * baudrate / 10 / BENCHMARK_LINE_LENGTH))
+        else:
+            due = count
+        self.write(b''.join(self.line(i) for i in range(index, due)))
+        if due < count:
+            self.schedule(self.TICK, self._stream, due, count, baudrate, start)
+
+
+def _run_emulator(factory, connection):
+    """ Child process: run the emulator until the parent closes the connection. """
+    emulator = factory()
+    emulator.start()
+    connection.send(emulator.device())
+    try:
+        connection.recv()
+    except EOFError:
+        pass
+    emulator.stop()
+
+
+class EmulatorProcess:
+    """ Emulator running in a child process (context manager returning its Device). """
+    def __init__(self, factory):
+        self._factory = factory
+        self._connection = None
+        self._process = None
+
+    def __enter__(self):
+        context = multiprocessing.get_context('fork')
+        self._connection, child_connection = context.Pipe()
+        self._process = context.Process(target=_run_emulator,
+                                        args=(self._factory, child_connection))
+        self._process.daemon = True
+        self._process.start()
+        return self._connection.recv()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._connection.close()
+        self._process.join(5)
+        return False
+
+
+def _percentile(values, percent):
+    """ Returns the percentile of values (nearest rank). """
+    values = sorted(values)
+    return values[max(0, min(len(values) - 1, int(round(percent / 100 * len(values))) - 1))]
+
+
+def _open_board(cls, device):
+    board = cls(device)
+    board.logger.logger.setLevel(BENCHMARK_LOG_LEVEL)
+    assert board.open_serial_port()
+    return board
+
+
+def benchmark_command(device, count=500):
+    """ Latency of Eddington._execute() and commands per second, sequential
+    and pipelined (Eddington.batch()). """
+    board = _open_board(Eddington, device)
+    try:
+        latencies = []
+        for _ in range(count):
+            start = time.perf_counter()
+            assert board._execute('') == EDD_RESULT_SUCCESS
+            latencies.append(time.perf_counter() - start)
+        start = time.perf_counter()
+        with board.batch() as batch:
+            for _ in range(count):
+                batch.execute('')
+        pipelined = time.perf_counter() - start
+        assert batch.results == [EDD_RESULT_SUCCESS] * count
+    finally:
+        board.__del__()
+    return {
+        'commands': count,
+        'commands_per_second': count / sum(latencies),
+        'latency_p50_ms': _percentile(latencies, 50) * 1000,
+        'latency_p99_ms': _percentile(latencies, 99) * 1000,
+        'latency_max_ms': max(latencies) * 1000,
+        'pipelined_commands_per_second': count / pipelined,
+    }
+
+
+def _open_line_source(device):
+    serial = SerialPort(device.port, Logger('benchmark', level=BENCHMARK_LOG_LEVEL))
+    assert serial.serial_open(int(device.baud))
+    return serial
+
+
+def _receive_stream(serial, count, baudrate, timeout):
+    """ Stream count lines and wait for them. Returns (seconds, CPU seconds). """
+    serial.serial_rx_clear()
+    target = serial.serial_rx_mark() + count
+    deadline = time.monotonic() + timeout
+    start, cpu_start = time.perf_counter(), time.process_time()
+    serial.serial_write_data('STREAM {} {}\r'.format(count, baudrate))
+    with serial.rx_cond:
+        while serial.rx_data.end < target:
+            remaining = deadline - time.monotonic()
+            assert remaining > 0, 'stream timeout'
+            serial.rx_cond.wait(remaining)
+    return time.perf_counter() - start, time.process_time() - cpu_start
+
+
+def benchmark_rx_throughput(device, duration=1.0, lines=20000):
+    """ RX line throughput and CPU per MB received, at each baudrate
+    (duration seconds of data) and not paced (lines lines, baudrate 0). """
+    serial = _open_line_source(device)
+    results = []
+    try:
+        for baudrate in BENCHMARK_BAUDRATES + (0,):
+            count = lines if not baudrate else \
+                max(1, int(duration * baudrate / 10 / BENCHMARK_LINE_LENGTH))
+            seconds, cpu = _receive_stream(serial, count, baudrate, duration * 10 + 30)
+            size = count * BENCHMARK_LINE_LENGTH
+            results.append({
+                'baudrate': baudrate,
+                'lines': count,
+                'bytes': size,
+                'seconds': seconds,
+                'lines_per_second': count / seconds,
+                'bytes_per_second': size / seconds,
+                'cpu_seconds_per_mb': cpu / size * _MEGABYTE,
+            })
+    finally:
+        serial.serial_close()
+    return results
+
+
+def benchmark_regex_search(device, searches=20):
+    """ Cost of the regex searches (no match, whole buffer searched) vs the
+    number of lines in the serial rx buffer, with and without cursor. """
+    serial = _open_line_source(device)
+    results = []
+    try:
+        for size in BENCHMARK_SEARCH_SIZES:
+            _receive_stream(serial, size, 0, 60)
+            timings = {}
+            for name, search in (
+                    ('regex', lambda: serial.serial_search_regex(r'NOMATCH (\d+)')),
+                    ('regex_all', lambda: serial.serial_search_regex_all(r'NOMATCH (\d+)')),
+                    ('line_startswith', lambda: serial.serial_search_line_startswith('NOMATCH'))):
+                start = time.perf_counter()
+                for _ in range(searches):
+                    search()
+                timings[name] = (time.perf_counter() - start) / searches
+            # searches with a cursor: only the lines received since the first search
+            cursor = SerialSearchCursor()
+            serial.serial_search_regex(r'NOMATCH (\d+)', cursor=cursor)
+            start = time.perf_counter()
+            for _ in range(searches):
+                serial.serial_search_regex(r'NOMATCH (\d+)', cursor=cursor)
+            timings['regex_cursor'] = (time.perf_counter() - start) / searches
+            results.append(dict({'lines': size, 'bytes': size * BENCHMARK_LINE_LENGTH},
+                                **{name + '_us': seconds * 1e6
+                                   for name, seconds in timings.items()}))
+    finally:
+        serial.serial_close()
+    return results
+
+
+def benchmark_scan(device, duration=10):
+    """ Scan results parsed per second (Melody.ble_scan(), the emulated BC127
+    reports 100 advertisers every 10 ms for a tenth of duration). """
+    board = _open_board(Melody, device)
+    try:
+        assert board.common_reset()
+        start, cpu_start = time.perf_counter(), time.process_time()
+        results = board.ble_scan(duration)
+        seconds, cpu = time.perf_counter() - start, time.process_time() - cpu_start
+    finally:
+        board.__del__()
+    return {
+        'results': len(results),
+        'seconds': seconds,
+        'results_per_cpu_second': len(results) / cpu if cpu else None,
+    }
+
+
+def _scan_emulator():
+    return MelodyEmulator(advertisers=virtual_advertisers(100), scan_interval=0.01,
+                          time_scale=0.1)
+
+
+def run(benchmarks=BENCHMARKS, port=None, baudrate=115200):
+    """ Run the benchmarks. Returns the results (dict, JSON serializable).
+    The command benchmark runs against the board on port, if given. """
+    results = {}
+    if 'command' in benchmarks:
+        if port:
+            results['command'] = benchmark_command(
+                Device('', 'BC310X', '', port, str(baudrate)))
+        else:
+            with EmulatorProcess(EddingtonEmulator) as device:
+                results['command'] = benchmark_command(device)
+    for name, function in (('rx_throughput', benchmark_rx_throughput),
+                           ('regex_search', benchmark_regex_search)):
+        if name in benchmarks:
+            with EmulatorProcess(LineSource) as device:
+                results[name] = function(device)
+    if 'scan' in benchmarks:
+        with EmulatorProcess(_scan_emulator) as device:
+            results['scan'] = benchmark_scan(device)
+    return {
+        'framework_version': sr_framework.__version__,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'date': datetime.datetime.now().isoformat(timespec='seconds'),
+        'port': port,
+        'benchmarks': results,
+    }
+
+
+def main(argv=None):
+    """ Command line entry point. """
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--output', help='JSON output file (default: standard output)')
+    parser.add_argument('--only', help='comma separated benchmarks, in: ' + ','.join(BENCHMARKS))
+    parser.add_argument('--port', help='serial port of an Eddington board (command benchmark)')
+    parser.add_argument('--baudrate', type=int, default=115200, help='baudrate of the board')
+    args = parser.parse_args(argv)
+    benchmarks = args.only.split(',') if args.only else BENCHMARKS
+    results = json.dumps(run(benchmarks, args.port, args.baudrate), indent=2)
+    if args.output:
+        with open(args.output, 'w') as file:
+            file.write(results + '\n')
+    else:
+        print(results)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -4,8 +4,13 @@
 
 This module contains the complete BLE interface (absract class).
 The BLE interface itself inherits from the GAP, GATT and BC Smart interfaces.
+
+The payloads (advertising data, attribute values, BC Smart data) are given as
+bytes-like objects (bytes, bytearray, memoryview...) or lists of ints, and
+returned as bytes (lists of ints after Board.set_list_payloads(True)).
 """
 import enum
+from sr_framework.utils import payload
 
 
 class GapInterface:
@@ -40,8 +45,8 @@ class GapInterface:
 
         Args:
             enable:         True to start advertising, or False to stop advertising.
-            adv_data:       Advertising data (e.g. [0x02, 0x01, 0x06..]).
-            scan_resp_data: Scan response data (e.g. [0x05, 0x11, 0xAA, 0xBB..]).
+            adv_data:       Advertising data (e.g. b'\\x02\\x01\\x06..').
+            scan_resp_data: Scan response data (e.g. b'\\x05\\x11\\xAA\\xBB..').
 
         Returns:
             bool: True for success, False otherwise.
@@ -90,6 +95,7 @@ class GapInterface:
 
     class ScanResult:
         """ Scan result (parsed format). """
+        __slots__ = ('addr', 'addr_type', 'rssi', 'flag', 'name')
 
         def __init__(self, addr, addr_type, rssi, flag, name=None):
             self.addr = addr
@@ -111,6 +117,7 @@ class GapInterface:
 
     class ScanRawResult:
         """ Scan result (raw format). """
+        __slots__ = ('addr', 'addr_type', 'rssi', 'raw_data')
 
         def __init__(self, addr, addr_type, rssi, raw_data):
             self.addr = addr
@@ -128,7 +135,7 @@ class GapInterface:
         def __str__(self):
             return ('ScanRawResult: addr="%s", addr_type=%d, rssi=%d, raw data="%s"'
                     % (self.addr, self.addr_type, self.rssi,
-                       ''.join('\\' + x for x in self.raw_data)))
+                       payload.escape(self.raw_data)))
 
     def ble_scan(self, duration, result_format=SCAN_RESULT_FORMAT_DEFAULT):
         """ Start scanning.
@@ -143,6 +150,27 @@ class GapInterface:
         """
         pass
 
+    def ble_scan_iter(self, duration, result_format=SCAN_RESULT_FORMAT_DEFAULT, stop_when=None):
+        """ Start scanning, and yield the scan results as they are received.
+
+        Args:
+            duration:       Maximum duration of the scan.
+            result_format:  Format of the scan results (SCAN_RESULT_FORMAT_DEFAULT
+                            or SCAN_RESULT_FORMAT_RAW_DATA)
+            stop_when:      Function of a scan result, the scan is stopped once it
+                            returns True (after this result is yielded). None to
+                            scan for the whole duration.
+
+        Yields:
+            ScanResult or ScanRawResult: Each scan result, as it is received.
+            Nothing if the scan could not be started.
+
+        Usage:
+            for result in remote.ble_scan_iter(10, stop_when=lambda res: res.addr == addr):
+                ...
+        """
+        pass
+
     def ble_set_scan_parameters(self, scan_type, scan_interval, scan_window):
         """ Set scan parameters.
 
@@ -387,7 +415,7 @@ class GattInterface:
                                     1 - Variable length value
             max_attribute_length:   The maximum attribute length.
             attribute_value:        Attribute value (e.g.
-                                    [0x31, 0x38, 0x57..]).
+                                    b'\\x31\\x38\\x57..').
 
         Returns:
             bool:     True if the characteristic has been staged
@@ -415,7 +443,7 @@ class GattInterface:
                                     1 - Variable length value
             max_attribute_length:   The maximum attribute length.
             attribute_value:        Attribute value (e.g.
-                                    [0x31, 0x38, 0x57..]).
+                                    b'\\x31\\x38\\x57..').
 
         Returns:
             bool:     True if the descriptor has been staged
@@ -478,7 +506,7 @@ class GattInterface:
             session_id:     BLE session ID.
             handle:         Handle of the characteristic value.
             accept:         True or False.
-            value:          Attribute value (e.g. [0x01, 0x42, 0x35..]).
+            value:          Attribute value (e.g. b'\\x01\\x42\\x35..').
                             Ignored if the Read Request is rejected.
             offset:         Attribute value offset
 
@@ -496,7 +524,7 @@ class GattInterface:
             timeout:        Timeout in seconds.
 
         Returns:
-            List of int: Characteristic value (e.g. [0x01, 0x42, 0x35..]).
+            bytes: Characteristic value (e.g. b'\\x01\\x42\\x35..').
         """
         pass
 
@@ -509,7 +537,7 @@ class GattInterface:
         Args:
             session_id:     BLE session ID.
             handle:         Handle of the characteristic value.
-            value:          Attribute value (e.g. [0x01, 0x42, 0x35..]).
+            value:          Attribute value (e.g. b'\\x01\\x42\\x35..').
             need_rsp:       True for a Write Request (with response),
                             or False for a Write Command (without response).
 
@@ -588,7 +616,7 @@ class GattInterface:
         Args:
             session_id:     BLE session ID.
             handle:         Handle of the characteristic value.
-            value:          Attribute value (e.g. [0x01, 0x42, 0x35..]).
+            value:          Attribute value (e.g. b'\\x01\\x42\\x35..').
 
         Returns:
             bool: True for success, False otherwise.
@@ -604,7 +632,7 @@ class GattInterface:
             timeout:        Timeout in seconds.
 
         Returns:
-            List of int: Characteristic value (e.g. [0x01, 0x42, 0x35..]).
+            bytes: Characteristic value (e.g. b'\\x01\\x42\\x35..').
         """
         pass
 
@@ -617,7 +645,7 @@ class GattInterface:
         Args:
             session_id:     BLE session ID.
             handle:         Handle of the characteristic value.
-            value:          Attribute value (e.g. [0x01, 0x42, 0x35..]).
+            value:          Attribute value (e.g. b'\\x01\\x42\\x35..').
 
         Returns:
             bool: True for success, False otherwise.
@@ -633,7 +661,7 @@ class GattInterface:
             timeout:        Timeout in seconds.
 
         Returns:
-            List of int: Characteristic value (e.g. [0x01, 0x42, 0x35..]).
+            bytes: Characteristic value (e.g. b'\\x01\\x42\\x35..').
         """
         pass
 
@@ -677,22 +705,26 @@ class BcSmartInterface:
 
         Args:
             session_id:     BLE session ID.
-            data:           Data to send (e.g. [0x01, 0x42, 0x35..]).
+            data:           Data to send (e.g. b'\\x01\\x42\\x35..').
 
         Returns:
             bool: True for success, False otherwise.
         """
         pass
 
-    def bc_smart_server_wait_for_data(self, session_id, timeout=2):
+    def bc_smart_server_wait_for_data(self, session_id, timeout=2, size=None, quiet=None):
         """ Wait for data sent by a BC Smart client.
 
         Args:
             session_id:     BLE session ID.
             timeout:        Timeout in seconds.
+            size:           Size of the data expected: returns as soon as size
+                            bytes are received. None to wait for timeout.
+            quiet:          Returns once no data has been received for quiet
+                            seconds, after the first data. None to wait for timeout.
 
         Returns:
-            List of int: Data received (e.g. [0x01, 0x42, 0x35..]).
+            bytes: Data received (e.g. b'\\x01\\x42\\x35..').
         """
         pass
 
@@ -716,22 +748,27 @@ class BcSmartInterface:
 
         Args:
             session_id:     BLE session ID.
-            data:           Data to send (e.g. [0x01, 0x42, 0x35..]).
+            data:           Data to send (e.g. b'\\x01\\x42\\x35..').
 
         Returns:
             bool: True for success, False otherwise.
         """
         pass
 
-    def bc_smart_client_wait_for_client_data(self, session_id, timeout=2):
+    def bc_smart_client_wait_for_client_data(self, session_id, timeout=2, size=None,
+                                             quiet=None):
         """ Wait for data sent by a BC Smart server.
 
         Args:
             session_id:     BLE session ID.
             timeout:        Timeout in seconds.
+            size:           Size of the data expected: returns as soon as size
+                            bytes are received. None to wait for timeout.
+            quiet:          Returns once no data has been received for quiet
+                            seconds, after the first data. None to wait for timeout.
 
         Returns:
-            List of int: Data received (e.g. [0x01, 0x42, 0x35..]).
+            bytes: Data received (e.g. b'\\x01\\x42\\x35..').
         """
         pass
 
@@ -747,12 +784,14 @@ class BcSmartInterface:
         """
         pass
 
-    def bc_smart_client_wait_for_command_response(self, session_id, timeout=5):
+    def bc_smart_client_wait_for_command_response(self, session_id, timeout=5, quiet=None):
         """ Wait for command response sent by a BC Smart server.
 
         Args:
             session_id:     BLE session ID.
             timeout:        Timeout in seconds.
+            quiet:          Returns once no response has been received for quiet
+                            seconds, after the first response. None to wait for timeout.
 
         Returns:
             List of str: Command response(s).
@@ -0,0 +1,107 @@
+#!/usr/bin/python
+
+""" BLE link pool.
+
+This module contains the BleLinkPool class, which keeps a BLE connection
+between a DUT (peripheral) and a remote device (central) alive across the
+tests sharing it, instead of connecting and disconnecting for each test.
+"""
+
+import time
+
+
+class BleLink:
+    """ BLE connection between a DUT and a remote device.
+
+        Attributes:
+            key (str): Identifier of the tests sharing the link (and of their setup).
+            dut: DUT board (peripheral).
+            remote: Remote board (central).
+            dut_session_id (int): BLE session ID of the link on the DUT.
+            remote_session_id (int): BLE session ID of the link on the remote device.
+    """
+    def __init__(self, key, dut, remote, dut_session_id, remote_session_id):
+        self.key = key
+        self.dut = dut
+        self.remote = remote
+        self.dut_session_id = dut_session_id
+        self.remote_session_id = remote_session_id
+
+    def __str__(self):
+        return 'BleLink: key="%s", dut_session_id=%s, remote_session_id=%s' % (
+            self.key, self.dut_session_id, self.remote_session_id)
+
+
+class BleLinkPool:
+    """ Keeps the BLE link of the last tests alive, for the next tests of the same key.
+
+        A link is established for a key (e.g. a test module and the GATT
+        database of its DUT), after a setup function of the DUT. It is handed
+        out again while the key is the same and the link is still connected
+        (checked on the session tables of the boards, kept from the URCs).
+        Otherwise the link is released and both boards are reset before the
+        new link is established.
+
+        Attributes:
+            link (BleLink): Link kept alive, None if none.
+    """
+    def __init__(self):
+        self.link = None
+
+    @staticmethod
+    def _is_connected(link):
+        return bool(link.dut.ble_is_connected(link.dut_session_id)) and \
+            bool(link.remote.ble_is_connected(link.remote_session_id))
+
+    def acquire(self, dut, remote, key, setup=None, settle=0):
+        """ Returns the link between dut and remote for key, established if needed.
+
+        Args:
+            dut: DUT board (peripheral), reset if no link is kept.
+            remote: Remote board (central), reset if no link is kept.
+            key: Identifier of the tests sharing the link.
+            setup: Function of the DUT (e.g. GATT database setup), called before
+                the connection. Not called again while the link is reused.
+            settle: Time to wait once connected (in seconds), e.g. for the remote
+                device discovering the DUT services.
+
+        Returns:
+            BleLink: The link, None if it could not be established.
+        """
+        link = self.link
+        if link is not None:
+            if link.key == key and link.dut is dut and link.remote is remote and \
+                    self._is_connected(link):
+                # events of the previous tests
+                dut.flush_events()
+                remote.flush_events()
+                return link
+            self.release(reset=True)
+        if setup is not None:
+            setup(dut)
+        dut_bdaddr = dut.ble_get_local_address()
+        remote_bdaddr = remote.ble_get_local_address()
+        if not dut.ble_set_advertising_enable(True):
+            return None
+        remote_session = remote.ble_create_session(dut_bdaddr)
+        if not remote_session or not remote.ble_connect(remote_session.session_id) or \
+                not dut.ble_wait_for_connection():
+            return None
+        dut_session_id = dut.ble_get_session_id_from_bdaddr(remote_bdaddr)
+        if dut_session_id is None:
+            return None
+        if settle:
+            time.sleep(settle)
+        self.link = BleLink(key, dut, remote, dut_session_id, remote_session.session_id)
+        return self.link
+
+    def release(self, reset=False):
+        """ Disconnect the link kept, if any. The boards are reset if reset is True. """
+        link, self.link = self.link, None
+        if link is None:
+            return
+        if link.remote.ble_disconnect(link.remote_session_id):
+            link.dut.ble_wait_for_disconnection(link.dut_session_id)
+        if reset:
+            link.dut.common_reset()
+            link.remote.common_reset()
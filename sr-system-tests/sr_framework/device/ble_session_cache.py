@@ -0,0 +1,136 @@
+#!/usr/bin/python
+
+""" BLE session cache.
+
+This module contains the BleSessionCache class, which keeps the BLE sessions
+of a board (AT+SRBLECFG) without querying the board for each status request.
+"""
+
+from sr_framework.utils.urc_dispatcher import DEFAULT_URC_QUEUE_SIZE
+
+# Connection/disconnection URC, e.g. '+SRBLE_IND: 1,1' or '+SRBLE_IND: 1,0,19'.
+_BLE_IND_REGEX = r"\+SRBLE_IND: (\d+),([0|1])"
+
+
+class CachedBleSession:
+    """ BLE session of the board, as known by the cache.
+
+        Attributes:
+            session_id (int): BLE session identifier.
+            addr (str): Bluetooth address of the remote device (e.g '20:FA:BB:00:01:80').
+            connected (int): 1 if connected, 0 otherwise.
+            mtu (int): Exchanged MTU size, None if not known.
+    """
+    def __init__(self, session_id, addr, connected=0, mtu=None):
+        self.session_id = session_id
+        self.addr = addr
+        self.connected = connected
+        self.mtu = mtu
+
+    def __str__(self):
+        return 'CachedBleSession: session_id=%d, addr="%s", connected=%d, mtu=%s' % (
+            self.session_id, self.addr, self.connected, self.mtu)
+
+
+class BleSessionCache:
+    """ BLE sessions of a board, indexed by session id and by address.
+
+        The cache is loaded once from the board, then kept current from the
+        +SRBLE_IND URCs (received on its own URC subscription, so they are
+        still queued for the board waiters) and from the session commands of
+        the board (update(), remove()). It is reloaded on the next request
+        after invalidate() (e.g. reset) or a URC of an unknown session.
+
+        The exchanged MTU is only known from the board: it is reloaded when
+        requested for a session (dis)connected since the last load.
+    """
+    def __init__(self, serial_port, load):
+        """
+        Args:
+            serial_port: SerialPort of the board.
+            load: Function querying the board, returning its sessions (list of
+                CachedBleSession), None on failure.
+        """
+        # first: the cache is current when the board waiters get the URCs
+        self._urc = serial_port.serial_urc_subscribe(('+SRBLE_IND',), first=True)
+        self._load = load
+        self._by_id = {}
+        self._by_addr = {}
+        self._valid = False
+
+    def invalidate(self):
+        """ Reload the sessions from the board on the next request. """
+        self._valid = False
+
+    def refresh(self):
+        """ Reload the sessions from the board. Returns True on success. """
+        # URCs received before the load are reflected by the sessions loaded.
+        self._urc.flush()
+        sessions = self._load()
+        self._by_id = {}
+        self._by_addr = {}
+        self._valid = sessions is not None
+        for session in sessions or ():
+            self._add(session)
+        return self._valid
+
+    def _add(self, session):
+        previous = self._by_id.get(session.session_id)
+        if previous:
+            self._by_addr.pop(previous.addr, None)
+        self._by_id[session.session_id] = session
+        self._by_addr[session.addr] = session
+
+    def _sync(self):
+        """ Apply the URCs received, and reload the sessions if needed.
+        Returns True if the cache is valid. """
+        urcs = self._urc.wait_all(_BLE_IND_REGEX)
+        if len(urcs) >= DEFAULT_URC_QUEUE_SIZE:
+            # URCs might have been dropped
+            self._valid = False
+        for session_id, connected in urcs:
+            session = self._by_id.get(int(session_id))
+            if session is None:
+                # session created by the board (e.g. remote connection)
+                self._valid = False
+                continue
+            session.connected = int(connected)
+            session.mtu = None
+        return self._valid or self.refresh()
+
+    def update(self, session):
+        """ Add or replace a session (CachedBleSession), e.g. once created. """
+        if self._sync():
+            self._add(session)
+
+    def remove(self, session_id):
+        """ Remove a session, e.g. once deleted. """
+        if self._sync():
+            session = self._by_id.pop(session_id, None)
+            if session:
+                self._by_addr.pop(session.addr, None)
+
+    def get(self, session_id):
+        """ Returns the CachedBleSession of session_id, None if not found. """
+        if not self._sync():
+            return None
+        return self._by_id.get(session_id)
+
+    def get_by_addr(self, addr):
+        """ Returns the CachedBleSession of the remote address addr, None if not found. """
+        if not self._sync():
+            return None
+        return self._by_addr.get(addr)
+
+    def get_mtu(self, session_id):
+        """ Returns the exchanged MTU size of session_id, None if not known. """
+        session = self.get(session_id)
+        if session and session.mtu is None and self.refresh():
+            session = self._by_id.get(session_id)
+        return session.mtu if session else None
+
+    def sessions(self):
+        """ Returns all the CachedBleSession, by session id. None on failure. """
+        if not self._sync():
+            return None
+        return [self._by_id[session_id] for session_id in sorted(self._by_id)]
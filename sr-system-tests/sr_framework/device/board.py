@@ -4,13 +4,81 @@
 It is a base class for Eddington, Euler and Melody classes.
 """
 
+import functools
 from sr_framework.utils.serial_port import SerialPort
 from sr_framework.utils.logger import Logger
 import sr_framework.utils.helpers
 
+
+def cached_identity(name):
+    """ Decorator of the Board methods reading a device identity attribute
+    (Board.IDENTITY_INVALIDATION), which read the board once until invalidated.
+    A failure (None) is not cached. """
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self):
+            value = self._identity_cache.get(name)
+            if value is None:
+                value = method(self)
+                if value is not None:
+                    self._identity_cache[name] = value
+            # the callers may modify the lists returned
+            return list(value) if isinstance(value, list) else value
+        return wrapper
+    return decorator
+
+
+def changes_state(state):
+    """ Decorator of the Board methods changing the state of the board, recorded
+    in the dirty state of the board (see Board.dirty_state). state is the name of
+    the state changed, or a function of the method arguments returning it. """
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            # recorded first: the state might be changed even if the method fails
+            self._dirty.add(state(*args, **kwargs) if callable(state) else state)
+            return method(self, *args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def resets_state(method):
+    """ Decorator of the Board methods resetting the board (returning True on
+    success), which clear the dirty state of the board. """
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        result = method(self, *args, **kwargs)
+        if result:
+            self._mark_clean()
+        return result
+    return wrapper
+
+
+def advertising_state(enable, adv_data=None, scan_resp_data=None):
+    """ Returns the state changed by ble_set_advertising_enable (see changes_state). """
+    return 'advertising_data' if adv_data or scan_resp_data else 'advertising'
+
+
 class Board:
     """ Board base class."""
 
+    # Prefixes of the unsolicited result codes of the board, queued in self._urc.
+    URC_PREFIXES = ()
+
+    # Device identity attributes cached (see cached_identity), with the events
+    # invalidating them: 'restore' (common_restore_to_defaults) and 'save'
+    # (hw_save_settings). A reset does not invalidate any of them: it reloads
+    # the saved settings, which are the cached ones since a save invalidates
+    # the settings attributes.
+    IDENTITY_INVALIDATION = {
+        'manufacturer_id': ('restore',),
+        'model_id': ('restore',),
+        'revision_id': ('restore',),
+        'supported_command_list': ('restore',),
+        'local_address': ('restore', 'save'),
+        'local_mtu_size': ('restore', 'save'),
+    }
+
     def __init__(self, device):
         assert device.is_acquired() is False
         device.acquire()
@@ -18,6 +86,13 @@ class Board:
         self.logger = Logger(sr_framework.utils.helpers.get_valid_filename(
             self._device.port), colorise=False)
         self._serial = SerialPort(device.port, self.logger)
+        self._urc = self._serial.serial_urc_subscribe(self.URC_PREFIXES)
+        self._identity_cache = {}
+        # payloads returned as lists of ints (see set_list_payloads).
+        self._list_payloads = False
+        # states changed since the last reset (see dirty_state).
+        self._dirty = set()
+        self._clean_urc_count = 0
 
     def __del__(self):
         self.close_serial_port()
@@ -39,6 +114,69 @@ class Board:
         """Returns the device revision string."""
         return self._device.revision
 
+    def set_list_payloads(self, enable):
+        """ Return the payloads received (GATT values, scan raw data, BC Smart data)
+        as lists of ints instead of bytes, for the scripts written for lists. """
+        self._list_payloads = enable
+
+    def _payload(self, data):
+        """ Returns a payload received (bytes-like object) in the type selected
+        by set_list_payloads. """
+        return list(data) if self._list_payloads else bytes(data)
+
+    @staticmethod
+    def _until_size(size, decode):
+        """ Returns the until function (see UrcSubscription.wait_all) completing once
+        size bytes of data are collected, decode being the function returning the
+        data (bytes) of a match. None if size is None. """
+        if size is None:
+            return None
+        return lambda results: sum(len(decode(result)) for result in results) >= size
+
+    def dirty_state(self):
+        """ Returns the fingerprint of the changes since the last reset: frozenset of
+        the names of the states changed by the methods of the board (e.g. 'gpio',
+        'advertising', 'sessions', 'gatt_database'), and 'events' if unsolicited
+        events have been received (e.g. connection of a remote device).
+        Empty if the board is in the state of the last reset. """
+        dirty = set(self._dirty)
+        if self._urc.count != self._clean_urc_count:
+            dirty.add('events')
+        return frozenset(dirty)
+
+    def _mark_clean(self):
+        self._dirty.clear()
+        self._clean_urc_count = self._urc.count
+
+    def restore_clean_state(self):
+        """ Restore the state of the last reset: nothing to do if the board is clean,
+        stop advertising if it is the only change, reset the board otherwise.
+        Returns True on success. """
+        dirty = self.dirty_state()
+        if not dirty:
+            return True
+        if dirty == {'advertising'} and self.ble_set_advertising_enable(False):
+            self._mark_clean()
+            return True
+        return self.common_reset()
+
+    def flush_events(self):
+        """ Discard the unsolicited events received and not waited for yet
+        (e.g. by the previous test sharing a BLE connection). """
+        self._urc.flush()
+
+    def clear_identity_cache(self):
+        """ Read the device identity attributes from the board on the next
+        request (e.g. after a firmware update). """
+        self._identity_cache.clear()
+
+    def _invalidate_identity(self, event):
+        """ Invalidate the identity attributes cached which are invalidated by
+        event (IDENTITY_INVALIDATION). """
+        for name in list(self._identity_cache):
+            if event in self.IDENTITY_INVALIDATION[name]:
+                del self._identity_cache[name]
+
 
     # SERIAL INTERFACE
 
@@ -0,0 +1,93 @@
+#!/usr/bin/python
+
+""" Board group.
+
+This module contains the BoardGroup class, which runs the same operation
+(e.g. open, reset, restore) on several boards concurrently, one thread per
+board, and reports the errors of each board.
+"""
+
+import threading
+
+
+class BoardGroupError(Exception):
+    """ Raised by BoardGroup.run when the operation raised on some boards.
+
+        Attributes:
+            errors (dict): Exception raised, by board.
+    """
+    def __init__(self, errors):
+        self.errors = errors
+        super().__init__('; '.join('%s: %s: %s' % (board.get_device_model(), type(error).__name__,
+                                                     error) for board, error in errors.items()))
+
+
+class BoardGroup:
+    """ Boards operated together (e.g. the DUT and the remote device of a test).
+
+        Usage:
+            boards = BoardGroup([dut, remote])
+            assert all(boards.run(lambda board: board.common_reset()))
+    """
+    def __init__(self, boards):
+        self.boards = list(boards)
+
+    def run(self, function):
+        """ Call function(board) for all the boards concurrently, and wait for them.
+
+        Returns:
+            List of the results, in the order of the boards.
+
+        Raises:
+            BoardGroupError: If function raised on some boards (the other boards
+                are completed).
+        """
+        results = [None] * len(self.boards)
+        errors = {}
+
+        def call(index, board):
+            try:
+                results[index] = function(board)
+            except Exception as error:
+                errors[board] = error
+
+        if len(self.boards) == 1:
+            call(0, self.boards[0])
+        else:
+            threads = [threading.Thread(target=call, args=(index, board),
+                                        name=board.get_device_model())
+                       for index, board in enumerate(self.boards)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        if errors:
+            raise BoardGroupError(errors)
+        return results
+
+    def open_serial_ports(self):
+        """ Open the serial ports of the boards. Returns the list of the results. """
+        return self.run(lambda board: board.open_serial_port())
+
+    def reset(self):
+        """ Reset the boards (common_reset). Returns the list of the results. """
+        return self.run(lambda board: board.common_reset())
+
+    def restore_to_defaults(self):
+        """ Restore the default settings of the boards (common_restore_to_defaults).
+        Returns the list of the results. """
+        return self.run(lambda board: board.common_restore_to_defaults())
+
+    def restore_clean_state(self):
+        """ Restore the state of the last reset of the boards (see
+        Board.restore_clean_state). Returns the list of the results. """
+        return self.run(lambda board: board.restore_clean_state())
+
+    def __iter__(self):
+        return iter(self.boards)
+
+    def __len__(self):
+        return len(self.boards)
+
+    def __getitem__(self, index):
+        return self.boards[index]
@@ -4,12 +4,17 @@
 It contains the Eddington class, which inherits from the Board class
 and implements the common, ble and hw interfaces. """
 
-import time
 import warnings
-from sr_framework.device.board import Board
+from sr_framework.device.board import Board, cached_identity, changes_state, \
+    resets_state, advertising_state
 from sr_framework.device.common import CommonInterface
 from sr_framework.device.ble import BleInterface
+from sr_framework.device.ble_session_cache import BleSessionCache, CachedBleSession
 from sr_framework.device.hw import HWInterface
+from sr_framework.utils.at_command import AtCommandEngine, AtBatch, DEFAULT_PIPELINE_DEPTH, \
+    format_execute, format_query, format_write
+from sr_framework.utils import payload
+from sr_framework.utils.serial_port import SerialSearchCursor
 
 # Eddington end of line character
 EDD_EOL = '\r'
@@ -23,74 +28,110 @@ EDD_RESULT_ERROR = 1
 EDD_RESULT_CME_ERROR = 2
 EDD_RESULT_TIMEOUT = 3
 
+# Result codes of the final result codes returned by _get_final_results
+EDD_FINAL_RESULT_CODES = (EDD_RESULT_SUCCESS, EDD_RESULT_ERROR, EDD_RESULT_CME_ERROR)
+
+# BLE session configuration, e.g. '+SRBLECFG: 1,1,"20:FA:BB:00:01:80",0,23'
+EDD_SESSION_REGEX = r"\+SRBLECFG: (\d+),([0|1]),\"([\w|:]{17})\"(,(\d),(\d+))?"
+
 class Eddington(Board, CommonInterface, BleInterface, HWInterface):
     """
     Eddington Board
     """
 
-    @staticmethod
-    def _convert_escaped_string_to_data(escaped_string):
-        """ Convert "\\00\\01\\02Hello" to [0x00, 0x01, 0x02, 0x48, 0x65, 0x6c, 0x6c, 0x6f]. """
-        result = []
-        i = 0
-        while i < len(escaped_string):
-            if escaped_string[i] == '\\':
-                value = int(escaped_string[i+1:i+3], 16)
-                result.append(value)
-                i += 3
-            else:
-                result.append(ord(escaped_string[i]))
-                i += 1
-        return result
+    URC_PREFIXES = ('+SRBLE_IND', '+SRBLEREAD_REQ', '+SRBLEWRITE_REQ', '+SRBLEWRITE_IND',
+                    '+KGPIO', '+SRBCSMARTRECV', '+SRREMCMD')
+
+    def __init__(self, device):
+        super().__init__(device)
+        self._at = AtCommandEngine(self._serial, EDD_EOL, DEFAULT_COMMAND_TIMEOUT)
+        # transaction of the last command sent, its response is parsed by the callers.
+        self._transaction = None
+        self._sessions = BleSessionCache(self._serial, self._load_sessions)
+        # encoding of the payloads sent (see set_payload_encoding).
+        self._payload_encoding = payload.ENCODING_ESCAPED
 
-    def _get_result_from_response(self, command):
+    @staticmethod
+    def _get_final_results(command):
+        """Returns the prefixes of the final result codes of command, in the
+        EDD_FINAL_RESULT_CODES order."""
         success_string = 'OK' if command != '+RST' else 'Ready'
-        cme_error_string = '+CME'
-        error_string = 'ERROR'
-        timeout = DEFAULT_COMMAND_TIMEOUT
-        while timeout >= 0:
-            if command == '&F':
-                regex = r"(.)"
-                if self._serial.serial_search_regex(regex):
-                    return EDD_RESULT_SUCCESS
-            if self._serial.serial_search_line_startswith(success_string):
-                return EDD_RESULT_SUCCESS
-            if self._serial.serial_search_line_startswith(error_string):
-                return EDD_RESULT_ERROR
-            if self._serial.serial_search_line_startswith(cme_error_string):
-                return EDD_RESULT_CME_ERROR
-            time.sleep(min(0.1, timeout))
-            timeout -= 0.1
-        return EDD_RESULT_TIMEOUT
+        if command == '&F':
+            # any data received means success
+            success_string = ''
+        return (success_string, 'ERROR', '+CME')
+
+    @staticmethod
+    def _get_result_code(transaction):
+        """Returns the result code of an AtTransaction."""
+        if transaction.result is None:
+            return EDD_RESULT_TIMEOUT
+        return EDD_FINAL_RESULT_CODES[transaction.result]
+
+    def _send(self, command, at_command):
+        """Send AT command and wait for its final result code."""
+        self._transaction = self._at.send(at_command, self._get_final_results(command))
+        return self._get_result_code(self._transaction)
 
     def _execute(self, command):
         """Execute AT command."""
-        self._serial.serial_rx_clear()
-        self._serial.serial_write_data('AT{}'.format(command) + EDD_EOL)
-        return self._get_result_from_response(command)
+        return self._send(command, format_execute(command))
 
     def _query(self, command):
         """Read AT command."""
-        self._serial.serial_rx_clear()
-        self._serial.serial_write_data('AT{}'.format(command) + '?' + EDD_EOL)
-        return self._get_result_from_response(command)
+        return self._send(command, format_query(command))
 
     def _write(self, command, args):
         """Write AT command."""
-        self._serial.serial_rx_clear()
-        self._serial.serial_write_data('AT{}={}'.format(command, ','.join(
-            (str(x) if x is not None else '') for x in args)) + EDD_EOL)
-        return self._get_result_from_response(command)
+        return self._send(command, format_write(command, args))
 
     def _custom_command(self, command):
         """Custom command."""
-        self._serial.serial_rx_clear()
-        self._serial.serial_write_data(command + EDD_EOL)
-        return self._get_result_from_response(command)
+        return self._send(command, command)
+
+    def set_payload_encoding(self, encoding):
+        """ Select the encoding of the payloads sent (advertising data, GATT values,
+        BC Smart data): payload.ENCODING_ESCAPED (default, all the bytes escaped)
+        or payload.ENCODING_COMPACT (printable ASCII characters not escaped). """
+        if encoding not in payload.ENCODINGS:
+            raise ValueError('invalid encoding')
+        self._payload_encoding = encoding
+
+    def batch(self, depth=DEFAULT_PIPELINE_DEPTH):
+        """ Returns an AtBatch queuing AT commands, which are sent pipelined when
+        the batch exits (at most depth commands waiting for their result).
+        The results of the batch are EDD_RESULT_* codes, in the order of the commands.
+
+        Usage:
+            with dut.batch() as batch:
+                batch.write('+SRBLEADDSERV', [uuid])
+                batch.query('+SRBLE')
+            assert batch.results == [EDD_RESULT_SUCCESS] * 2
+
+        The commands resetting the board (+RST, &F) can not be sent in a batch
+        (ValueError raised when the batch is sent). The board is not clean after
+        a batch (see dirty_state), and the caches changed by the commands of the
+        batch are invalidated.
+        """
+        return AtBatch(self._at, self._get_final_results, self._get_result_code, depth,
+                       self._prepare_batch_command)
+
+    def _prepare_batch_command(self, command):
+        """Check a command of a batch before it is sent, and invalidate the
+        caches changed by the command (see AtBatch)."""
+        if command in ('+RST', '&F'):
+            # the commands pipelined after a reset would be lost
+            raise ValueError('%s can not be sent in a batch' % command)
+        self._dirty.add('batch')
+        if command in ('+SRBLECFG', '+SRBLEDEL'):
+            self._sessions.invalidate()
+        elif command == '&W':
+            self._invalidate_identity('save')
 
 
     # HW INTERFACE.
 
+    @changes_state('baudrate')
     def hw_set_uart_baudrate(self, new_baudrate):
         """Function defined in HWInterface. """
         command = '+IPR'
@@ -100,6 +141,7 @@ class Eddington(Board, CommonInterface, BleInterface, HWInterface):
             self.set_serial_baudrate(new_baudrate)
         return result
 
+    @changes_state('flow_control')
     def hw_set_uart_flow_control(self, enable):
         """Function defined in HWInterface. """
         command = '&K=3' if enable else '&K=0'
@@ -113,21 +155,25 @@ class Eddington(Board, CommonInterface, BleInterface, HWInterface):
         command = '+IPR'
         if self._query(command) is EDD_RESULT_SUCCESS:
             regex = r"\+IPR: (\d+)"
-            response = self._serial.serial_search_regex(regex)
+            response = self._transaction.search(regex)
             return int(response[0])
         return None
 
+    @changes_state('settings')
     def hw_save_settings(self):
         """Function defined in HWInterface. """
         command = '&W'
+        self._invalidate_identity('save')
         return self._execute(command) is EDD_RESULT_SUCCESS
 
+    @changes_state('gpio')
     def hw_gpio_configure(self, gpio, direction, pull_mode):
         """Function defined in HWInterface. """
         command = '+KGPIOCFG'
         args = [gpio, direction, pull_mode]
         return self._write(command, args) is EDD_RESULT_SUCCESS
 
+    @changes_state('gpio')
     def hw_gpio_write(self, gpio, value):
         """Function defined in HWInterface. """
         if (value > 1) or (value < 0):
@@ -142,13 +188,17 @@ class Eddington(Board, CommonInterface, BleInterface, HWInterface):
         args = [gpio, 2]
         if self._write(command, args) is EDD_RESULT_SUCCESS:
             regex = r"\+KGPIOCFG: (\d+), ([0|1])"
-            return int(self._serial.serial_search_regex(regex)[1])
+            return int(self._transaction.search(regex)[1])
         return 2
 
-    def hw_gpio_wait_for_event(self, gpio, timeout=1):
+    def hw_gpio_wait_for_event(self, gpio, timeout=1, state=None):
         """Function defined in HWInterface. """
         regex = r"\+KGPIO: (\d+), (\d)"
-        result = self._serial.serial_search_regex_all(regex, timeout)
+        until = None
+        if state is not None:
+            event = (str(gpio), str(state))
+            until = lambda results: results[-1] == event
+        result = self._urc.wait_all(regex, timeout, until)
         gpio_list = []
         for res in result:
             gpio_list.append((int(res[0]), int(res[1])))
@@ -156,50 +206,66 @@ class Eddington(Board, CommonInterface, BleInterface, HWInterface):
 
     # COMMON INTERFACE.
 
+    @changes_state('custom')
     def common_send_custom_command(self, command):
         """Function defined in CommonInterface. """
+        # the custom command may change the BLE sessions and the device identity
+        self._sessions.invalidate()
+        self.clear_identity_cache()
         return self._custom_command(command) is EDD_RESULT_SUCCESS
 
+    @resets_state
     def common_reset(self):
         """Function defined in CommonInterface. """
         command = '+RST'
-        return self._execute(command) is EDD_RESULT_SUCCESS
+        self._sessions.invalidate()
+        if self._execute(command) is EDD_RESULT_SUCCESS:
+            self._urc.flush()
+            return True
+        return False
 
+    @cached_identity('supported_command_list')
     def common_get_supported_command_list(self):
         """Function defined in CommonInterface. """
         command = '+CLAC'
         if self._execute(command) is EDD_RESULT_SUCCESS:
-            return self._serial.serial_search_regex_all(r"(AT\+[\w]+)")
+            return self._transaction.search_all(r"(AT\+[\w]+)")
         return None
 
+    @resets_state
     def common_restore_to_defaults(self):
         """Function defined in CommonInterface. """
         # TODO: Clear pairing list
         command = '&F'
+        self._sessions.invalidate()
+        self._invalidate_identity('restore')
         return self._execute(command) is EDD_RESULT_SUCCESS
 
+    @cached_identity('manufacturer_id')
     def common_read_manufacturer_id(self):
         """Function defined in CommonInterface. """
         command = '+FMI'
         if self._execute(command) is EDD_RESULT_SUCCESS:
             regex = r"([\w| ]+)"
-            return self._serial.serial_search_regex(regex)[0]
+            return self._transaction.search(regex)[0]
         return None
 
+    @cached_identity('model_id')
     def common_read_model_id(self):
         """Function defined in CommonInterface. """
         command = '+FMM'
         if self._execute(command) is EDD_RESULT_SUCCESS:
             regex = r"([\w]+)"
-            return self._serial.serial_search_regex(regex)[0]
+            return self._transaction.search(regex)[0]
         return None
 
+    @cached_identity('revision_id')
     def common_read_revision_id(self):
         """Function defined in CommonInterface. """
         command = '+FMR'
         if self._execute(command) is EDD_RESULT_SUCCESS:
             regex = r"([\S]+)"
-            return self._serial.serial_search_regex(regex)[0]
+            return self._transaction.search(regex)[0]
         return None
 
     def common_get_remote_controller(self):
@@ -207,10 +273,11 @@ class Eddington(Board, CommonInterface, BleInterface, HWInterface):
         command = '+SRREMCTRL'
         if self._query(command) is EDD_RESULT_SUCCESS:
             regex = r"\+SRREMCTRL: (\d+)"
-            response = self._serial.serial_search_regex(regex)
+            response = self._transaction.search(regex)
             return int(response[0])
         return None
 
+    @changes_state('remote_controller')
     def common_set_remote_controller(self, session_id):
         """Function defined in CommonInterface. """
         command = '+SRREMCTRL'
@@ -220,71 +287,83 @@ class Eddington(Board, CommonInterface, BleInterface, HWInterface):
 
     # BLE INTERFACE.
 
+    @cached_identity('local_address')
     def ble_get_local_address(self):
         """Function defined in BleInterface. """
         command = '+SRBLEADDR'
         if self._query(command) is EDD_RESULT_SUCCESS:
             regex = r"\+SRBLEADDR: \"([\w|:]{17})\",(\d)"
-            response = self._serial.serial_search_regex(regex)
+            response = self._transaction.search(regex)
             return BleInterface.Bdaddr(response[0], int(response[1]))
         return None
 
+    def _load_sessions(self):
+        """Returns the BLE sessions of the board (list of CachedBleSession), None on failure."""
+        command = '+SRBLECFG'
+        if self._query(command) is EDD_RESULT_SUCCESS:
+            responses = self._transaction.search_all(EDD_SESSION_REGEX)
+            return [CachedBleSession(int(resp[0]), resp[2], int(resp[1]),
+                                     int(resp[5]) if resp[5] else None) for resp in responses]
+        return None
+
+    def ble_refresh_sessions(self):
+        """Reload the BLE sessions from the board (e.g. changed by a remote controller).
+        Returns True on success."""
+        return self._sessions.refresh()
+
+    @changes_state('sessions')
     def ble_create_session(self, bdaddr):
         """Function defined in BleInterface. """
         command = '+SRBLECFG'
         args = ['"' + bdaddr.addr + '"']
         if self._write(command, args) is EDD_RESULT_SUCCESS:
-            regex = r"\+SRBLECFG: (\d+),([0|1]),\"([\w|:]{17})\"(,(\d),(\d+))?"
-            response = self._serial.serial_search_regex(regex)
-            return BleInterface.BleSession(int(response[0]),
+            response = self._transaction.search(EDD_SESSION_REGEX)
+            session_id = int(response[0])
+            self._sessions.update(CachedBleSession(
+                session_id, response[2], int(response[1]),
+                int(response[5]) if response[5] else None))
+            return BleInterface.BleSession(session_id,
                                            BleInterface.Bdaddr(response[2], bdaddr.addr_type))
         return None
 
+    @changes_state('sessions')
     def ble_delete_session(self, session_id):
         """Function defined in BleInterface. """
         command = '+SRBLEDEL'
         args = [session_id]
-        return self._write(command, args) is EDD_RESULT_SUCCESS
+        if self._write(command, args) is EDD_RESULT_SUCCESS:
+            self._sessions.remove(session_id)
+            return True
+        return False
 
     def ble_get_session_id_from_bdaddr(self, bdaddr):
         """Function defined in BleInterface. """
-        command = '+SRBLECFG'
-        if self._query(command) is EDD_RESULT_SUCCESS:
-            regex = r"\+SRBLECFG: (\d+),([0|1]),\"([\w|:]{17})\"(,(\d),(\d+))?"
-            responses = self._serial.serial_search_regex_all(regex)
-            for resp in responses:
-                if resp[2] == bdaddr.addr:
-                    return int(resp[0])
-        return None
+        session = self._sessions.get_by_addr(bdaddr.addr)
+        return session.session_id if session else None
 
     def ble_get_all_sessions(self):
         """Function defined in BleInterface. """
-        command = '+SRBLECFG'
-        if self._query(command) is EDD_RESULT_SUCCESS:
-            regex = r"\+SRBLECFG: (\d+),([0|1]),\"([\w|:]{17})\"(,(\d),(\d+))?"
-            responses = self._serial.serial_search_regex_all(regex)
-            sessions = []
-            for resp in responses:
-                sessions.append(BleInterface.BleSession(int(resp[0]), BleInterface.Bdaddr(
-                    resp[2], BleInterface.LE_BDADDR_TYPE_UNKNOWN)))
-            return sessions
-        return None
+        sessions = self._sessions.sessions()
+        if sessions is None:
+            return None
+        return [BleInterface.BleSession(session.session_id, BleInterface.Bdaddr(
+            session.addr, BleInterface.LE_BDADDR_TYPE_UNKNOWN)) for session in sessions]
 
 
     # BLE GAP interface.
 
+    @changes_state(advertising_state)
     def ble_set_advertising_enable(self, enable, adv_data=None, scan_resp_data=None):
         """Function defined in GapInterface. """
         command = '+SRBLEADV'
         args = [int(enable)]
         if adv_data:
-            args.append('"' + ''.join('\\{:02X}'.format(x)
-                                      for x in adv_data) + '"')
+            args.append(payload.quote(adv_data, self._payload_encoding))
         if scan_resp_data:
-            args.append('"' + ''.join('\\{:02X}'.format(x)
-                                      for x in scan_resp_data) + '"')
+            args.append(payload.quote(scan_resp_data, self._payload_encoding))
         return self._write(command, args) is EDD_RESULT_SUCCESS
 
+    @changes_state('advertising_parameters')
     def ble_set_advertising_parameters(self,
                                        adv_type,
                                        adv_int_min,
@@ -299,6 +378,7 @@ class Eddington(Board, CommonInterface, BleInterface, HWInterface):
             args.append(adv_fp)
         return self._write(command, args) is EDD_RESULT_SUCCESS
 
+    @changes_state('connection_parameters')
     def ble_set_peripheral_preferred_connection_parameters(self,
                                                            min_conn_interval,
                                                            max_conn_interval,
@@ -315,11 +395,20 @@ class Eddington(Board, CommonInterface, BleInterface, HWInterface):
         warnings.warn('Not supported yet.')
         return False
 
+    @changes_state('scan')
+    def ble_scan_iter(self, duration, result_format=BleInterface.SCAN_RESULT_FORMAT_DEFAULT,
+                      stop_when=None):
+        """Function defined in GapInterface. """
+        warnings.warn('Not supported yet.')
+        return iter(())
+
+    @changes_state('scan_parameters')
     def ble_set_scan_parameters(self, scan_type, scan_interval, scan_window):
         """Function defined in GapInterface. """
         warnings.warn('Not supported yet.')
         return False
 
+    @changes_state('sessions')
     def ble_connect(self, session_id, max_attempt=2):
         """Function defined in GapInterface. """
         warnings.warn('Not supported yet.')
@@ -327,12 +416,10 @@ class Eddington(Board, CommonInterface, BleInterface, HWInterface):
 
     def ble_wait_for_connection(self, timeout=10):
         """Function defined in GapInterface. """
-        regex = r"\+SRBLE_IND: (\d),(\d)"
-        response = self._serial.serial_search_regex(regex, timeout)
-        if response and int(response[1]) == 1:
-            return True
-        return False
+        regex = r"\+SRBLE_IND: (\d+),(1)"
+        return self._urc.wait(regex, timeout) is not None
 
+    @changes_state('sessions')
     def ble_disconnect(self, session_id):
         """Function defined in GapInterface. """
         command = '+SRBLECLOSE'
@@ -344,43 +431,31 @@ class Eddington(Board, CommonInterface, BleInterface, HWInterface):
     def ble_wait_for_disconnection(self, session_id, timeout=5):
         """Function defined in GapInterface. """
         regex = r"\+SRBLE_IND: (%d),(0),(\d+)" % session_id
-        response = self._serial.serial_search_regex(regex, timeout)
+        response = self._urc.wait(regex, timeout)
         return True if response else False
 
     def ble_is_connected(self, session_id):
         """Function defined in GapInterface. """
-        command = '+SRBLECFG'
-        if self._query(command) is EDD_RESULT_SUCCESS:
-            regex = r"\+SRBLECFG: (\d+),([0|1]),\"([\w|:]{17})\"(,(\d),(\d+))?"
-            responses = self._serial.serial_search_regex_all(regex)
-            for resp in responses:
-                if int(resp[0]) == session_id:
-                    return int(resp[1])
-        return None
+        session = self._sessions.get(session_id)
+        return session.connected if session else None
 
 
     # BLE GATT interface.
 
+    @cached_identity('local_mtu_size')
     def ble_get_local_mtu_size(self):
         """Function defined in GattInterface. """
         command = '+SRBLE'
         if self._query(command) is EDD_RESULT_SUCCESS:
             regex = r"\+SRBLE: \"(\w+)\",(\d+),(\d)"
-            response = self._serial.serial_search_regex(regex)
+            response = self._transaction.search(regex)
             if response:
                 return int(response[1])
         return None
 
     def ble_get_exchanged_mtu_size(self, session_id):
         """Function defined in GattInterface. """
-        command = '+SRBLECFG'
-        if self._query(command) is EDD_RESULT_SUCCESS:
-            regex = r"\+SRBLECFG: (\d+),([0|1]),\"([\w|:]{17})\"(,(\d),(\d+))?"
-            responses = self._serial.serial_search_regex_all(regex)
-            for resp in responses:
-                if int(resp[0]) == session_id:
-                    return int(resp[5])
-        return None
+        return self._sessions.get_mtu(session_id)
 
     def ble_gatt_discover_all_primary_services(self, session_id):
         """Function defined in GattInterface. """
@@ -392,6 +467,7 @@ class Eddington(Board, CommonInterface, BleInterface, HWInterface):
         warnings.warn('Not supported yet.')
         return False
 
+    @changes_state('gatt_database')
     def ble_gatt_add_service(self, serv_uuid, is_primary=1):
         """Function defined in GattInterface. """
         command = '+SRBLEADDSERV'
@@ -399,6 +475,7 @@ class Eddington(Board, CommonInterface, BleInterface, HWInterface):
                 is_primary]
         return self._write(command, args) is EDD_RESULT_SUCCESS
 
+    @changes_state('gatt_database')
     def ble_gatt_add_characteristic(self,
                                     char_uuid,
                                     properties,
@@ -413,10 +490,10 @@ class Eddington(Board, CommonInterface, BleInterface, HWInterface):
                 '{:02X}'.format(permissions),
                 max_attribute_length,
                 variable_length,
-                '"' + ''.join('\\{:02X}'.format(x)
-                              for x in attribute_value) + '"']
+                payload.quote(attribute_value, self._payload_encoding)]
         return self._write(command, args) is EDD_RESULT_SUCCESS
 
+    @changes_state('gatt_database')
     def ble_gatt_add_characteristic_descriptor(
             self,
             char_desc_uuid,
@@ -430,20 +507,21 @@ class Eddington(Board, CommonInterface, BleInterface, HWInterface):
                 '{:02X}'.format(permissions),
                 max_attribute_length,
                 variable_length,
-                '"' + ''.join('\\{:02X}'.format(x)
-                              for x in attribute_value) + '"']
+                payload.quote(attribute_value, self._payload_encoding)]
         return self._write(command, args) is EDD_RESULT_SUCCESS
 
+    @changes_state('gatt_database')
     def ble_gatt_profile_setup(self, accept):
         """Function defined in GattInterface. """
         command = '+SRBLEPROFILESETUP'
         args = [accept]
         if self._write(command, args) is EDD_RESULT_SUCCESS:
             regex = r"\+SRBLEPROFILESETUP: (\d+),?(\d+)?"
-            responses = self._serial.serial_search_regex_all(regex)
+            responses = self._transaction.search_all(regex)
             return responses
         return None
 
+    @changes_state('gatt')
     def ble_gatt_read_request(self, session_id, handle):
         """Function defined in GattInterface. """
         warnings.warn('Not supported yet.')
@@ -453,9 +531,9 @@ class Eddington(Board, CommonInterface, BleInterface, HWInterface):
                                        timeout=5):
         """Function defined in GattInterface. """
         regex = r"\+SRBLEREAD_REQ: %d,%d" % (session_id, handle)
-        return\
-            self._serial.serial_search_regex(regex, timeout) is not None
+        return self._urc.wait(regex, timeout) is not None
 
+    @changes_state('gatt')
     def ble_gatt_read_response(self,
                                session_id,
                                handle,
@@ -466,8 +544,7 @@ class Eddington(Board, CommonInterface, BleInterface, HWInterface):
         command = '+SRBLEREADRESP'
         args = [session_id, handle, '{:d}'.format(accept),]
         if accept:
-            args.append('"' + ''.join('\\{:02X}'.format(x)
-                                      for x in value) + '"')
+            args.append(payload.quote(value, self._payload_encoding))
             args.append(offset)
         return self._write(command, args) is EDD_RESULT_SUCCESS
 
@@ -476,6 +553,7 @@ class Eddington(Board, CommonInterface, BleInterface, HWInterface):
         warnings.warn('Not supported yet.')
         return False
 
+    @changes_state('gatt')
     def ble_gatt_write_request(self, session_id, handle, value, need_rsp):
         """Function defined in GattInterface. """
         warnings.warn('Not supported yet.')
@@ -485,14 +563,15 @@ class Eddington(Board, CommonInterface, BleInterface, HWInterface):
         """Function defined in GattInterface. """
         regex = r"\+SRBLEWRITE_(REQ|IND): %d,%d,(\d+),(\d+),\"(.+)\"" % (
             session_id, handle)
-        response = self._serial.serial_search_regex(regex, timeout)
+        response = self._urc.wait(regex, timeout)
         if response:
             offset = int(response[1])
-            value = Eddington._convert_escaped_string_to_data(response[3])
+            value = self._payload(payload.unescape(response[3]))
             need_rsp = True if response[0] == 'REQ' else False
             return BleInterface.GattWriteReq(session_id, handle, offset, value, need_rsp)
         return None
 
+    @changes_state('gatt')
     def ble_gatt_write_response(self, session_id, handle, accept):
         """Function defined in GattInterface. """
         command = '+SRBLEWRITERESP'
@@ -504,11 +583,11 @@ class Eddington(Board, CommonInterface, BleInterface, HWInterface):
         warnings.warn('Not supported yet.')
         return False
 
+    @changes_state('gatt')
     def ble_gatt_notification_request(self, session_id, handle, value):
         """Function defined in GattInterface. """
         command = '+SRBLENOTIFY'
-        args = [session_id, handle, '"' +
-                ''.join('\\{:02X}'.format(x) for x in value) + '"']
+        args = [session_id, handle, payload.quote(value, self._payload_encoding)]
         return self._write(command, args) is EDD_RESULT_SUCCESS
 
     def ble_gatt_wait_for_notification(self, session_id, handle, timeout=5):
@@ -516,11 +595,11 @@ class Eddington(Board, CommonInterface, BleInterface, HWInterface):
         warnings.warn('Not supported.')
         return False
 
+    @changes_state('gatt')
     def ble_gatt_indication_request(self, session_id, handle, value):
         """Function defined in GattInterface. """
         command = '+SRBLEINDICATE'
-        args = [session_id, handle, '"' +
-                ''.join('\\{:02X}'.format(x) for x in value) + '"']
+        args = [session_id, handle, payload.quote(value, self._payload_encoding)]
         return self._write(command, args) is EDD_RESULT_SUCCESS
 
     def ble_gatt_wait_for_indication(self, session_id, handle, timeout=5):
@@ -528,6 +607,7 @@ class Eddington(Board, CommonInterface, BleInterface, HWInterface):
         warnings.warn('Not supported.')
         return False
 
+    @changes_state('gatt')
     def ble_gatt_indication_response(self, session_id, handle):
         """Function defined in GattInterface. """
         # automatically sent by Eddington
@@ -536,54 +616,58 @@ class Eddington(Board, CommonInterface, BleInterface, HWInterface):
     def ble_gatt_wait_for_indication_response(self, session_id, handle, timeout=5):
         """Function defined in GattInterface. """
         regex = "OK"
-        return self._serial.serial_search_regex(regex, timeout) is not None
+        # search the data received since the last command was sent
+        start = self._transaction.start if self._transaction else 0
+        cursor = SerialSearchCursor(overlap=0, line=start)
+        return self._serial.serial_search_regex(regex, timeout, cursor) is not None
 
 
     # BLE BC Smart interface.
 
+    @changes_state('bc_smart')
     def bc_smart_server_send_data(self, session_id, data):
         """Function defined in BcSmartInterface. """
         command = '+SRBCSMARTSEND'
         warnings.warn('TODO: update gatt role param (EDDINGTON-132).')
-        args = [session_id, 1, '"' +
-                ''.join('\\{:02X}'.format(x) for x in data) + '"']
+        args = [session_id, 1, payload.quote(data, self._payload_encoding)]
         return self._write(command, args) is EDD_RESULT_SUCCESS
 
-    def bc_smart_server_wait_for_data(self, session_id, timeout=2):
+    def bc_smart_server_wait_for_data(self, session_id, timeout=2, size=None, quiet=None):
         """Function defined in BcSmartInterface. """
         regex = r"\+SRBCSMARTRECV: (%d),(%d),\"(.+)\"" % (session_id, 0)
-        responses = self._serial.serial_search_regex_all(regex, timeout)
+        until = self._until_size(size, lambda resp: payload.unescape(resp[2]))
+        responses = self._urc.wait_all(regex, timeout, until, quiet)
         if responses:
-            result = []
-            for resp in responses:
-                result += Eddington._convert_escaped_string_to_data(resp[2])
-            return result
+            return self._payload(b''.join(payload.unescape(resp[2]) for resp in responses))
         return None
 
     def bc_smart_server_wait_for_command(self, session_id, timeout=2):
         """Function defined in BcSmartInterface. """
         regex = r"\+SRREMCMD: \"(.+)\""
-        response = self._serial.serial_search_regex(regex, timeout)
+        response = self._urc.wait(regex, timeout)
         if response:
             return response[0]
         return None
 
+    @changes_state('bc_smart')
     def bc_smart_client_send_data(self, session_id, data):
         """Function defined in BcSmartInterface. """
         warnings.warn('Not supported.')
         return False
 
-    def bc_smart_client_wait_for_client_data(self, session_id, timeout=2):
+    def bc_smart_client_wait_for_client_data(self, session_id, timeout=2, size=None,
+                                             quiet=None):
         """Function defined in BcSmartInterface. """
         warnings.warn('Not supported.')
         return False
 
+    @changes_state('bc_smart')
     def bc_smart_client_send_command(self, session_id, command):
         """Function defined in BcSmartInterface. """
         warnings.warn('Not supported.')
         return False
 
-    def bc_smart_client_wait_for_command_response(self, session_id, timeout=5):
+    def bc_smart_client_wait_for_command_response(self, session_id, timeout=5, quiet=None):
         """Function defined in BcSmartInterface. """
         warnings.warn('Not supported.')
         return False
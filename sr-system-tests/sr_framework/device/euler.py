@@ -6,9 +6,17 @@ and implements the common and ble interfaces. """
 
 import time
 import warnings
-from sr_framework.device.board import Board
+from sr_framework.device.board import Board, cached_identity, changes_state, \
+    resets_state, advertising_state
 from sr_framework.device.common import CommonInterface
 from sr_framework.device.ble import BleInterface
+from sr_framework.device.ble_session_cache import BleSessionCache, CachedBleSession
+from sr_framework.device.gatt_cache import GattDiscoveryCache, ATTRIBUTE_CHARACTERISTIC
+from sr_framework.utils.at_command import AtCommandEngine, AtBatch, DEFAULT_PIPELINE_DEPTH, \
+    format_execute, format_query, format_write
+from sr_framework.utils import payload
+from sr_framework.utils.rx_buffer import compile_regex, decode_groups
+from sr_framework.utils.serial_port import SerialSearchCursor
 
 # Euler end of line character
 EUL_EOL = '\r'
@@ -22,6 +30,16 @@ EUL_RESULT_ERROR = 1
 EUL_RESULT_DEFAULT_ERROR = 2
 EUL_RESULT_TIMEOUT = 3
 
+# Result codes of the final result codes returned by _get_final_results
+EUL_FINAL_RESULT_CODES = (EUL_RESULT_SUCCESS, EUL_RESULT_ERROR, EUL_RESULT_DEFAULT_ERROR)
+
+# BLE session configuration, e.g. '+SRBLECFG: 1,1,"20:fa:bb:00:01:80",23'
+EUL_SESSION_REGEX = r"\+SRBLECFG: (\d+),([0|1]),\"([\w|:]{17})\",(\d+)"
+
+# Scan results (AT+SRBLESCAN), default and raw data formats
+EUL_SCAN_REGEX = r"\"([\w|:]{17})\",([0|1]),-(\d+),(\d+)(,\"(.+)\")?"
+EUL_SCAN_RAW_REGEX = r"\"([\w|:]{17})\",([0|1]),-(\d+),\"((\\[0-9A-F]{2})+)\""
+
 EUL_BLE_GATT_SERV_HANDLE_OFFSET = 50
 EUL_BLE_GATT_SERV_HANDLE_RANGE = 100
 
@@ -31,20 +49,9 @@ class Euler(Board, CommonInterface, BleInterface):
     Euler Board
     """
 
-    @staticmethod
-    def _convert_escaped_string_to_data(escaped_string):
-        """ Convert "\\00\\01\\02Hello" to [0x00, 0x01, 0x02, 0x48, 0x65, 0x6c, 0x6c, 0x6f]. """
-        result = []
-        i = 0
-        while i < len(escaped_string):
-            if escaped_string[i] == '\\':
-                value = int(escaped_string[i+1:i+3], 16)
-                result.append(value)
-                i += 3
-            else:
-                result.append(ord(escaped_string[i]))
-                i += 1
-        return result
+    URC_PREFIXES = ('+SRBLE_IND', '+SRBLEREAD', '+SRBLEREADCHAR', '+SRBLEWRITE',
+                    '+SRBLENOTIFICATION', '+SRBLEINDICATION', '+SRBCSMARTRECV',
+                    '+SRBCSMARTRSP', '+SRREMCMD')
 
     @staticmethod
     def _convert_euler_address_to_standard(addr):
@@ -54,38 +61,118 @@ class Euler(Board, CommonInterface, BleInterface):
     def _convert_standard_address_to_euler(addr):
         return addr.lower()
 
-    def _get_result_from_response(self, command, timeout=DEFAULT_COMMAND_TIMEOUT):
+    def __init__(self, device):
+        super().__init__(device)
+        self._at = AtCommandEngine(self._serial, EUL_EOL, DEFAULT_COMMAND_TIMEOUT)
+        # transaction of the last command sent, its response is parsed by the callers.
+        self._transaction = None
+        self._sessions = BleSessionCache(self._serial, self._load_sessions)
+        # encoding of the payloads sent (see set_payload_encoding).
+        self._payload_encoding = payload.ENCODING_ESCAPED
+        # True once the bluetooth feature is enabled, None if unknown (e.g. after a reset).
+        self._bluetooth_enabled = None
+        self._gatt_cache = GattDiscoveryCache(
+            self._serial, ('+SRBLE_IND', '+SRBLEINDICATION'),
+            r"\+SRBLE(_IND|INDICATION): (\d+),(\d+)", self._parse_gatt_cache_event)
+        # (transaction, end) of a scan stopped early by ble_scan_iter, None if none.
+        self._scan = None
+
+    def _parse_gatt_cache_event(self, groups):
+        """Returns (peer address, indication handle) of a GattDiscoveryCache event."""
+        session = self._sessions.get(int(groups[1]))
+        addr = session.addr if session else None
+        return addr, int(groups[2]) if groups[0] == 'INDICATION' else None
+
+    def _gatt_database(self, session_id):
+        """Returns the DiscoveredDatabase of the peer of session_id, None if unknown."""
+        session = self._sessions.get(session_id)
+        return self._gatt_cache.database(session.addr) if session else None
+
+    @staticmethod
+    def _get_final_results(command):
+        """Returns the prefixes of the final result codes of command, in the
+        EUL_FINAL_RESULT_CODES order."""
         success_string = 'OK' if (command not in ['+RST', '&F']) else 'READY'
-        error_string = '+CME ERROR'
-        while timeout >= 0:
-            if self._serial.serial_search_line_startswith(success_string):
-                return EUL_RESULT_SUCCESS
-            if self._serial.serial_search_line_startswith(error_string):
-                return EUL_RESULT_ERROR
-            if self._serial.serial_search_line_startswith('ERROR'):
-                return EUL_RESULT_DEFAULT_ERROR
-            time.sleep(min(0.1, timeout))
-            timeout -= 0.1
-        return EUL_RESULT_TIMEOUT
+        return (success_string, '+CME ERROR', 'ERROR')
+
+    @staticmethod
+    def _get_result_code(transaction):
+        """Returns the result code of an AtTransaction."""
+        if transaction.result is None:
+            return EUL_RESULT_TIMEOUT
+        return EUL_FINAL_RESULT_CODES[transaction.result]
+
+    def _wait_scan_complete(self):
+        """Wait for the final result code of a scan stopped early by ble_scan_iter,
+        so that it is not taken for the final result code of the next command."""
+        scan, self._scan = self._scan, None
+        if scan:
+            transaction, end = scan
+            self._at.read_response(transaction, self._get_final_results('+SRBLESCAN'),
+                                   max(end - time.monotonic(), 0))
+
+    def _send(self, command, at_command, timeout):
+        """Send AT command and wait for its final result code."""
+        if command in ['+RST', '&F']:
+            # the scan is stopped by the reset
+            self._scan = None
+        else:
+            self._wait_scan_complete()
+        self._transaction = self._at.send(at_command, self._get_final_results(command), timeout)
+        return self._get_result_code(self._transaction)
 
     def _execute(self, command, timeout=DEFAULT_COMMAND_TIMEOUT):
         """Execute AT command."""
-        self._serial.serial_rx_clear()
-        self._serial.serial_write_data('AT{}'.format(command) + EUL_EOL)
-        return self._get_result_from_response(command, timeout)
+        return self._send(command, format_execute(command), timeout)
 
     def _query(self, command, timeout=DEFAULT_COMMAND_TIMEOUT):
         """Read AT command."""
-        self._serial.serial_rx_clear()
-        self._serial.serial_write_data('AT{}'.format(command) + '?' + EUL_EOL)
-        return self._get_result_from_response(command, timeout)
+        return self._send(command, format_query(command), timeout)
 
     def _write(self, command, args, timeout=DEFAULT_COMMAND_TIMEOUT):
         """Write AT command."""
-        self._serial.serial_rx_clear()
-        self._serial.serial_write_data('AT{}={}'.format(command, ','.join(
-            (str(x) if x is not None else '') for x in args)) + EUL_EOL)
-        return self._get_result_from_response(command, timeout)
+        return self._send(command, format_write(command, args), timeout)
+
+    def set_payload_encoding(self, encoding):
+        """ Select the encoding of the payloads sent (advertising data, GATT values,
+        BC Smart data): payload.ENCODING_ESCAPED (default, all the bytes escaped)
+        or payload.ENCODING_COMPACT (printable ASCII characters not escaped). """
+        if encoding not in payload.ENCODINGS:
+            raise ValueError('invalid encoding')
+        self._payload_encoding = encoding
+
+    def batch(self, depth=DEFAULT_PIPELINE_DEPTH):
+        """ Returns an AtBatch queuing AT commands, which are sent pipelined when
+        the batch exits (at most depth commands waiting for their result).
+        The results of the batch are EUL_RESULT_* codes, in the order of the commands.
+
+        Usage:
+            with dut.batch() as batch:
+                batch.write('+SRBLEADDSERV', [uuid])
+                batch.query('+SRBLE')
+            assert batch.results == [EUL_RESULT_SUCCESS] * 2
+
+        The commands resetting the board (+RST, &F) can not be sent in a batch
+        (ValueError raised when the batch is sent). The board is not clean after
+        a batch (see dirty_state), and the caches changed by the commands of the
+        batch are invalidated.
+        """
+        self._wait_scan_complete()
+        return AtBatch(self._at, self._get_final_results, self._get_result_code, depth,
+                       self._prepare_batch_command)
+
+    def _prepare_batch_command(self, command):
+        """Check a command of a batch before it is sent, and invalidate the
+        caches changed by the command (see AtBatch)."""
+        if command in ('+RST', '&F'):
+            # the commands pipelined after a reset would be lost
+            raise ValueError('%s can not be sent in a batch' % command)
+        self._dirty.add('batch')
+        if command in ('+SRBLECFG', '+SRBLEDEL'):
+            self._sessions.invalidate()
+            self._gatt_cache.invalidate()
+        elif command == '+SRBTSYSTEM':
+            self._bluetooth_enabled = None
 
     def _get_serv_handle_from_char_handle(self, char_handle):
         """Derives the service handle value from the characteristic handle value
@@ -101,51 +188,76 @@ class Euler(Board, CommonInterface, BleInterface):
         """Get transfer id from the last read request notification
         """
         regex = r"\+SRBLEREAD: %d,(\d+),%d" % (session_id, handle)
-        response = self._serial.serial_search_regex(regex, timeout)
+        response = self._urc.wait(regex, timeout)
         if response:
             return int(response[0])
         return None
 
     def _is_a_characteristic(self, session_id, handle):
         """Return True if the handle belongs to a characteristic, False otherwise
+        The characteristics are discovered once per connection (GattDiscoveryCache).
         """
         chars = self.ble_gatt_discover_all_characteristics(session_id)
-        for char in chars:
-            if char.handle == handle:
-                return True
-        return False
+        if chars is None:
+            return False
+        database = self._gatt_database(session_id)
+        if database is None:
+            # session not in the session cache: characteristics not cached
+            return any(char.handle == handle for char in chars)
+        return database.attribute_type(handle) == ATTRIBUTE_CHARACTERISTIC
 
     def _enable_bluetooth(self):
         """Enable the bluetooth feature if necessary
         Return True if successful and false otherwise
+        The board is only queried when the bluetooth state is unknown.
         """
+        if self._bluetooth_enabled:
+            return True
         command = '+SRBTSYSTEM'
         if self._query(command) is EUL_RESULT_SUCCESS:
             regex = r"\+SRBTSYSTEM: (1)"
-            if self._serial.serial_search_regex(regex):
+            if self._transaction.search(regex):
+                self._bluetooth_enabled = True
+                return True
+            # enabled since the last reset: not the state of the reset anymore
+            self._dirty.add('bluetooth')
+            if self._write('+SRBTSYSTEM', [1]) is EUL_RESULT_SUCCESS:
+                self._bluetooth_enabled = True
                 return True
-            return self._write('+SRBTSYSTEM', [1]) is EUL_RESULT_SUCCESS
         return False
 
 
     # COMMON INTERFACE.
 
+    @resets_state
     def common_reset(self):
         """Function defined in CommonInterface. """
         command = '+RST'
-        return self._execute(command) is EUL_RESULT_SUCCESS
+        self._sessions.invalidate()
+        self._gatt_cache.invalidate()
+        self._bluetooth_enabled = None
+        if self._execute(command) is EUL_RESULT_SUCCESS:
+            self._urc.flush()
+            return True
+        return False
 
+    @cached_identity('supported_command_list')
     def common_get_supported_command_list(self):
         """Function defined in CommonInterface. """
         command = '+CLAC'
         if self._execute(command) is EUL_RESULT_SUCCESS:
             regex = r"(AT\+[\w]+)"
-            return self._serial.serial_search_regex_all(regex)
+            return self._transaction.search_all(regex)
         return None
 
+    @resets_state
     def common_restore_to_defaults(self):
         """Function defined in CommonInterface. """
         command = '&F'
+        self._sessions.invalidate()
+        self._gatt_cache.invalidate()
+        self._bluetooth_enabled = None
+        self._invalidate_identity('restore')
         # FIXME EULER-607
         # "READY" is printed before the device is actually ready.
         # Workaround: sleep for a few seconds to make sure the device is ready.
@@ -153,28 +265,31 @@ class Euler(Board, CommonInterface, BleInterface):
         time.sleep(3)
         return res is EUL_RESULT_SUCCESS
 
+    @cached_identity('manufacturer_id')
     def common_read_manufacturer_id(self):
         """Function defined in CommonInterface. """
         command = '+FMI'
         if self._execute(command) is EUL_RESULT_SUCCESS:
             regex = r"([\w| ]+)"
-            return self._serial.serial_search_regex(regex)[0]
+            return self._transaction.search(regex)[0]
         return None
 
+    @cached_identity('model_id')
     def common_read_model_id(self):
         """Function defined in CommonInterface. """
         command = '+FMM'
         if self._execute(command) is EUL_RESULT_SUCCESS:
             regex = r"([\w]+)"
-            return self._serial.serial_search_regex(regex)[0]
+            return self._transaction.search(regex)[0]
         return None
 
+    @cached_identity('revision_id')
     def common_read_revision_id(self):
         """Function defined in CommonInterface. """
         command = '+FMR'
         if self._execute(command) is EUL_RESULT_SUCCESS:
             regex = r"([\S]+)"
-            return self._serial.serial_search_regex(regex)[0]
+            return self._transaction.search(regex)[0]
         return None
 
     def common_get_remote_controller(self):
@@ -182,10 +297,11 @@ class Euler(Board, CommonInterface, BleInterface):
         command = '+SRREMCTRL'
         if self._query(command) is EUL_RESULT_SUCCESS:
             regex = r"\+SRREMCTRL: (\d+)"
-            response = self._serial.serial_search_regex(regex)
+            response = self._transaction.search(regex)
             return int(response[0])
         return None
 
+    @changes_state('remote_controller')
     def common_set_remote_controller(self, session_id):
         """Function defined in CommonInterface. """
         command = '+SRREMCTRL'
@@ -195,6 +311,7 @@ class Euler(Board, CommonInterface, BleInterface):
 
     # BLE INTERFACE.
 
+    @cached_identity('local_address')
     def ble_get_local_address(self):
         """Function defined in BleInterface. """
         if not self._enable_bluetooth():
@@ -202,11 +319,29 @@ class Euler(Board, CommonInterface, BleInterface):
         command = '+SRBTADDR'
         if self._query(command) is EUL_RESULT_SUCCESS:
             regex = r"\+SRBTADDR: \"([\w|:]{17})\""
-            response = self._serial.serial_search_regex(regex)
+            response = self._transaction.search(regex)
             return BleInterface.Bdaddr(Euler._convert_euler_address_to_standard(
                 response[0]), BleInterface.LE_BDADDR_TYPE_PUBLIC)
         return None
 
+    def _load_sessions(self):
+        """Returns the BLE sessions of the board (list of CachedBleSession), None on failure."""
+        command = '+SRBLECFG'
+        if self._query(command) is EUL_RESULT_SUCCESS:
+            responses = self._transaction.search_all(EUL_SESSION_REGEX)
+            return [CachedBleSession(int(resp[0]),
+                                     Euler._convert_euler_address_to_standard(resp[2]),
+                                     int(resp[1]), int(resp[3])) for resp in responses]
+        return None
+
+    def ble_refresh_sessions(self):
+        """Reload the BLE sessions from the board (e.g. changed by a remote controller).
+        Returns True on success."""
+        if not self._enable_bluetooth():
+            return False
+        return self._sessions.refresh()
+
+    @changes_state('sessions')
     def ble_create_session(self, bdaddr):
         """Function defined in BleInterface. """
         if not self._enable_bluetooth():
@@ -216,53 +351,48 @@ class Euler(Board, CommonInterface, BleInterface):
         if self._write(command, args) is EUL_RESULT_SUCCESS:
             regex = r"\+SRBLECFG: (\d+),([0|1]),\"(%s)\",(\d+)" % (
                 Euler._convert_standard_address_to_euler(bdaddr.addr))
-            response = self._serial.serial_search_regex(regex)
+            response = self._transaction.search(regex)
+            addr = Euler._convert_euler_address_to_standard(response[2])
+            self._sessions.update(CachedBleSession(int(response[0]), addr, int(response[1]),
+                                                   int(response[3])))
             return BleInterface.BleSession(
-                int(response[0]), BleInterface.Bdaddr(
-                    Euler._convert_euler_address_to_standard(response[2]),
-                    bdaddr.addr_type))
+                int(response[0]), BleInterface.Bdaddr(addr, bdaddr.addr_type))
         return None
 
+    @changes_state('sessions')
     def ble_delete_session(self, session_id):
         """Function defined in BleInterface. """
         if not self._enable_bluetooth():
             return False
         command = '+SRBLEDEL'
         args = [session_id]
-        return self._write(command, args) is EUL_RESULT_SUCCESS
+        if self._write(command, args) is EUL_RESULT_SUCCESS:
+            self._sessions.remove(session_id)
+            return True
+        return False
 
     def ble_get_session_id_from_bdaddr(self, bdaddr):
         """Function defined in BleInterface. """
         if not self._enable_bluetooth():
             return None
-        command = '+SRBLECFG'
-        if self._query(command) is EUL_RESULT_SUCCESS:
-            regex = r"\+SRBLECFG: (\d+),([0|1]),\"(%s)\",(\d+)" % (
-                Euler._convert_standard_address_to_euler(bdaddr.addr))
-            response = self._serial.serial_search_regex(regex)
-            if response:
-                return int(response[0])
-        return None
+        session = self._sessions.get_by_addr(
+            Euler._convert_euler_address_to_standard(bdaddr.addr))
+        return session.session_id if session else None
 
     def ble_get_all_sessions(self):
         """Function defined in BleInterface. """
         if not self._enable_bluetooth():
             return None
-        command = '+SRBLECFG'
-        if self._query(command) is EUL_RESULT_SUCCESS:
-            regex = r"\+SRBLECFG: (\d+),([0|1]),\"([\w|:]{17})\",(\d+)"
-            sessions = []
-            responses = self._serial.serial_search_regex_all(regex)
-            for resp in responses:
-                sessions.append(BleInterface.BleSession(int(resp[0]), BleInterface.Bdaddr(
-                    Euler._convert_euler_address_to_standard(resp[2]),
-                    BleInterface.LE_BDADDR_TYPE_UNKNOWN)))
-            return sessions
-        return None
+        sessions = self._sessions.sessions()
+        if sessions is None:
+            return None
+        return [BleInterface.BleSession(session.session_id, BleInterface.Bdaddr(
+            session.addr, BleInterface.LE_BDADDR_TYPE_UNKNOWN)) for session in sessions]
 
 
     # BLE GAP interface.
 
+    @changes_state(advertising_state)
     def ble_set_advertising_enable(self, enable, adv_data=None, scan_resp_data=None):
         """Function defined in GapInterface. """
         if not self._enable_bluetooth():
@@ -270,13 +400,12 @@ class Euler(Board, CommonInterface, BleInterface):
         command = '+SRBLEADV'
         args = [int(enable)]
         if adv_data:
-            args.append('"' + ''.join('\\{:02X}'.format(x)
-                                      for x in adv_data) + '"')
+            args.append(payload.quote(adv_data, self._payload_encoding))
         if scan_resp_data:
-            args.append('"' + ''.join('\\{:02X}'.format(x)
-                                      for x in scan_resp_data) + '"')
+            args.append(payload.quote(scan_resp_data, self._payload_encoding))
         return self._write(command, args) is EUL_RESULT_SUCCESS
 
+    @changes_state('advertising_parameters')
     def ble_set_advertising_parameters(
             self, adv_type, adv_int_min, adv_int_max, adv_timeout, adv_fp=0):
         """Function defined in GapInterface. """
@@ -288,42 +417,80 @@ class Euler(Board, CommonInterface, BleInterface):
         args = [adv_int_min, adv_int_max, adv_type]
         return self._write(command, args) is EUL_RESULT_SUCCESS
 
+    @changes_state('connection_parameters')
     def ble_set_peripheral_preferred_connection_parameters(
             self, min_conn_interval, max_conn_interval, conn_latency, supervision_timeout):
         """Function defined in GapInterface. """
         warnings.warn('Not supported.')
         return False
 
+    def _scan_result(self, groups):
+        """Returns the ScanResult of the EUL_SCAN_REGEX groups."""
+        return BleInterface.ScanResult(Euler._convert_euler_address_to_standard(groups[0]),
+                                       int(groups[1]),
+                                       int(groups[2]),
+                                       int(groups[3]),
+                                       groups[4])
+
+    def _scan_raw_result(self, groups):
+        """Returns the ScanRawResult of the EUL_SCAN_RAW_REGEX groups."""
+        return BleInterface.ScanRawResult(Euler._convert_euler_address_to_standard(groups[0]),
+                                          int(groups[1]),
+                                          int(groups[2]),
+                                          self._payload(payload.unescape(groups[3])))
+
+    def _scan_format(self, result_format):
+        """Returns (regex, parse function) of the scan results in result_format."""
+        if result_format == BleInterface.SCAN_RESULT_FORMAT_DEFAULT:
+            return EUL_SCAN_REGEX, self._scan_result
+        if result_format == BleInterface.SCAN_RESULT_FORMAT_RAW_DATA:
+            return EUL_SCAN_RAW_REGEX, self._scan_raw_result
+        raise ValueError('invalid result_format')
+
     def ble_scan(self, duration, result_format=BleInterface.SCAN_RESULT_FORMAT_DEFAULT):
         """ Function defined in GapInterface. """
+        regex, parse = self._scan_format(result_format)
         if not self._enable_bluetooth():
             return None
         command = '+SRBLESCAN'
         args = [duration, int(result_format)]
-        if result_format == BleInterface.SCAN_RESULT_FORMAT_DEFAULT:
-            if self._write(command, args, duration * 2) is EUL_RESULT_SUCCESS:
-                regex = r"\"([\w|:]{17})\",([0|1]),-(\d+),(\d+)(,\"(.+)\")?"
-                responses = self._serial.serial_search_regex_all(regex)
-                return [BleInterface.ScanResult(Euler._convert_euler_address_to_standard(resp[0]),
-                                                int(resp[1]),
-                                                int(resp[2]),
-                                                int(resp[3]),
-                                                resp[4])
-                        for resp in responses]
-        elif result_format == BleInterface.SCAN_RESULT_FORMAT_RAW_DATA:
-            if self._write(command, args, duration * 2) is EUL_RESULT_SUCCESS:
-                regex = r"\"([\w|:]{17})\",([0|1]),-(\d+),\"((\\[0-9A-F]{2})+)\""
-                responses = self._serial.serial_search_regex_all(regex)
-                return [BleInterface.ScanRawResult( \
-                            Euler._convert_euler_address_to_standard(resp[0]),
-                            int(resp[1]),
-                            int(resp[2]),
-                            Euler._convert_escaped_string_to_data(resp[3]))
-                        for resp in responses]
-        else:
-            raise ValueError('invalid result_format')
+        if self._write(command, args, duration * 2) is EUL_RESULT_SUCCESS:
+            return [parse(resp) for resp in self._transaction.search_all(regex)]
         return None
 
+    @changes_state('scan')
+    def ble_scan_iter(self, duration, result_format=BleInterface.SCAN_RESULT_FORMAT_DEFAULT,
+                      stop_when=None):
+        """ Function defined in GapInterface. """
+        regex, parse = self._scan_format(result_format)
+        return self._scan_iter([duration, int(result_format)], compile_regex(regex), parse,
+                               duration * 2, stop_when)
+
+    def _scan_iter(self, args, pattern, parse, timeout, stop_when):
+        """ Generator of ble_scan_iter: parse the scan results as their lines are received. """
+        if not self._enable_bluetooth():
+            return
+        command = '+SRBLESCAN'
+        self._wait_scan_complete()
+        end = time.monotonic() + timeout
+        transaction = self._at.start(format_write(command, args))
+        self._transaction = transaction
+        try:
+            for line in self._at.iter_response(transaction, self._get_final_results(command),
+                                               timeout):
+                match = pattern.search(line)
+                if match:
+                    result = parse(decode_groups(match, ''))
+                    stop = stop_when is not None and stop_when(result)
+                    yield result
+                    if stop:
+                        return
+        finally:
+            if transaction.result is None:
+                # stopped before the final result code
+                self._scan = (transaction, end)
+
+    @changes_state('scan_parameters')
     def ble_set_scan_parameters(self, scan_type, scan_interval, scan_window):
         """Function defined in GapInterface. """
         command = '+SRBLESCANPARAMS'
@@ -332,6 +499,7 @@ class Euler(Board, CommonInterface, BleInterface):
         args = [scan_type, scan_interval, scan_window]
         return self._write(command, args) is EUL_RESULT_SUCCESS
 
+    @changes_state('sessions')
     def ble_connect(self, session_id, max_attempt=2):
         """Function defined in GapInterface. """
         warnings.warn('TODO, ble.py API updated: max_attempt param added.')
@@ -345,13 +513,14 @@ class Euler(Board, CommonInterface, BleInterface):
 
     def ble_wait_for_connection(self, timeout=10):
         """Function defined in GapInterface. """
-        regex = r"\+SRBLE_IND: (\d+),(\d)"
-        response = self._serial.serial_search_regex(regex, timeout)
-        if response and int(response[1]) == 1:
+        regex = r"\+SRBLE_IND: (\d+),(1)"
+        response = self._urc.wait(regex, timeout)
+        if response:
             time.sleep(0.5) # Wait to allow MTU exchange and BC smart service registration
             return True
         return False
 
+    @changes_state('sessions')
     def ble_disconnect(self, session_id):
         """Function defined in GapInterface. """
         if not self._enable_bluetooth():
@@ -365,24 +534,20 @@ class Euler(Board, CommonInterface, BleInterface):
     def ble_wait_for_disconnection(self, session_id, timeout=5):
         """Function defined in GapInterface. """
         regex = r"\+SRBLE_IND: (%d),(0),(\d+)" % session_id
-        response = self._serial.serial_search_regex(regex, timeout)
+        response = self._urc.wait(regex, timeout)
         return True if response else False
 
     def ble_is_connected(self, session_id):
         """Function defined in GapInterface. """
         if not self._enable_bluetooth():
             return None
-        command = '+SRBLECFG'
-        if self._query(command) is EUL_RESULT_SUCCESS:
-            regex = r"\+SRBLECFG: (%d),([0|1]),\"([\w|:]{17})\",(\d+)" % (session_id)
-            response = self._serial.serial_search_regex(regex)
-            if response:
-                return int(response[1])
-        return None
+        session = self._sessions.get(session_id)
+        return session.connected if session else None
 
 
     # BLE GATT interface.
 
+    @cached_identity('local_mtu_size')
     def ble_get_local_mtu_size(self):
         """Function defined in GattInterface. """
         if not self._enable_bluetooth():
@@ -390,7 +555,7 @@ class Euler(Board, CommonInterface, BleInterface):
         command = '+SRBLE'
         if self._query(command) is EUL_RESULT_SUCCESS:
             regex = r"\+SRBLE: \"(.+)\",(\d+),(\d)"
-            response = self._serial.serial_search_regex(regex)
+            response = self._transaction.search(regex)
             if response:
                 return int(response[1])
         return None
@@ -399,28 +564,27 @@ class Euler(Board, CommonInterface, BleInterface):
         """Function defined in GattInterface. """
         if not self._enable_bluetooth():
             return None
-        command = '+SRBLECFG'
-        if self._query(command) is EUL_RESULT_SUCCESS:
-            regex = r"\+SRBLECFG: (%d),([0|1]),\"([\w|:]{17})\",(\d+)" % (session_id)
-            response = self._serial.serial_search_regex(regex)
-            if response:
-                return int(response[3])
-        return None
+        return self._sessions.get_mtu(session_id)
 
     def ble_gatt_discover_all_primary_services(self, session_id):
         """Function defined in GattInterface. """
         if not self._enable_bluetooth():
             return None
+        database = self._gatt_database(session_id)
+        if database and database.services is not None:
+            return list(database.services)
         command = '+SRBLEDISCSERV'
         args = [session_id]
         res = None
         if self._write(command, args) is EUL_RESULT_SUCCESS:
             regex = r"\+SRBLEDISCSERV: (%d),\"([0-9a-f|\-]+)\",(1),(\d+),(\d+)" % (session_id)
-            responses = self._serial.serial_search_regex_all(regex)
+            responses = self._transaction.search_all(regex)
             res = []
             for resp in responses:
                 res.append(BleInterface.GattService(resp[1].upper(), True,
                                                     int(resp[3]), int(resp[4])))
+            if database:
+                database.set_services(res)
             return res
         return None
 
@@ -428,18 +592,24 @@ class Euler(Board, CommonInterface, BleInterface):
         """Function defined in GattInterface. """
         if not self._enable_bluetooth():
             return None
+        database = self._gatt_database(session_id)
+        if database and database.characteristics is not None:
+            return list(database.characteristics)
         command = '+SRBLEDISCCHAR'
         args = [session_id]
         if self._write(command, args) is EUL_RESULT_SUCCESS:
             regex = r"\+SRBLEDISCCHAR: (%d),\"([0-9a-f|\-]+)\",(\d+),(\d+)" % (session_id)
-            responses = self._serial.serial_search_regex_all(regex)
+            responses = self._transaction.search_all(regex)
             res = []
             for resp in responses:
                 res.append(BleInterface.GattCharacteristic(resp[1].upper(),
                                                            int(resp[3]), int(resp[2])))
+            if database:
+                database.set_characteristics(res)
             return res
         return None
 
+    @changes_state('gatt_database')
     def ble_gatt_add_primary_service(self, serv_uuid):
         """Function defined in GattInterface. """
         if not self._enable_bluetooth():
@@ -448,11 +618,12 @@ class Euler(Board, CommonInterface, BleInterface):
         args = [serv_uuid]
         if self._write(command, args) is EUL_RESULT_SUCCESS:
             regex = r"\+SRBLEADDSERV: (\d+)"
-            response = self._serial.serial_search_regex(regex)
+            response = self._transaction.search(regex)
             if response:
                 return int(response[0])
         return None
 
+    @changes_state('gatt_database')
     def ble_gatt_add_characteristic(self,
                                     char_uuid,
                                     properties,
@@ -476,11 +647,12 @@ class Euler(Board, CommonInterface, BleInterface):
                 # (1 if control_policy == 0 else 0)]
         # if self._write(command, args) is EUL_RESULT_SUCCESS:
             # regex = r"\+SRBLEADDCHAR: (\d+)"
-            # response = self._serial.serial_search_regex(regex)
+            # response = self._transaction.search(regex)
             # if response:
                 # return int(response[0])
         return None
 
+    @changes_state('gatt_database')
     def ble_gatt_add_characteristic_descriptor(
             self,
             char_desc_uuid,
@@ -506,11 +678,12 @@ class Euler(Board, CommonInterface, BleInterface):
                 # (1 if control_policy == 0 else 0)]
         # if self._write(command, args) is EUL_RESULT_SUCCESS:
             # regex = r"\+SRBLEADDCHARDESCR: (\d+)"
-            # response = self._serial.serial_search_regex(regex)
+            # response = self._transaction.search(regex)
             # if response:
                 # return int(response[0])
         return None
 
+    @changes_state('gatt')
     def ble_gatt_read_request(self, session_id, handle):
         """Function defined in GattInterface. """
         if not self._enable_bluetooth():
@@ -532,8 +705,10 @@ class Euler(Board, CommonInterface, BleInterface):
     def ble_gatt_wait_for_read_request(self, session_id, handle, timeout=5):
         """Function defined in GattInterface. """
         regex = r"\+SRBLEREAD: %d,\d+,%d" % (session_id, handle)
-        return self._serial.serial_search_regex(regex, timeout) is not None
+        # the read request is consumed by ble_gatt_read_response (transfer id)
+        return self._urc.wait(regex, timeout, consume=False) is not None
 
+    @changes_state('gatt')
     def ble_gatt_read_response(self,
                                session_id,
                                handle,
@@ -552,19 +727,19 @@ class Euler(Board, CommonInterface, BleInterface):
             return False
         command = '+SRBLEREADRESP'
         args = [session_id, transfer_id, handle]
-        args.append('"' + ''.join('\\{:02X}'.format(x)
-                                  for x in value) + '"')
+        args.append(payload.quote(value, self._payload_encoding))
         return self._write(command, args) is EUL_RESULT_SUCCESS
 
     def ble_gatt_wait_for_read_response(self, session_id, handle, timeout=5):
         """Function defined in GattInterface. """
         warnings.warn('handle parameter ignored.')
         regex = r"\+SRBLEREADCHAR: %d,\d+,\"(.*)\"" % (session_id)
-        response = self._serial.serial_search_regex(regex, timeout)
+        response = self._urc.wait(regex, timeout)
         if response:
-            return self._convert_escaped_string_to_data(response[0])
+            return self._payload(payload.unescape(response[0]))
         return None
 
+    @changes_state('gatt')
     def ble_gatt_write_request(self, session_id, handle, value, need_rsp):
         """Function defined in GattInterface. """
         if not self._enable_bluetooth():
@@ -577,16 +752,15 @@ class Euler(Board, CommonInterface, BleInterface):
                 command = '+SRBLEWRITECHARNORSP'
         else:
             command = '+SRBLEWRITEDESC'
-        args = [session_id, handle, '"' +
-                ''.join('\\{:02X}'.format(x) for x in value) + '"']
+        args = [session_id, handle, payload.quote(value, self._payload_encoding)]
         return self._write(command, args) is EUL_RESULT_SUCCESS
 
     def ble_gatt_wait_for_write_request(self, session_id, handle, timeout=5):
         """Function defined in GattInterface. """
         regex = r"\+SRBLEWRITE: %d,%d,\"(.+)\"" % (session_id, handle)
-        response = self._serial.serial_search_regex(regex, timeout)
+        response = self._urc.wait(regex, timeout)
         if response:
-            value = Euler._convert_escaped_string_to_data(response[0])
+            value = self._payload(payload.unescape(response[0]))
             warnings.warn('offset not supported - ignored.')
             warnings.warn(
                 'need_rsp automatically handled (accepted) by Euler. \
@@ -594,6 +768,7 @@ class Euler(Board, CommonInterface, BleInterface):
             return BleInterface.GattWriteReq(session_id, handle, 0, value, False)
         return None
 
+    @changes_state('gatt')
     def ble_gatt_write_response(self, session_id, handle, accept):
         """Function defined in GattInterface. """
         # Automatically sent by Euler
@@ -608,40 +783,41 @@ class Euler(Board, CommonInterface, BleInterface):
         warnings.warn('Write Response not supported.')
         return True
 
+    @changes_state('gatt')
     def ble_gatt_notification_request(self, session_id, handle, value):
         """Function defined in GattInterface. """
         if not self._enable_bluetooth():
             return False
         command = '+SRBLENOTIFY'
-        args = [session_id, handle, '"' +
-                ''.join('\\{:02X}'.format(x) for x in value) + '"']
+        args = [session_id, handle, payload.quote(value, self._payload_encoding)]
         return self._write(command, args) is EUL_RESULT_SUCCESS
 
     def ble_gatt_wait_for_notification(self, session_id, handle, timeout=5):
         """Function defined in GattInterface. """
         regex = r"\+SRBLENOTIFICATION: %d,\d+,\"(.*)\"" % (session_id)
-        response = self._serial.serial_search_regex(regex, timeout)
+        response = self._urc.wait(regex, timeout)
         if response:
-            return self._convert_escaped_string_to_data(response[0])
+            return self._payload(payload.unescape(response[0]))
         return None
 
+    @changes_state('gatt')
     def ble_gatt_indication_request(self, session_id, handle, value):
         """Function defined in GattInterface. """
         if not self._enable_bluetooth():
             return False
         command = '+SRBLEINDICATE'
-        args = [session_id, handle, '"' +
-                ''.join('\\{:02X}'.format(x) for x in value) + '"']
+        args = [session_id, handle, payload.quote(value, self._payload_encoding)]
         return self._write(command, args) is EUL_RESULT_SUCCESS
 
     def ble_gatt_wait_for_indication(self, session_id, handle, timeout=5):
         """Function defined in GattInterface. """
         regex = r"\+SRBLEINDICATION: %d,\d+,\"(.*)\"" % (session_id)
-        response = self._serial.serial_search_regex(regex, timeout)
+        response = self._urc.wait(regex, timeout)
         if response:
-            return self._convert_escaped_string_to_data(response[0])
+            return self._payload(payload.unescape(response[0]))
         return None
 
+    @changes_state('gatt')
     def ble_gatt_indication_response(self, session_id, handle):
         """Function defined in GattInterface. """
         # automatically sent by Euler
@@ -649,55 +825,56 @@ class Euler(Board, CommonInterface, BleInterface):
 
     def ble_gatt_wait_for_indication_response(self, session_id, handle, timeout=5):
         """Function defined in GattInterface. """
-        return self._serial.serial_search_regex_all('(OK)', timeout)
+        # search the data received since the last command was sent
+        start = self._transaction.start if self._transaction else 0
+        cursor = SerialSearchCursor(overlap=0, line=start)
+        return self._serial.serial_search_regex_all('(OK)', timeout, cursor)
 
 
     # BLE BC Smart interface.
 
+    @changes_state('bc_smart')
     def bc_smart_server_send_data(self, session_id, data):
         """Function defined in BcSmartInterface. """
         if not self._enable_bluetooth():
             return False
         command = '+SRBCSMARTSEND'
-        args = [session_id, 1, '"' +
-                ''.join('\\{:02X}'.format(x) for x in data) + '"']
+        args = [session_id, 1, payload.quote(data, self._payload_encoding)]
         return self._write(command, args) is EUL_RESULT_SUCCESS
 
-    def bc_smart_server_wait_for_data(self, session_id, timeout=2):
+    def bc_smart_server_wait_for_data(self, session_id, timeout=2, size=None, quiet=None):
         """Function defined in BcSmartInterface. """
         regex = r"\+SRBCSMARTRECV: (%d),(1),\"(.+)\"" % (session_id)
-        responses = self._serial.serial_search_regex_all(regex, timeout)
-        res = []
-        for resp in responses:
-            res.extend(Euler._convert_escaped_string_to_data(resp[2]))
-        return res
+        until = self._until_size(size, lambda resp: payload.unescape(resp[2]))
+        responses = self._urc.wait_all(regex, timeout, until, quiet)
+        return self._payload(b''.join(payload.unescape(resp[2]) for resp in responses))
 
     def bc_smart_server_wait_for_command(self, session_id, timeout=2):
         """Function defined in BcSmartInterface. """
         regex = r"\+SRREMCMD: \"(.+)\""
-        response = self._serial.serial_search_regex(regex, timeout)
+        response = self._urc.wait(regex, timeout)
         if response:
             return response[0]
         return None
 
+    @changes_state('bc_smart')
     def bc_smart_client_send_data(self, session_id, data):
         """Function defined in BcSmartInterface. """
         if not self._enable_bluetooth():
             return False
         command = '+SRBCSMARTSEND'
-        args = [session_id, 0, '"' +
-                ''.join('\\{:02X}'.format(x) for x in data) + '"']
+        args = [session_id, 0, payload.quote(data, self._payload_encoding)]
         return self._write(command, args) is EUL_RESULT_SUCCESS
 
-    def bc_smart_client_wait_for_client_data(self, session_id, timeout=2):
+    def bc_smart_client_wait_for_client_data(self, session_id, timeout=2, size=None,
+                                             quiet=None):
         """Function defined in BcSmartInterface. """
         regex = r"\+SRBCSMARTRECV: (%d),(0),\"(.+)\"" % (session_id)
-        responses = self._serial.serial_search_regex_all(regex, timeout)
-        res = []
-        for resp in responses:
-            res.extend(Euler._convert_escaped_string_to_data(resp[2]))
-        return res
+        until = self._until_size(size, lambda resp: payload.unescape(resp[2]))
+        responses = self._urc.wait_all(regex, timeout, until, quiet)
+        return self._payload(b''.join(payload.unescape(resp[2]) for resp in responses))
 
+    @changes_state('bc_smart')
     def bc_smart_client_send_command(self, session_id, command):
         """Function defined in BcSmartInterface. """
         if not self._enable_bluetooth():
@@ -706,10 +883,10 @@ class Euler(Board, CommonInterface, BleInterface):
         args = [session_id, command + EUL_EOL]
         return self._write(atcommand, args) is EUL_RESULT_SUCCESS
 
-    def bc_smart_client_wait_for_command_response(self, session_id, timeout=5):
+    def bc_smart_client_wait_for_command_response(self, session_id, timeout=5, quiet=None):
         """Function defined in BcSmartInterface. """
         regex = r"\+SRBCSMARTRSP: (%d),\"(.+)\"" % (session_id)
-        responses = self._serial.serial_search_regex_all(regex, timeout)
+        responses = self._urc.wait_all(regex, timeout, quiet=quiet)
         res = ''
         for resp in responses:
             res += resp[1]
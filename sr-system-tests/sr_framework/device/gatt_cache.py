@@ -0,0 +1,103 @@
+#!/usr/bin/python
+
+""" GATT discovery cache.
+
+This module contains the GattDiscoveryCache class, which keeps the GATT
+databases discovered on the connected peers of a board (GATT client), so
+that a remote database is only discovered once per connection.
+"""
+
+from sr_framework.utils.urc_dispatcher import DEFAULT_URC_QUEUE_SIZE
+
+# Types of the attributes of a DiscoveredDatabase.
+ATTRIBUTE_SERVICE = 'service'
+ATTRIBUTE_CHARACTERISTIC = 'characteristic'
+
+# UUID of the Service Changed characteristic (16-bit and 128-bit forms).
+SERVICE_CHANGED_UUIDS = ('2A05', '00002A05-0000-1000-8000-00805F9B34FB')
+
+
+class DiscoveredDatabase:
+    """ GATT database of a peer, discovered in the current connection.
+
+        Attributes:
+            services (list of GattService): Primary services, None if not discovered.
+            characteristics (list of GattCharacteristic): Characteristics, None
+                if not discovered.
+            service_changed_handle (int): Handle of the Service Changed
+                characteristic, None if not discovered.
+    """
+    def __init__(self):
+        self.services = None
+        self.characteristics = None
+        self.service_changed_handle = None
+        self._types = {}
+
+    def set_services(self, services):
+        """ Store the primary services discovered. """
+        self.services = list(services)
+        for service in services:
+            self._types[service.start_handle] = ATTRIBUTE_SERVICE
+
+    def set_characteristics(self, characteristics):
+        """ Store the characteristics discovered. """
+        self.characteristics = list(characteristics)
+        for char in characteristics:
+            self._types[char.handle] = ATTRIBUTE_CHARACTERISTIC
+            if char.uuid.upper() in SERVICE_CHANGED_UUIDS:
+                self.service_changed_handle = char.handle
+
+    def attribute_type(self, handle):
+        """ Returns the type (ATTRIBUTE_*) of the attribute handle, None if not
+        discovered (e.g. descriptor). """
+        return self._types.get(handle)
+
+
+class GattDiscoveryCache:
+    """ GATT databases discovered by a board, by peer address.
+
+        A database is dropped when the peer connects or disconnects, and when
+        the peer indicates a Service Changed. These events are received on a
+        URC subscription of the cache, queued before the board waiters ones.
+    """
+    def __init__(self, serial_port, prefixes, regex, parse):
+        """
+        Args:
+            serial_port: SerialPort of the board.
+            prefixes: Prefixes of the connection, disconnection and indication URCs.
+            regex: Regular expression of these URCs.
+            parse: Function of the match groups of regex, returning (addr, handle):
+                handle is None for a connection or disconnection, the handle of
+                the indication otherwise. addr is None if the peer is not known.
+        """
+        self._urc = serial_port.serial_urc_subscribe(prefixes, first=True)
+        self._regex = regex
+        self._parse = parse
+        self._databases = {}
+
+    def invalidate(self, addr=None):
+        """ Drop the database of the peer addr, all the databases if None. """
+        if addr is None:
+            self._databases = {}
+        else:
+            self._databases.pop(addr, None)
+
+    def _sync(self):
+        """ Apply the URCs received. """
+        events = self._urc.wait_all(self._regex)
+        if len(events) >= DEFAULT_URC_QUEUE_SIZE:
+            # URCs might have been dropped
+            self.invalidate()
+            return
+        for groups in events:
+            addr, handle = self._parse(groups if isinstance(groups, tuple) else (groups,))
+            database = self._databases.get(addr)
+            if addr is None:
+                self.invalidate()
+            elif database and (handle is None or handle == database.service_changed_handle):
+                self.invalidate(addr)
+
+    def database(self, addr):
+        """ Returns the DiscoveredDatabase of the peer addr (empty if not discovered). """
+        self._sync()
+        return self._databases.setdefault(addr, DiscoveredDatabase())
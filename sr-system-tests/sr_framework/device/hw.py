@@ -80,12 +80,14 @@ class HWInterface:
         """
         pass
 
-    def hw_gpio_wait_for_event(self, gpio, timeout=1):
+    def hw_gpio_wait_for_event(self, gpio, timeout=1, state=None):
         """ Wait for a GPIO event.
 
         Args:
             gpio: the GPIO to wait on
             timeout: the timeout before the event shall be detected.
+            state: the state expected: returns as soon as the event (gpio, state)
+                is detected. None to collect the events until timeout.
 
         Returns:
             A list of tuples of GPIOs and their new state.
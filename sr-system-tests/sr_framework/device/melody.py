@@ -6,10 +6,14 @@ and implements the common, ble and hw interfaces. """
 
 import time
 import warnings
-from sr_framework.device.board import Board
+from sr_framework.device.board import Board, cached_identity, changes_state, \
+    resets_state, advertising_state
 from sr_framework.device.common import CommonInterface
 from sr_framework.device.ble import BleInterface
 from sr_framework.device.hw import HWInterface
+from sr_framework.device.gatt_cache import GattDiscoveryCache
+from sr_framework.utils import payload
+from sr_framework.utils.rx_buffer import compile_regex, decode_groups
 
 # Melody end of line character
 BC127_EOL = '\r'
@@ -29,9 +33,20 @@ CONFIG_DICT = {
     'UART_CONFIG':  r"UART_CONFIG=(\d{4,6}) (ON|OFF) ([0-2])" + BC127_EOL,
 }
 
+# Melody scan result regex (SCAN and SCAN ON)
+SCAN_REGEX = r"SCAN (\w{12}) (0|1) <([^\r]*)> ([0-9A-F]{2}) -(\d+)dBm" + BC127_EOL
+SCAN_RAW_REGEX = r"SCAN_RAW (\w{12}) (\d) -(\d+)dBm (\d+) ([0-9A-F| ]+)" + BC127_EOL
+
+# Header of the BC Smart data received, followed by the raw data (decimal length).
+RECV_HEADER_REGEX = r"RECV [0-9A-F]+ (\d+) "
+
 class Melody(Board, CommonInterface, BleInterface, HWInterface):
     """Melody board. Used to control BC127 over serial interface (UART)."""
 
+    URC_PREFIXES = ('OPEN_OK', 'CLOSE_OK', 'BLE_READ', 'BLE_READ_RES', 'BLE_WRITE',
+                    'BLE_NOTIFICATION', 'BLE_INDICATION', 'RECV', 'BC_SMART_CMD',
+                    'BC_SMART_CMD_RESP')
+
     class BleSessionWrapper(BleInterface.BleSession):
         """Melody virtual BLE session."""
 
@@ -52,7 +67,28 @@ class Melody(Board, CommonInterface, BleInterface, HWInterface):
 
     def __init__(self, device):
         super().__init__(device)
+        self._serial.serial_add_raw_data_header(RECV_HEADER_REGEX)
         self._ble_sessions = []  # virtual BLE sessions (BleSessionWrapper).
+        self._gatt_cache = GattDiscoveryCache(
+            self._serial, ('OPEN_OK', 'CLOSE_OK', 'BLE_INDICATION'),
+            r"(?:OPEN_OK|CLOSE_OK) \w+ BLE (\w{12})|BLE_INDICATION (\w+) ([0-9A-F]{4})",
+            self._parse_gatt_cache_event)
+        # end (time.monotonic()) of a scan stopped early by ble_scan_iter, None if none.
+        self._scan_end = None
+
+    def _parse_gatt_cache_event(self, groups):
+        """Returns (peer address, indication handle) of a GattDiscoveryCache event."""
+        if groups[0]:
+            return Melody._convert_melody_address_to_standard(groups[0]), None
+        for session in self._ble_sessions:
+            if session.link_id == int(groups[1], 16):
+                return session.bdaddr.addr, int(groups[2], 16)
+        return None, None
+
+    def _gatt_database(self, session_id):
+        """Returns the DiscoveredDatabase of the peer of session_id, None if unknown."""
+        bdaddr = self._ble_sessions_get_bdaddr_from_session_id(session_id)
+        return self._gatt_cache.database(bdaddr.addr) if bdaddr else None
 
     @staticmethod
     def _convert_melody_address_to_standard(addr):
@@ -108,28 +144,32 @@ class Melody(Board, CommonInterface, BleInterface, HWInterface):
 
     # Command helpers
     def _get_result_from_response(self, success_string, error_string, timeout):
-        while timeout >= 0:
-            if self._serial.serial_search_line_startswith(success_string):
-                return BC127_RESULT_SUCCESS
-            if self._serial.serial_search_line_startswith(error_string) or \
-                self._serial.serial_search_line_startswith('ERROR'):
-                return BC127_RESULT_ERROR
-            time.sleep(min(0.1, timeout))
-            timeout -= 0.1
+        result_codes = (BC127_RESULT_SUCCESS, BC127_RESULT_ERROR, BC127_RESULT_ERROR)
+        response = self._serial.serial_search_line_startswith_any(
+            (success_string, error_string, 'ERROR'), timeout)
+        if response:
+            return result_codes[response[0]]
         return BC127_RESULT_TIMEOUT
 
-    def _execute(self,
-                 command,
-                 args=None,
-                 success_string='OK',
-                 error_string='ERROR',
-                 timeout=DEFAULT_COMMAND_TIMEOUT):
+    def _send(self, command, args=None):
+        """Send command without waiting for its response. Returns the absolute
+        index of the first line of the response in the serial rx buffer."""
         self._serial.serial_rx_clear()
+        start = self._serial.serial_rx_mark()
         self._serial.serial_write_data(command
                                        + (' ' if (command[-1] != '=') and args else '')
                                        + (' '.join(str(x)
                                                    for x in args) if args else '')
                                        + BC127_EOL)
+        return start
+
+    def _execute(self,
+                 command,
+                 args=None,
+                 success_string='OK',
+                 error_string='ERROR',
+                 timeout=DEFAULT_COMMAND_TIMEOUT):
+        self._send(command, args)
         return self._get_result_from_response(success_string, error_string, timeout)
 
     def _send_raw_data(self, data):
@@ -151,18 +191,26 @@ class Melody(Board, CommonInterface, BleInterface, HWInterface):
 
     # COMMON INTERFACE.
 
+    @changes_state('custom')
     def common_send_custom_command(self, command):
         """Function defined in CommonInterface."""
+        # the custom command may change the device identity
+        self.clear_identity_cache()
         return self._execute(command, timeout=5) is BC127_RESULT_SUCCESS
 
+    @resets_state
     def common_reset(self):
         """Function defined in CommonInterface."""
         command = 'RESET'
         if self._execute(command, success_string='Ready') is BC127_RESULT_SUCCESS:
             self._ble_sessions_delete_all_sessions()
+            self._gatt_cache.invalidate()
+            self._scan_end = None
+            self._urc.flush()
             return True
         return False
 
+    @cached_identity('supported_command_list')
     def common_get_supported_command_list(self):
         """Function defined in CommonInterface."""
         command = 'HELP'
@@ -171,9 +219,11 @@ class Melody(Board, CommonInterface, BleInterface, HWInterface):
             return list(responses[:-1])  # remove last element 'OK'
         return None
 
+    @resets_state
     def common_restore_to_defaults(self):
         """Function defined in CommonInterface."""
         # Restore default config
+        self._invalidate_identity('restore')
         if self._execute('RESTORE', success_string='Ready') != BC127_RESULT_SUCCESS:
             return False
         # Clear all virtual sessions
@@ -185,6 +235,7 @@ class Melody(Board, CommonInterface, BleInterface, HWInterface):
             return False
         return True
 
+    @cached_identity('manufacturer_id')
     def common_read_manufacturer_id(self):
         """Function defined in CommonInterface."""
         command = 'VERSION'
@@ -199,6 +250,7 @@ class Melody(Board, CommonInterface, BleInterface, HWInterface):
         # There is no existing command to get the model identification.
         return 'BC127'
 
+    @cached_identity('revision_id')
     def common_read_revision_id(self):
         """Function defined in CommonInterface."""
         command = 'VERSION'
@@ -213,6 +265,7 @@ class Melody(Board, CommonInterface, BleInterface, HWInterface):
         warnings.warn('Not supported.')
         return 0
 
+    @changes_state('remote_controller')
     def common_set_remote_controller(self, session_id):
         """Function defined in CommonInterface."""
         warnings.warn('Not supported.')
@@ -221,6 +274,7 @@ class Melody(Board, CommonInterface, BleInterface, HWInterface):
 
     # HARDWARE INTERFACE.
 
+    @changes_state('baudrate')
     def hw_set_uart_baudrate(self, new_baudrate):
         """Function defined in HWInterface."""
         uart_config = self._get_config('UART_CONFIG')
@@ -230,6 +284,7 @@ class Melody(Board, CommonInterface, BleInterface, HWInterface):
         self.set_serial_baudrate(new_baudrate)
         return self._clear_command_buffer()
 
+    @changes_state('flow_control')
     def hw_set_uart_flow_control(self, enable):
         """Function defined in HWInterface."""
         uart_config = self._get_config('UART_CONFIG')
@@ -251,13 +306,16 @@ class Melody(Board, CommonInterface, BleInterface, HWInterface):
         uart_config = self._get_config('UART_CONFIG')
         return int(uart_config[0])
 
+    @changes_state('settings')
     def hw_save_settings(self):
         """Function defined in HWInterface."""
+        self._invalidate_identity('save')
         return self._execute('WRITE') == BC127_RESULT_SUCCESS
 
 
     # BLE INTERFACE.
 
+    @cached_identity('local_address')
     def ble_get_local_address(self):
         """Function defined in BleInterface."""
         addr = Melody._convert_melody_address_to_standard(
@@ -265,6 +323,7 @@ class Melody(Board, CommonInterface, BleInterface, HWInterface):
         addr_type = True if self._get_config('BLE_CONFIG')[3] == 'ON' else False
         return BleInterface.Bdaddr(addr, addr_type)
 
+    @changes_state('sessions')
     def ble_create_session(self, bdaddr):
         """Function defined in BleInterface."""
         # use virtual sessions since Melody does not have sessions.
@@ -275,6 +334,7 @@ class Melody(Board, CommonInterface, BleInterface, HWInterface):
             return ble_session
         return None
 
+    @changes_state('sessions')
     def ble_delete_session(self, session_id):
         """Function defined in BleInterface."""
         # use virtual sessions since Melody does not have sessions.
@@ -296,12 +356,13 @@ class Melody(Board, CommonInterface, BleInterface, HWInterface):
 
     # BLE GAP interface.
 
+    @changes_state(advertising_state)
     def ble_set_advertising_enable(self, enable, adv_data=None, scan_resp_data=None):
         """Function defined in GapInterface."""
         if adv_data:
             # Set advertising data
             command = 'ADVERTISING'
-            args = ['{}'.format(len(adv_data))]
+            args = ['{}'.format(payload.size(adv_data))]
             if self._execute(command, args, success_string='PENDING') is BC127_RESULT_SUCCESS:
                 self._send_raw_data(adv_data)
                 if not self._serial.serial_search_regex('(OK)'):
@@ -311,7 +372,7 @@ class Melody(Board, CommonInterface, BleInterface, HWInterface):
         if scan_resp_data:
             # Set scan response data
             command = 'SSRD'
-            args = ['{}'.format(len(scan_resp_data))]
+            args = ['{}'.format(payload.size(scan_resp_data))]
             if self._execute(command, args, success_string='PENDING') is BC127_RESULT_SUCCESS:
                 self._send_raw_data(scan_resp_data)
                 if not self._serial.serial_search_regex('(OK)'):
@@ -323,6 +384,7 @@ class Melody(Board, CommonInterface, BleInterface, HWInterface):
         args = ['ON' if enable else 'OFF']
         return self._execute(command, args) is BC127_RESULT_SUCCESS
 
+    @changes_state('advertising_parameters')
     def ble_set_advertising_parameters(self,
                                        adv_type,
                                        adv_int_min,
@@ -333,6 +395,7 @@ class Melody(Board, CommonInterface, BleInterface, HWInterface):
         warnings.warn('TODO')
         return False
 
+    @changes_state('connection_parameters')
     def ble_set_peripheral_preferred_connection_parameters(self,
                                                            min_conn_interval,
                                                            max_conn_interval,
@@ -342,48 +405,94 @@ class Melody(Board, CommonInterface, BleInterface, HWInterface):
         warnings.warn('Not supported.')
         return False
 
+    def _scan_result(self, groups):
+        """Returns the ScanResult of the SCAN_REGEX groups."""
+        return BleInterface.ScanResult(Melody._convert_melody_address_to_standard(groups[0]),
+                                       int(groups[1]),
+                                       int(groups[4]),
+                                       int(groups[3], 16),
+                                       groups[2])
+
+    def _scan_raw_result(self, groups):
+        """Returns the ScanRawResult of the SCAN_RAW_REGEX groups."""
+        return BleInterface.ScanRawResult(Melody._convert_melody_address_to_standard(groups[0]),
+                                          int(groups[1]),
+                                          int(groups[2]),
+                                          self._payload(payload.from_hex(groups[4])))
+
+    def _wait_scan_complete(self):
+        """Wait for the end of a scan stopped early by ble_scan_iter (SCAN_OK),
+        the BC127 keeps scanning until the end of its duration."""
+        if self._scan_end is None:
+            return
+        remaining = self._scan_end - time.monotonic()
+        self._scan_end = None
+        if remaining > 0:
+            self._serial.serial_search_line_startswith('SCAN_OK', remaining)
+
     def ble_scan(self, duration, result_format=BleInterface.SCAN_RESULT_FORMAT_DEFAULT):
         """Function defined in GapInterface."""
         command = 'SCAN'
         args = [duration]
         if result_format == BleInterface.SCAN_RESULT_FORMAT_DEFAULT:
-            if self._execute(command,
-                             args,
-                             success_string='SCAN_OK',
-                             timeout=duration+1) is BC127_RESULT_SUCCESS:
-                regex = r"SCAN (\w{12}) (0|1) <(.+)> ([0-9A-F]{2}) -(\d+)dBm" + BC127_EOL
-                responses = self._serial.serial_search_regex_all(regex)
-                return [BleInterface.ScanResult( \
-                                Melody._convert_melody_address_to_standard(resp[0]),
-                                int(resp[1]),
-                                int(resp[4]),
-                                int(resp[3], 16),
-                                resp[2])
-                        for resp in responses]
+            regex, parse = SCAN_REGEX, self._scan_result
         elif result_format == BleInterface.SCAN_RESULT_FORMAT_RAW_DATA:
             args.append('ON')
-            if self._execute(command,
-                             args,
-                             success_string='SCAN_OK',
-                             timeout=duration+1) is BC127_RESULT_SUCCESS:
-                scan_raw_regex = r"SCAN_RAW (\w{12}) (\d) -(\d+)dBm (\d+) ([0-9A-F| ]+)" + BC127_EOL
-                responses = self._serial.serial_search_regex_all(
-                    scan_raw_regex)
-                return [BleInterface.ScanRawResult( \
-                               Melody._convert_melody_address_to_standard(resp[0]),
-                               int(resp[1]),
-                               int(resp[2]),
-                               [int(x, 16) for x in resp[4].split()])
-                        for resp in responses]
+            regex, parse = SCAN_RAW_REGEX, self._scan_raw_result
         else:
             raise ValueError('invalid result_format')
+        self._wait_scan_complete()
+        if self._execute(command,
+                         args,
+                         success_string='SCAN_OK',
+                         timeout=duration+1) is BC127_RESULT_SUCCESS:
+            return [parse(resp) for resp in self._serial.serial_search_regex_all(regex)]
         return None
 
+    @changes_state('scan')
+    def ble_scan_iter(self, duration, result_format=BleInterface.SCAN_RESULT_FORMAT_DEFAULT,
+                      stop_when=None):
+        """Function defined in GapInterface."""
+        args = [duration]
+        if result_format == BleInterface.SCAN_RESULT_FORMAT_DEFAULT:
+            regex, parse = SCAN_REGEX, self._scan_result
+        elif result_format == BleInterface.SCAN_RESULT_FORMAT_RAW_DATA:
+            args.append('ON')
+            regex, parse = SCAN_RAW_REGEX, self._scan_raw_result
+        else:
+            raise ValueError('invalid result_format')
+        return self._scan_iter(args, compile_regex(regex), parse, duration + 1, stop_when)
+
+    def _scan_iter(self, args, pattern, parse, timeout, stop_when):
+        """Generator of ble_scan_iter: parse the scan results as their lines are received."""
+        self._wait_scan_complete()
+        end = time.monotonic() + timeout
+        complete = False
+        try:
+            for _, line in self._serial.serial_iter_lines(self._send('SCAN', args), timeout):
+                if line.startswith((b'SCAN_OK', b'ERROR')):
+                    complete = True
+                    return
+                match = pattern.match(line)
+                if match:
+                    result = parse(decode_groups(match))
+                    stop = stop_when is not None and stop_when(result)
+                    yield result
+                    if stop:
+                        return
+            complete = True
+        finally:
+            if not complete:
+                # stopped before SCAN_OK
+                self._scan_end = end
+
+    @changes_state('scan_parameters')
     def ble_set_scan_parameters(self, scan_type, scan_interval, scan_window):
         """Function defined in GapInterface."""
         warnings.warn('TODO')
         return False
 
+    @changes_state('sessions')
     def ble_connect(self, session_id, max_attempt=2):
         """Function defined in GapInterface."""
         bdaddr = self._ble_sessions_get_bdaddr_from_session_id(session_id)
@@ -403,7 +512,7 @@ class Melody(Board, CommonInterface, BleInterface, HWInterface):
     def ble_wait_for_connection(self, timeout=10):
         """Function defined in GapInterface."""
         regex = r"OPEN_OK (\d4) BLE (\w{12})" + BC127_EOL
-        response = self._serial.serial_search_regex(regex, timeout)
+        response = self._urc.wait(regex, timeout)
         if response:
             link_id = int(response[0], 16)
             bdaddr = BleInterface.Bdaddr(self._convert_melody_address_to_standard(
@@ -419,6 +528,7 @@ class Melody(Board, CommonInterface, BleInterface, HWInterface):
             return True
         return False
 
+    @changes_state('sessions')
     def ble_disconnect(self, session_id):
         """Function defined in GapInterface."""
         link_id = self._ble_sessions_get_link_id_from_session_id(session_id)
@@ -434,7 +544,7 @@ class Melody(Board, CommonInterface, BleInterface, HWInterface):
         link_id = self._ble_sessions_get_link_id_from_session_id(session_id)
         if link_id is not None:
             regex = (r"CLOSE_OK %X BLE (\w{12})" % link_id) + BC127_EOL
-            response = self._serial.serial_search_regex(regex, timeout)
+            response = self._urc.wait(regex, timeout)
             if response:
                 self._ble_sessions_set_session_link_id(session_id, 0)
                 return True
@@ -448,6 +558,7 @@ class Melody(Board, CommonInterface, BleInterface, HWInterface):
 
     # BLE GATT interface.
 
+    @cached_identity('local_mtu_size')
     def ble_get_local_mtu_size(self):
         """Function defined in GattInterface."""
         return int(self._get_config('BLE_CONFIG')[2])
@@ -466,38 +577,51 @@ class Melody(Board, CommonInterface, BleInterface, HWInterface):
         """Function defined in GattInterface."""
         link_id = self._ble_sessions_get_link_id_from_session_id(session_id)
         if link_id is not None:
+            database = self._gatt_database(session_id)
+            if database.services is not None:
+                return list(database.services)
             command = 'BLE_GET_SERV'
             args = ['{:X}'.format(link_id)]
             if self._execute(command, args) is BC127_RESULT_SUCCESS:
                 regex = r"BLE_SERV (\d4) (\w+) ([0-9A-F|\-]+) ([0-9A-F]{4}) ([0-9A-F]{4})" \
                          + BC127_EOL
                 responses = self._serial.serial_search_regex_all(regex)
-                return [BleInterface.GattService(resp[2],
-                                                 True,
-                                                 int(resp[3], 16),
-                                                 int(resp[4], 16)) for resp in responses]
+                services = [BleInterface.GattService(resp[2],
+                                                     True,
+                                                     int(resp[3], 16),
+                                                     int(resp[4], 16)) for resp in responses]
+                database.set_services(services)
+                return services
         return None
 
     def ble_gatt_discover_all_characteristics(self, session_id):
         """Function defined in GattInterface."""
         link_id = self._ble_sessions_get_link_id_from_session_id(session_id)
         if link_id is not None:
+            database = self._gatt_database(session_id)
+            if database.characteristics is not None:
+                return list(database.characteristics)
             command = 'BLE_GET_CHAR'
             args = ['{:X}'.format(link_id)]
             if self._execute(command, args) is BC127_RESULT_SUCCESS:
                 regex = r"BLE_CHAR (\d4) (\w+) ([0-9A-F|\-]+) ([0-9A-F]{4}) ([0-9A-F]{2})" \
                          + BC127_EOL
                 responses = self._serial.serial_search_regex_all(regex)
-                return [BleInterface.GattCharacteristic(resp[2],
-                                                        int(resp[3], 16),
-                                                        int(resp[4], 16)) for resp in responses]
+                characteristics = [BleInterface.GattCharacteristic(resp[2],
+                                                                   int(resp[3], 16),
+                                                                   int(resp[4], 16))
+                                   for resp in responses]
+                database.set_characteristics(characteristics)
+                return characteristics
         return None
 
+    @changes_state('gatt_database')
     def ble_gatt_add_primary_service(self, serv_uuid):
         """Function defined in GattInterface."""
         warnings.warn('TODO')
         return False
 
+    @changes_state('gatt_database')
     def ble_gatt_add_characteristic(self,
                                     char_uuid,
                                     properties,
@@ -509,6 +633,7 @@ class Melody(Board, CommonInterface, BleInterface, HWInterface):
         warnings.warn('TODO')
         return False
 
+    @changes_state('gatt_database')
     def ble_gatt_add_characteristic_descriptor(self,
                                                char_desc_uuid,
                                                permissions,
@@ -519,6 +644,7 @@ class Melody(Board, CommonInterface, BleInterface, HWInterface):
         warnings.warn('TODO')
         return False
 
+    @changes_state('gatt')
     def ble_gatt_read_request(self, session_id, handle):
         """Function defined in GattInterface."""
         link_id = self._ble_sessions_get_link_id_from_session_id(session_id)
@@ -531,17 +657,18 @@ class Melody(Board, CommonInterface, BleInterface, HWInterface):
         link_id = self._ble_sessions_get_link_id_from_session_id(session_id)
         if link_id is not None:
             regex = r"BLE_READ {:X} {:04X}".format(link_id, handle) + BC127_EOL
-            response = self._serial.serial_search_regex(regex, timeout)
+            response = self._urc.wait(regex, timeout)
             if response:
                 return True
         return None
 
+    @changes_state('gatt')
     def ble_gatt_read_response(self, session_id, handle, accept, value=None, offset=0):
         """Function defined in GattInterface."""
         link_id = self._ble_sessions_get_link_id_from_session_id(session_id)
         command = 'BLE_READ_RES'
         args = ['{:X}'.format(link_id), '{:X}'.format(
-            handle), '{:X}'.format(len(value))]
+            handle), '{:X}'.format(payload.size(value))]
         if self._execute(command, args, success_string='PENDING') is BC127_RESULT_SUCCESS:
             self._send_raw_data(value)
             return True
@@ -553,13 +680,13 @@ class Melody(Board, CommonInterface, BleInterface, HWInterface):
         if link_id is not None:
             regex = r"BLE_READ_RES {:X} {:04X} (\d+) (\d+)".format(
                 link_id, handle) + BC127_EOL
-            response = self._serial.serial_search_regex(regex, timeout)
+            response = self._urc.wait(regex, timeout)
             if response:
-                data_iter = iter(response[1])
-                value = [int(a + b, 16) for a, b in zip(data_iter, data_iter)]
+                value = self._payload(payload.from_hex(response[1]))
                 return value
         return None
 
+    @changes_state('gatt')
     def ble_gatt_write_request(self, session_id, handle, value, need_rsp):
         """Function defined in GattInterface."""
         if need_rsp:
@@ -567,7 +694,7 @@ class Melody(Board, CommonInterface, BleInterface, HWInterface):
             link_id = self._ble_sessions_get_link_id_from_session_id(session_id)
             command = 'BLE_WRITE'
             args = ['{:X}'.format(link_id), '{:X}'.format(
-                handle), '{:X}'.format(len(value))]
+                handle), '{:X}'.format(payload.size(value))]
             if self._execute(command, args, success_string='PENDING') is BC127_RESULT_SUCCESS:
                 self._send_raw_data(value)
                 return True
@@ -582,13 +709,13 @@ class Melody(Board, CommonInterface, BleInterface, HWInterface):
         if link_id is not None:
             regex = r"BLE_WRITE {:X} {:04X} (\d+) (\d+)".format(
                 link_id, handle) + BC127_EOL
-            response = self._serial.serial_search_regex(regex, timeout)
+            response = self._urc.wait(regex, timeout)
             if response:
-                data_iter = iter(response[1])
-                value = [int(a + b, 16) for a, b in zip(data_iter, data_iter)]
+                value = self._payload(payload.from_hex(response[1]))
                 return BleInterface.GattWriteReq(session_id, handle, 0, value, False)
         return None
 
+    @changes_state('gatt')
     def ble_gatt_write_response(self, session_id, handle, accept):
         """Function defined in GattInterface."""
         warnings.warn('Write Response not supported (BC127-181).')
@@ -598,12 +725,13 @@ class Melody(Board, CommonInterface, BleInterface, HWInterface):
         """Function defined in GattInterface."""
         return self._serial.serial_search_line_startswith('OK', timeout)
 
+    @changes_state('gatt')
     def ble_gatt_notification_request(self, session_id, handle, value):
         """Function defined in GattInterface."""
         link_id = self._ble_sessions_get_link_id_from_session_id(session_id)
         command = 'BLE_NOTIFICATION'
         args = ['{:X}'.format(link_id), '{:X}'.format(
-            handle), '{:X}'.format(len(value))]
+            handle), '{:X}'.format(payload.size(value))]
         if self._execute(command, args, success_string='PENDING') is BC127_RESULT_SUCCESS:
             self._send_raw_data(value)
             return True
@@ -615,19 +743,19 @@ class Melody(Board, CommonInterface, BleInterface, HWInterface):
         if link_id is not None:
             regex = r"BLE_NOTIFICATION {:X} {:04X} (\d+) (\d+)".format(
                 link_id, handle) + BC127_EOL
-            response = self._serial.serial_search_regex(regex, timeout)
+            response = self._urc.wait(regex, timeout)
             if response:
-                data_iter = iter(response[1])
-                value = [int(a + b, 16) for a, b in zip(data_iter, data_iter)]
+                value = self._payload(payload.from_hex(response[1]))
                 return value
         return None
 
+    @changes_state('gatt')
     def ble_gatt_indication_request(self, session_id, handle, value):
         """Function defined in GattInterface."""
         link_id = self._ble_sessions_get_link_id_from_session_id(session_id)
         command = 'BLE_INDICATION'
         args = ['{:X}'.format(link_id), '{:X}'.format(
-            handle), '{:X}'.format(len(value))]
+            handle), '{:X}'.format(payload.size(value))]
         if self._execute(command, args, success_string='PENDING') is BC127_RESULT_SUCCESS:
             self._send_raw_data(value)
             return True
@@ -639,13 +767,13 @@ class Melody(Board, CommonInterface, BleInterface, HWInterface):
         if link_id is not None:
             regex = r"BLE_INDICATION {:X} {:04X} (\d+) (\d+)".format(
                 link_id, handle) + BC127_EOL
-            response = self._serial.serial_search_regex(regex, timeout)
+            response = self._urc.wait(regex, timeout)
             if response:
-                data_iter = iter(response[1])
-                value = [int(a + b, 16) for a, b in zip(data_iter, data_iter)]
+                value = self._payload(payload.from_hex(response[1]))
                 return value
         return None
 
+    @changes_state('gatt')
     def ble_gatt_indication_response(self, session_id, handle):
         """Function defined in GattInterface."""
         # automatically sent by Melody
@@ -658,11 +786,12 @@ class Melody(Board, CommonInterface, BleInterface, HWInterface):
 
     # BLE BC Smart interface.
 
+    @changes_state('bc_smart')
     def bc_smart_server_send_data(self, session_id, data):
         """Function defined in BcSmartInterface."""
         link_id = self._ble_sessions_get_link_id_from_session_id(session_id)
         command = 'SEND_RAW'
-        args = ['{:X}'.format(link_id), '{:X}'.format(len(data))]
+        args = ['{:X}'.format(link_id), '{:X}'.format(payload.size(data))]
         # SEND_RAW command send a Notification if notifications are enabled,
         # otherwise a Write Request if the BC Smart Data characteristic is discovered
         # on the remote device. If both fail the command return an error.
@@ -671,17 +800,23 @@ class Melody(Board, CommonInterface, BleInterface, HWInterface):
             return True
         return False
 
-    def bc_smart_server_wait_for_data(self, session_id, timeout=2):
+    def _wait_for_recv(self, link_id, timeout, size, quiet):
+        """Wait for the BC Smart data received on a link (RECV events).
+        Returns the data (bytes) concatenated, None if none."""
+        # the line of the event is the header, the raw data and the end of line
+        regex = r"RECV {:X} (\d+) (.*)".format(link_id)
+        data = lambda resp: resp[1][:int(resp[0])]
+        responses = self._urc.wait_all(regex, timeout, self._until_size(size, data), quiet,
+                                       decode=False)
+        if responses:
+            return self._payload(b''.join(data(resp) for resp in responses))
+        return None
+
+    def bc_smart_server_wait_for_data(self, session_id, timeout=2, size=None, quiet=None):
         """Function defined in BcSmartInterface."""
         link_id = self._ble_sessions_get_link_id_from_session_id(session_id)
         if link_id is not None:
-            regex = r"RECV {:X} (\d+) (.+)".format(link_id) + BC127_EOL
-            responses = self._serial.serial_search_regex_all(regex, timeout)
-            if responses:
-                result = []
-                for resp in responses:
-                    result += [ord(x) for x in resp[1]]
-                return result
+            return self._wait_for_recv(link_id, timeout, size, quiet)
         return None
 
     def bc_smart_server_wait_for_command(self, session_id, timeout=2):
@@ -689,16 +824,17 @@ class Melody(Board, CommonInterface, BleInterface, HWInterface):
         link_id = self._ble_sessions_get_link_id_from_session_id(session_id)
         if link_id is not None:
             regex = r"BC_SMART_CMD {:X} (\d+) (\w+)".format(link_id) + BC127_EOL
-            response = self._serial.serial_search_regex(regex, timeout)
+            response = self._urc.wait(regex, timeout)
             if response:
                 return response[1]
         return None
 
+    @changes_state('bc_smart')
     def bc_smart_client_send_data(self, session_id, data):
         """Function defined in BcSmartInterface."""
         link_id = self._ble_sessions_get_link_id_from_session_id(session_id)
         command = 'SEND_RAW'
-        args = ['{:X}'.format(link_id), '{:X}'.format(len(data))]
+        args = ['{:X}'.format(link_id), '{:X}'.format(payload.size(data))]
         # SEND_RAW command send a Notification if notifications are enabled,
         # otherwise a Write Request if the BC Smart Data characteristic is discovered
         # on the remote device. If both fail the command return an error.
@@ -707,19 +843,15 @@ class Melody(Board, CommonInterface, BleInterface, HWInterface):
             return True
         return False
 
-    def bc_smart_client_wait_for_client_data(self, session_id, timeout=2):
+    def bc_smart_client_wait_for_client_data(self, session_id, timeout=2, size=None,
+                                             quiet=None):
         """Function defined in BcSmartInterface."""
         link_id = self._ble_sessions_get_link_id_from_session_id(session_id)
         if link_id is not None:
-            regex = r"RECV {:X} (\d+) (.+)".format(link_id) + BC127_EOL
-            responses = self._serial.serial_search_regex_all(regex, timeout)
-            if responses:
-                result = []
-                for resp in responses:
-                    result += [ord(x) for x in resp[1]]
-                return result
+            return self._wait_for_recv(link_id, timeout, size, quiet)
         return None
 
+    @changes_state('bc_smart')
     def bc_smart_client_send_command(self, session_id, command):
         """Function defined in BcSmartInterface."""
         link_id = self._ble_sessions_get_link_id_from_session_id(session_id)
@@ -727,12 +859,12 @@ class Melody(Board, CommonInterface, BleInterface, HWInterface):
         args = ['{:X}'.format(link_id), command]
         return self._execute(cmd, args) is BC127_RESULT_SUCCESS
 
-    def bc_smart_client_wait_for_command_response(self, session_id, timeout=5):
+    def bc_smart_client_wait_for_command_response(self, session_id, timeout=5, quiet=None):
         """Function defined in BcSmartInterface."""
         link_id = self._ble_sessions_get_link_id_from_session_id(session_id)
         if link_id is not None:
             regex = r"BC_SMART_CMD_RESP {:X} (\d+) (\w+)".format(link_id) + BC127_EOL
-            responses = self._serial.serial_search_regex_all(regex, timeout)
+            responses = self._urc.wait_all(regex, timeout, quiet=quiet)
             if responses:
                 return [resp[1] for resp in responses]
         return None
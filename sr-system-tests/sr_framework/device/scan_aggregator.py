@@ -0,0 +1,171 @@
+#!/usr/bin/python
+
+""" Scan aggregator.
+
+This module contains the ScanAggregator class, which merges the scan results
+of a scan (ScanResult or ScanRawResult, reported again for each advertising
+event) into one ScanRecord per advertiser.
+"""
+
+import time
+from sr_framework.utils import payload
+
+# AD type of the Flags AD structure, only present in the advertising data.
+_AD_TYPE_FLAGS = 0x01
+
+
+def _has_flags(data):
+    """ Returns True if the advertising data (bytes) contains a Flags AD structure. """
+    i = 0
+    while i + 1 < len(data):
+        if data[i + 1] == _AD_TYPE_FLAGS:
+            return True
+        i += data[i] + 1
+    return False
+
+
+class ScanRecord:
+    """ Scan results of an advertiser, merged.
+
+        Attributes:
+            addr (str): Bluetooth address of the advertiser (e.g '20:FA:BB:00:01:80').
+            addr_type (int): Address type.
+            first_seen (float): Time (time.monotonic()) of the first scan result.
+            last_seen (float): Time (time.monotonic()) of the last scan result.
+            count (int): Number of scan results.
+            rssi_min (int): Minimum RSSI reported (same unit as ScanResult.rssi).
+            rssi_max (int): Maximum RSSI reported.
+            flag (int): Flags of the last ScanResult, None if none.
+            name (str): Last non empty name of the ScanResults, None if none.
+            adv_data (bytes): Last advertising data of the ScanRawResults, None if none.
+            scan_resp_data (bytes): Last scan response data of the ScanRawResults,
+                None if none.
+    """
+    __slots__ = ('addr', 'addr_type', 'first_seen', 'last_seen', 'count', 'rssi_min',
+                 'rssi_max', '_rssi_sum', 'flag', 'name', 'adv_data', 'scan_resp_data')
+
+    def __init__(self, addr, addr_type, timestamp):
+        self.addr = addr
+        self.addr_type = addr_type
+        self.first_seen = timestamp
+        self.last_seen = timestamp
+        self.count = 0
+        self.rssi_min = None
+        self.rssi_max = None
+        self._rssi_sum = 0
+        self.flag = None
+        self.name = None
+        self.adv_data = None
+        self.scan_resp_data = None
+
+    @property
+    def rssi_mean(self):
+        """ Mean RSSI reported (float), None if no scan result. """
+        return self._rssi_sum / self.count if self.count else None
+
+    def add(self, result, timestamp):
+        """ Merge a scan result (ScanResult or ScanRawResult) received at timestamp. """
+        rssi = result.rssi
+        if self.count:
+            self.rssi_min = min(self.rssi_min, rssi)
+            self.rssi_max = max(self.rssi_max, rssi)
+        else:
+            self.rssi_min = self.rssi_max = rssi
+        self.count += 1
+        self._rssi_sum += rssi
+        self.last_seen = timestamp
+        raw_data = getattr(result, 'raw_data', None)
+        if raw_data is None:
+            self.flag = result.flag
+            self.name = result.name or self.name
+            return
+        raw_data = payload.to_bytes(raw_data)
+        if raw_data in (self.adv_data, self.scan_resp_data):
+            return
+        # The Flags AD structure is not allowed in the scan response data. Without
+        # flags, the first data received is the advertising data (a scan response
+        # follows an advertising event).
+        if self.adv_data is None or _has_flags(raw_data):
+            self.adv_data = raw_data
+        else:
+            self.scan_resp_data = raw_data
+
+    def contains(self, data):
+        """ Returns True if the advertising data or the scan response data
+        contains data (bytes-like object or iterable of ints). """
+        data = payload.to_bytes(data)
+        return any(data in raw_data for raw_data in (self.adv_data, self.scan_resp_data)
+                   if raw_data is not None)
+
+    def __str__(self):
+        return ('ScanRecord: addr="%s", addr_type=%d, count=%d, rssi=%s/%s/%s, name="%s"'
+                % (self.addr, self.addr_type, self.count, self.rssi_min, self.rssi_max,
+                   self.rssi_mean, self.name))
+
+
+class ScanAggregator:
+    """ Scan results merged by advertiser, indexed by (address, address type).
+
+        Usage:
+            scan = ScanAggregator(remote.ble_scan_iter(10))
+            assert (dut_bdaddr.addr, dut_bdaddr.addr_type) in scan
+            record = scan.get(dut_bdaddr.addr, dut_bdaddr.addr_type)
+    """
+    def __init__(self, results=()):
+        """
+        Args:
+            results: Scan results to merge (e.g. list returned by ble_scan(),
+                or the generator returned by ble_scan_iter()).
+        """
+        self._records = {}
+        self.add_all(results)
+
+    def add(self, result, timestamp=None):
+        """ Merge a scan result (ScanResult or ScanRawResult), received at timestamp
+        (time.monotonic(), now if None). Returns the ScanRecord of its advertiser. """
+        if timestamp is None:
+            timestamp = time.monotonic()
+        key = (result.addr, result.addr_type)
+        record = self._records.get(key)
+        if record is None:
+            record = self._records[key] = ScanRecord(result.addr, result.addr_type, timestamp)
+        record.add(result, timestamp)
+        return record
+
+    def add_all(self, results, until=None):
+        """ Merge the scan results, as they are received.
+
+        Args:
+            results: Scan results to merge.
+            until: Function of the ScanRecord updated, the remaining results are
+                not merged once it returns True (and the scan of a generator
+                returned by ble_scan_iter() is stopped). None to merge all the results.
+
+        Returns:
+            ScanAggregator: self.
+        """
+        for result in results:
+            record = self.add(result)
+            if until is not None and until(record):
+                if hasattr(results, 'close'):
+                    results.close()
+                break
+        return self
+
+    def get(self, addr, addr_type):
+        """ Returns the ScanRecord of the advertiser, None if not seen. """
+        return self._records.get((addr, addr_type))
+
+    def records(self):
+        """ Returns all the ScanRecords, in the order the advertisers were first seen. """
+        return list(self._records.values())
+
+    def __contains__(self, key):
+        """ key: tuple (address, address type). """
+        return key in self._records
+
+    def __len__(self):
+        return len(self._records)
+
+    def __iter__(self):
+        return iter(self._records.values())
@@ -0,0 +1,9 @@
+""" Board emulators, exposed on pseudo-terminals (Linux only).
+
+They allow running the test scripts without boards, e.g. on CI workers:
+the Device returned by an emulator is used as any device of the DeviceManager.
+"""
+
+from sr_framework.emulator.air import Air, VirtualAdvertiser, virtual_advertisers
+from sr_framework.emulator.eddington import EddingtonEmulator
+from sr_framework.emulator.melody import MelodyEmulator
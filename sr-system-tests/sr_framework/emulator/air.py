@@ -0,0 +1,52 @@
+#!/usr/bin/python
+
+""" Radio medium shared by the board emulators.
+
+The Air is used by the central emulators to find the advertisers (scan) and
+the peripheral to connect to (BLE link, see ble_link.py).
+"""
+
+import collections
+
+# Advertiser which is not an emulator, reported by the scans (e.g. load generation).
+VirtualAdvertiser = collections.namedtuple(
+    'VirtualAdvertiser', ['bdaddr', 'addr_type', 'adv_data', 'scan_resp_data', 'rssi'])
+
+
+def virtual_advertisers(count, name='Virtual'):
+    """ Returns count VirtualAdvertiser, with reproducible addresses, names and RSSI. """
+    advertisers = []
+    for i in range(count):
+        local_name = '{}{}'.format(name, i).encode('ascii')
+        adv_data = bytes([0x02, 0x01, 0x06, len(local_name) + 1, 0x09]) + local_name
+        advertisers.append(VirtualAdvertiser(
+            '0A:00:00:00:{:02X}:{:02X}'.format(i >> 8 & 0xFF, i & 0xFF), i % 2,
+            adv_data, b'', 40 + (i * 7) % 50))
+    return advertisers
+
+
+class Air:
+    """ Emulators within radio range of each other.
+
+        The advertising state of the emulators is read from other threads
+        (e.g. scans), without lock: it is only a snapshot.
+    """
+    def __init__(self):
+        self._emulators = []
+
+    def register(self, emulator):
+        """ Add an emulator (with bdaddr, addr_type, advertising, adv_data and
+        scan_resp_data attributes). """
+        self._emulators.append(emulator)
+
+    def advertisers(self, observer=None):
+        """ Returns the emulators advertising, observer excluded. """
+        return [emulator for emulator in self._emulators
+                if emulator is not observer and emulator.advertising]
+
+    def find(self, addr):
+        """ Returns the emulator with the BLE address addr, None if not found. """
+        for emulator in self._emulators:
+            if emulator.bdaddr == addr:
+                return emulator
+        return None
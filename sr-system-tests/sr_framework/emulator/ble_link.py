@@ -0,0 +1,52 @@
+#!/usr/bin/python
+
+""" BLE link between two board emulators.
+
+The emulators exchange the BLE traffic by posting calls (PtyDevice.post) to
+the on_*() functions of their peer, with the BleLink as first argument.
+
+Peripheral side (e.g. EddingtonEmulator):
+    on_connect(link), on_disconnect(link, reason),
+    on_gatt_discover_services(link), on_gatt_discover_characteristics(link),
+    on_gatt_read(link, handle), on_gatt_write(link, handle, value, need_rsp),
+    on_bc_smart_data(link, data), on_remote_command(link, command)
+
+Central side:
+    on_connected(link), on_disconnect(link, reason),
+    on_gatt_services(link, services), on_gatt_characteristics(link, characteristics),
+    on_gatt_read_response(link, handle, value), on_gatt_write_response(link, handle, accepted),
+    on_gatt_notification(link, handle, value), on_gatt_indication(link, handle, value),
+    on_bc_smart_data(link, data), on_remote_command_response(link, lines)
+"""
+
+# Default ATT MTU.
+BLE_DEFAULT_MTU = 23
+
+# HCI disconnection reasons.
+BLE_REASON_REMOTE_USER = 0x13
+BLE_REASON_LOCAL_HOST = 0x16
+
+
+class BleLink:
+    """ BLE connection between a central and a peripheral emulator.
+
+        Attributes:
+            central (PtyDevice): Central emulator.
+            peripheral (PtyDevice): Peripheral emulator.
+            mtu (int): Exchanged ATT MTU.
+            sessions (dict): Session id of the link on each emulator.
+    """
+    def __init__(self, central, peripheral, mtu=BLE_DEFAULT_MTU):
+        self.central = central
+        self.peripheral = peripheral
+        self.mtu = mtu
+        self.sessions = {}
+
+    def peer(self, emulator):
+        """ Returns the peer of emulator on the link. """
+        return self.peripheral if emulator is self.central else self.central
+
+    def post(self, emulator, function_name, *args):
+        """ Post a call to the on_<function_name>() function of the peer of emulator. """
+        peer = self.peer(emulator)
+        peer.post(getattr(peer, 'on_' + function_name), self, *args)
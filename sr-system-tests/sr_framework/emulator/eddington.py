@@ -0,0 +1,600 @@
+#!/usr/bin/python
+
+""" Eddington emulator.
+
+It contains the EddingtonEmulator class, which emulates the AT commands of a
+BC310X board (see sr_framework/device/eddington.py) on a pseudo-terminal.
+"""
+
+import re
+from sr_framework.device.ble import BleInterface
+from sr_framework.device.hw import HWInterface
+from sr_framework.emulator.ble_link import BLE_REASON_LOCAL_HOST
+from sr_framework.emulator.pty_device import PtyDevice
+
+# GPIOs of the BC310X.
+EDD_GPIOS = (14, 16, 18, 19, 24, 25, 26, 27, 31, 32, 34, 35, 36,
+             42, 43, 44, 45, 46, 47, 48, 49, 53, 54)
+
+# GPIOs wired together on the dev board (see test_hw_gpio.py).
+EDD_DEV_BOARD_WIRING = ((18, 26), (42, 19), (34, 43), (35, 36), (32, 44), (16, 31),
+                        (48, 45), (49, 53), (46, 47), (27, 25), (24, 14))
+
+# Pull values of AT+KGPIOCFG and the level they pull the pin to
+# (as seen from the dev board, see test_hw_gpio_05).
+EDD_GPIO_PULL_LEVELS = {0: 0, 1: 1, 2: None}
+
+# Baudrates supported by AT+IPR.
+EDD_BAUDRATES = (1200, 2400, 4800, 9600, 14400, 19200, 28800, 38400, 57600, 76800,
+                 115200, 230400, 250000, 460800, 921600, 1000000)
+
+EDD_DEFAULT_SETTINGS = {'baudrate': 115200, 'flow_control': 0}
+
+# ATT MTU supported by the BC310X.
+EDD_LOCAL_MTU = 247
+
+# Advertising data after reset: flags and complete local name.
+EDD_DEFAULT_ADV_DATA = b'\x02\x01\x06\x07\x09BC310X'
+
+# First handle of the custom GATT database, following the built-in services.
+EDD_GATT_FIRST_HANDLE = 0x10
+
+_COMMAND_REGEX = re.compile(r'AT([+&][A-Z_]+|)(\?|=)?(.*)$', re.IGNORECASE)
+
+
+class AtError(Exception):
+    """ Raised by the command handlers to return ERROR. """
+
+
+def split_args(text):
+    """ Split the arguments of a write command, e.g. '1,"a,b",,2' to ['1', 'a,b', '', '2']. """
+    args = []
+    current = []
+    quoted = False
+    for char in text:
+        if char == '"':
+            quoted = not quoted
+        elif char == ',' and not quoted:
+            args.append(''.join(current))
+            current = []
+        else:
+            current.append(char)
+    args.append(''.join(current))
+    return args
+
+
+def unescape(text):
+    """ Convert "\\00\\01Hi" to b'\\x00\\x01Hi'. """
+    data = bytearray()
+    i = 0
+    while i < len(text):
+        if text[i] == '\\':
+            data.append(int(text[i + 1:i + 3], 16))
+            i += 3
+        else:
+            data += text[i].encode('ascii')
+            i += 1
+    return bytes(data)
+
+
+def escape(data):
+    """ Convert b'\\x00\\x01Hi' to "\\00\\01\\48\\69". """
+    return ''.join('\\{:02X}'.format(x) for x in data)
+
+
+class _Session:
+    """ BLE session of the emulator. """
+    def __init__(self, session_id, addr, addr_type):
+        self.session_id = session_id
+        self.addr = addr
+        self.addr_type = addr_type
+        self.link = None
+
+
+class _GattAttribute:
+    """ Service, characteristic or descriptor of the GATT database. """
+    def __init__(self, kind, uuid, properties=0, permissions=0, value=b''):
+        self.kind = kind
+        self.uuid = uuid.upper()
+        self.properties = properties
+        self.permissions = permissions
+        self.value = value
+        self.handle = None
+        self.end_handle = None
+
+
+def _assign_handles(attributes, handle):
+    """ Assign the handles of the GATT attributes, from handle.
+    Returns the handle following the last attribute. """
+    service = None
+    for attribute in attributes:
+        if attribute.kind == 'characteristic':
+            # characteristic declaration, followed by its value
+            handle += 1
+        attribute.handle = handle
+        if attribute.kind == 'service':
+            service = attribute
+        service.end_handle = handle
+        handle += 1
+    return handle
+
+
+def _builtin_gatt_db():
+    """ Returns the GAP, GATT and BC Smart services, at the start of the GATT database. """
+    properties = BleInterface.GattCharProperties
+    permissions = BleInterface.AttPermissions
+    cccd = ('descriptor', '2902', 0, permissions.READ | permissions.WRITE, b'\x00\x00')
+    attributes = [_GattAttribute(*attribute) for attribute in (
+        ('service', '1800'),
+        ('characteristic', '2A00', properties.READ, permissions.READ, b'BC310X'),
+        ('characteristic', '2A01', properties.READ, permissions.READ, b'\x00\x00'),
+        ('service', '1801'),
+        ('characteristic', '2A05', properties.INDICATE, 0),
+        cccd,
+        ('service', BleInterface.BC_SMART_SERVICE_UUID),
+        ('characteristic', BleInterface.BC_SMART_CHAR_DATA_UUID,
+         properties.WRITE_WITHOUT_RESPONSE | properties.WRITE | properties.NOTIFY,
+         permissions.WRITE),
+        cccd,
+        ('characteristic', BleInterface.BC_SMART_CHAR_COMMAND_UUID,
+         properties.WRITE | properties.NOTIFY, permissions.WRITE))]
+    _assign_handles(attributes, 1)
+    return attributes
+
+
+class EddingtonEmulator(PtyDevice):
+    """ BC310X emulator.
+
+        It implements the AT commands used by the Eddington class, the GPIOs
+        (wired as on the dev board) and the peripheral side of the BLE links
+        (see ble_link.py). The BLE centrals find it through the Air.
+
+        Attributes:
+            bdaddr (str): BLE address.
+            addr_type (int): BLE address type.
+            local_mtu (int): ATT MTU supported.
+            advertising (bool): True if advertising.
+            adv_data (bytes): Advertising data.
+            scan_resp_data (bytes): Scan response data.
+    """
+
+    MANUFACTURER = 'Sierra Wireless'
+    MODEL = 'BC310X'
+    REVISION = 'Beta.1.0'
+    BAUDRATE = 115200
+
+    def __init__(self, bdaddr='C0:FF:EE:00:00:01', wiring=EDD_DEV_BOARD_WIRING, air=None):
+        super().__init__()
+        self.bdaddr = bdaddr
+        self.addr_type = BleInterface.LE_BDADDR_TYPE_PRIVATE
+        self.local_mtu = EDD_LOCAL_MTU
+        self._wires = {}
+        for gpio_a, gpio_b in wiring:
+            self._wires[gpio_a] = gpio_b
+            self._wires[gpio_b] = gpio_a
+        self._saved_settings = dict(EDD_DEFAULT_SETTINGS)
+        self._commands = {
+            '': self._at,
+            '+RST': self._at_rst,
+            '&F': self._at_restore_defaults,
+            '&W': self._at_save_settings,
+            '&K': self._at_flow_control,
+            '+IPR': self._at_ipr,
+            '+CLAC': self._at_clac,
+            '+FMI': lambda op, args: [self.MANUFACTURER],
+            '+FMM': lambda op, args: [self.MODEL],
+            '+FMR': lambda op, args: [self.REVISION],
+            '+KGPIOCFG': self._at_kgpiocfg,
+            '+KGPIO': self._at_kgpio,
+            '+SRREMCTRL': self._at_srremctrl,
+            '+SRBLE': self._at_srble,
+            '+SRBLEADDR': self._at_srbleaddr,
+            '+SRBLECFG': self._at_srblecfg,
+            '+SRBLEDEL': self._at_srbledel,
+            '+SRBLECLOSE': self._at_srbleclose,
+            '+SRBLEADV': self._at_srbleadv,
+            '+SRBLEADVPARAMS': self._at_srbleadvparams,
+            '+SRBLEPPCP': self._at_srbleppcp,
+            '+SRBLEADDSERV': self._at_srbleaddserv,
+            '+SRBLEADDCHAR': self._at_srbleaddchar,
+            '+SRBLEADDDSCR': self._at_srbleadddscr,
+            '+SRBLEPROFILESETUP': self._at_srbleprofilesetup,
+            '+SRBLEREADRESP': self._at_srblereadresp,
+            '+SRBLEWRITERESP': self._at_srblewriteresp,
+            '+SRBLENOTIFY': self._at_srblenotify,
+            '+SRBLEINDICATE': self._at_srbleindicate,
+            '+SRBCSMARTSEND': self._at_srbcsmartsend,
+        }
+        self._reset()
+        if air:
+            air.register(self)
+
+    def _reset(self):
+        """ Reset the runtime state, as after a reboot. """
+        self._settings = dict(self._saved_settings)
+        self._gpio_config = {}
+        self._gpio_outputs = {}
+        self._gpio_levels = {}
+        self._remote_controller = 0
+        self._sessions = {}
+        self._next_session_id = 1
+        self._pending_reads = set()
+        self._pending_writes = {}
+        self._builtin_db = _builtin_gatt_db()
+        self._gatt_db = []
+        self._gatt_ready = False
+        self.advertising = False
+        self.adv_data = EDD_DEFAULT_ADV_DATA
+        self.scan_resp_data = b''
+        self._adv_params = None
+        self._ppcp = None
+
+    def _disconnect_all(self, reason):
+        """ Disconnect all the BLE links, without URC. """
+        for session in self._sessions.values():
+            if session.link:
+                session.link.post(self, 'disconnect', reason)
+                session.link = None
+
+
+    # AT COMMANDS.
+
+    def handle_command(self, command):
+        """ Execute an AT command and send its response. """
+        for line in self.execute(command):
+            self.send_line(line)
+
+    def execute(self, command):
+        """ Execute an AT command.
+        Returns the response lines, including the final result code. """
+        match = _COMMAND_REGEX.match(command.strip())
+        handler = self._commands.get(match.group(1).upper()) if match else None
+        if handler is None:
+            return ['ERROR']
+        op = match.group(2) or ''
+        if op != '=' and match.group(3):
+            return ['ERROR']
+        try:
+            args = split_args(match.group(3)) if op == '=' else []
+            lines = handler(op, args)
+        except (AtError, ValueError, IndexError, KeyError):
+            return ['ERROR']
+        if lines is None:
+            # final result code sent by the handler
+            return []
+        return lines + ['OK']
+
+    def _at(self, op, args):
+        return []
+
+    def _at_rst(self, op, args):
+        self._disconnect_all(BLE_REASON_LOCAL_HOST)
+        self._reset()
+        self.send_line('Ready')
+        return None
+
+    def _at_restore_defaults(self, op, args):
+        self._saved_settings = dict(EDD_DEFAULT_SETTINGS)
+        self._disconnect_all(BLE_REASON_LOCAL_HOST)
+        self._reset()
+        return []
+
+    def _at_save_settings(self, op, args):
+        self._saved_settings = dict(self._settings)
+        return []
+
+    def _at_flow_control(self, op, args):
+        if op != '=' or args[0] not in ('0', '3'):
+            raise AtError()
+        self._settings['flow_control'] = int(args[0])
+        return []
+
+    def _at_ipr(self, op, args):
+        if op == '?':
+            return ['+IPR: {}'.format(self._settings['baudrate'])]
+        if int(args[0]) not in EDD_BAUDRATES:
+            raise AtError()
+        self._settings['baudrate'] = int(args[0])
+        return []
+
+    def _at_clac(self, op, args):
+        return ['AT' + command for command in self._commands if command.startswith('+')]
+
+    def _at_srremctrl(self, op, args):
+        if op == '?':
+            return ['+SRREMCTRL: {}'.format(self._remote_controller)]
+        self._remote_controller = int(args[0])
+        return []
+
+
+    # GPIOS.
+
+    def _gpio_net(self, gpio):
+        """ Returns the GPIOs connected to gpio (gpio included). """
+        return (gpio, self._wires[gpio]) if gpio in self._wires else (gpio,)
+
+    def _update_gpio_level(self, gpio):
+        """ Update the level of the GPIOs connected to gpio and send the +KGPIO
+        URCs of the inputs if it changed. """
+        net = self._gpio_net(gpio)
+        previous_level = self._gpio_levels.get(net[0], 0)
+        level = previous_level
+        pulls = [EDD_GPIO_PULL_LEVELS[self._gpio_config[pin][1]]
+                 for pin in net if pin in self._gpio_config]
+        outputs = [self._gpio_outputs[pin] for pin in net
+                   if self._gpio_config.get(pin, (None,))[0] == HWInterface.GPIO_OUTPUT]
+        if outputs:
+            level = outputs[-1]
+        elif any(pull is not None for pull in pulls):
+            level = [pull for pull in pulls if pull is not None][-1]
+        for pin in net:
+            self._gpio_levels[pin] = level
+        if level != previous_level:
+            for pin in net:
+                if self._gpio_config.get(pin, (None,))[0] == HWInterface.GPIO_INPUT:
+                    self.send_line('+KGPIO: {}, {}'.format(pin, level))
+
+    def _at_kgpiocfg(self, op, args):
+        gpio, direction, pull = int(args[0]), int(args[1]), int(args[2])
+        if gpio not in EDD_GPIOS or direction not in (HWInterface.GPIO_INPUT,
+                                                     HWInterface.GPIO_OUTPUT):
+            raise AtError()
+        if pull not in EDD_GPIO_PULL_LEVELS:
+            raise AtError()
+        self._gpio_config[gpio] = (direction, pull)
+        self._gpio_outputs.setdefault(gpio, 0)
+        self.post(self._update_gpio_level, gpio)
+        return []
+
+    def _at_kgpio(self, op, args):
+        gpio, value = int(args[0]), int(args[1])
+        if gpio not in self._gpio_config:
+            raise AtError()
+        if value == 2:
+            return ['+KGPIOCFG: {}, {}'.format(gpio, self._gpio_levels.get(gpio, 0))]
+        if value not in (0, 1) or self._gpio_config[gpio][0] != HWInterface.GPIO_OUTPUT:
+            raise AtError()
+        self._gpio_outputs[gpio] = value
+        self.post(self._update_gpio_level, gpio)
+        return []
+
+
+    # BLE.
+
+    def _get_session(self, session_id, connected=False):
+        session = self._sessions[int(session_id)]
+        if connected and not session.link:
+            raise AtError()
+        return session
+
+    def _create_session(self, addr, addr_type):
+        for session in self._sessions.values():
+            if session.addr == addr:
+                return session
+        session = _Session(self._next_session_id, addr, addr_type)
+        self._sessions[session.session_id] = session
+        self._next_session_id += 1
+        return session
+
+    @staticmethod
+    def _session_line(session):
+        if session.link:
+            return '+SRBLECFG: {},1,"{}",{},{}'.format(
+                session.session_id, session.addr, session.addr_type, session.link.mtu)
+        return '+SRBLECFG: {},0,"{}"'.format(session.session_id, session.addr)
+
+    def _at_srble(self, op, args):
+        if op != '?':
+            raise AtError()
+        return ['+SRBLE: "{}",{},0'.format(self.MODEL, self.local_mtu)]
+
+    def _at_srbleaddr(self, op, args):
+        if op != '?':
+            raise AtError()
+        return ['+SRBLEADDR: "{}",{}'.format(self.bdaddr, self.addr_type)]
+
+    def _at_srblecfg(self, op, args):
+        if op == '?':
+            return [self._session_line(session) for session in self._sessions.values()]
+        addr = BleInterface.Bdaddr(args[0].upper(), BleInterface.LE_BDADDR_TYPE_UNKNOWN).addr
+        return [self._session_line(self._create_session(addr, BleInterface.LE_BDADDR_TYPE_UNKNOWN))]
+
+    def _at_srbledel(self, op, args):
+        session = self._get_session(args[0])
+        if session.link:
+            raise AtError()
+        del self._sessions[session.session_id]
+        return []
+
+    def _at_srbleclose(self, op, args):
+        session = self._get_session(args[0], connected=True)
+        self.send_line('OK')
+        session.link.post(self, 'disconnect', BLE_REASON_LOCAL_HOST)
+        self._on_disconnected(session, BLE_REASON_LOCAL_HOST)
+        return None
+
+    def _at_srbleadv(self, op, args):
+        self.advertising = bool(int(args[0]))
+        if len(args) > 1:
+            self.adv_data = unescape(args[1])
+        if len(args) > 2:
+            self.scan_resp_data = unescape(args[2])
+        return []
+
+    def _at_srbleadvparams(self, op, args):
+        self._adv_params = [int(arg) for arg in args]
+        return []
+
+    def _at_srbleppcp(self, op, args):
+        if len(args) != 4:
+            raise AtError()
+        self._ppcp = [int(arg) for arg in args]
+        return []
+
+
+    # GATT SERVER.
+
+    def _at_srbleaddserv(self, op, args):
+        if self._gatt_ready:
+            raise AtError()
+        self._gatt_db.append(_GattAttribute('service', args[0]))
+        return []
+
+    def _at_srbleaddchar(self, op, args):
+        if self._gatt_ready or not self._gatt_db:
+            raise AtError()
+        self._gatt_db.append(_GattAttribute('characteristic', args[0], int(args[1], 16),
+                                            int(args[2], 16), unescape(args[5])))
+        return []
+
+    def _at_srbleadddscr(self, op, args):
+        if self._gatt_ready or not self._gatt_db or self._gatt_db[-1].kind == 'service':
+            raise AtError()
+        self._gatt_db.append(_GattAttribute('descriptor', args[0], 0, int(args[1], 16),
+                                            unescape(args[4])))
+        return []
+
+    def _at_srbleprofilesetup(self, op, args):
+        if self._gatt_ready or not int(args[0]):
+            raise AtError()
+        _assign_handles(self._gatt_db, EDD_GATT_FIRST_HANDLE)
+        self._gatt_ready = True
+        return ['+SRBLEPROFILESETUP: 0,{}'.format(attribute.handle)
+                for attribute in self._gatt_db]
+
+    def _gatt_attributes(self):
+        """ Returns the attributes of the GATT database, built-in services included. """
+        return self._builtin_db + (self._gatt_db if self._gatt_ready else [])
+
+    def _get_attribute(self, handle):
+        for attribute in self._gatt_attributes():
+            if attribute.handle == handle and attribute.kind != 'service':
+                return attribute
+        return None
+
+    def _at_srblereadresp(self, op, args):
+        session = self._get_session(args[0], connected=True)
+        handle = int(args[1])
+        self._pending_reads.remove((session.session_id, handle))
+        value = unescape(args[3])[int(args[4]):] if int(args[2]) else None
+        session.link.post(self, 'gatt_read_response', handle, value)
+        return []
+
+    def _at_srblewriteresp(self, op, args):
+        session = self._get_session(args[0], connected=True)
+        handle = int(args[1])
+        value = self._pending_writes.pop((session.session_id, handle))
+        accepted = bool(int(args[2]))
+        if accepted:
+            self._get_attribute(handle).value = value
+        session.link.post(self, 'gatt_write_response', handle, accepted)
+        return []
+
+    def _at_srblenotify(self, op, args):
+        session = self._get_session(args[0], connected=True)
+        session.link.post(self, 'gatt_notification', int(args[1]), unescape(args[2]))
+        return []
+
+    def _at_srbleindicate(self, op, args):
+        session = self._get_session(args[0], connected=True)
+        session.link.post(self, 'gatt_indication', int(args[1]), unescape(args[2]))
+        return []
+
+    def _at_srbcsmartsend(self, op, args):
+        session = self._get_session(args[0], connected=True)
+        data = unescape(args[2])
+        if len(data) > session.link.mtu - 3:
+            raise AtError()
+        session.link.post(self, 'bc_smart_data', data)
+        return []
+
+
+    # BLE LINK (peripheral side, see ble_link.py).
+
+    def _on_disconnected(self, session, reason):
+        session.link = None
+        self._pending_reads = {(sid, h) for sid, h in self._pending_reads
+                               if sid != session.session_id}
+        self._pending_writes = {(sid, h): v for (sid, h), v in self._pending_writes.items()
+                                if sid != session.session_id}
+        self.send_line('+SRBLE_IND: {},0,{}'.format(session.session_id, reason))
+
+    def _link_session(self, link):
+        session = self._sessions.get(link.sessions.get(self))
+        return session if session and session.link is link else None
+
+    def on_connect(self, link):
+        """ Connection request of a central. """
+        if not self.advertising:
+            link.post(self, 'disconnect', BLE_REASON_LOCAL_HOST)
+            return
+        self.advertising = False
+        session = self._create_session(link.central.bdaddr, link.central.addr_type)
+        session.addr_type = link.central.addr_type
+        session.link = link
+        link.mtu = min(link.mtu, self.local_mtu)
+        link.sessions[self] = session.session_id
+        self.send_line('+SRBLE_IND: {},1'.format(session.session_id))
+        link.post(self, 'connected')
+
+    def on_disconnect(self, link, reason):
+        """ Disconnection by the central. """
+        session = self._link_session(link)
+        if session:
+            self._on_disconnected(session, reason)
+
+    def on_gatt_discover_services(self, link):
+        """ Primary services discovery. """
+        services = [(attribute.uuid, attribute.handle, attribute.end_handle)
+                    for attribute in self._gatt_attributes() if attribute.kind == 'service']
+        link.post(self, 'gatt_services', services)
+
+    def on_gatt_discover_characteristics(self, link):
+        """ Characteristics discovery. """
+        characteristics = [(attribute.uuid, attribute.properties, attribute.handle)
+                           for attribute in self._gatt_attributes()
+                           if attribute.kind == 'characteristic']
+        link.post(self, 'gatt_characteristics', characteristics)
+
+    def on_gatt_read(self, link, handle):
+        """ Read request of the central. """
+        session = self._link_session(link)
+        attribute = self._get_attribute(handle)
+        if not session or not attribute:
+            link.post(self, 'gatt_read_response', handle, None)
+        elif attribute.permissions & BleInterface.AttPermissions.READ_AUTHORIZATION:
+            self._pending_reads.add((session.session_id, handle))
+            self.send_line('+SRBLEREAD_REQ: {},{},0'.format(session.session_id, handle))
+        else:
+            link.post(self, 'gatt_read_response', handle, attribute.value)
+
+    def on_gatt_write(self, link, handle, value, need_rsp):
+        """ Write request (or command if need_rsp is False) of the central. """
+        session = self._link_session(link)
+        attribute = self._get_attribute(handle)
+        if not session or not attribute:
+            if need_rsp:
+                link.post(self, 'gatt_write_response', handle, False)
+        elif need_rsp and attribute.permissions & BleInterface.AttPermissions.WRITE_AUTHORIZATION:
+            self._pending_writes[(session.session_id, handle)] = value
+            self.send_line('+SRBLEWRITE_REQ: {},{},0,{},"{}"'.format(
+                session.session_id, handle, len(value), escape(value)))
+        else:
+            attribute.value = value
+            self.send_line('+SRBLEWRITE_IND: {},{},0,{},"{}"'.format(
+                session.session_id, handle, len(value), escape(value)))
+            if need_rsp:
+                link.post(self, 'gatt_write_response', handle, True)
+
+    def on_bc_smart_data(self, link, data):
+        """ BC Smart data sent by the central. """
+        session = self._link_session(link)
+        if session:
+            self.send_line('+SRBCSMARTRECV: {},0,"{}"'.format(session.session_id, escape(data)))
+
+    def on_remote_command(self, link, command):
+        """ BC Smart remote command sent by the central. """
+        session = self._link_session(link)
+        if session and session.session_id == self._remote_controller:
+            self.send_line('+SRREMCMD: "{}"'.format(command))
+            link.post(self, 'remote_command_response', self.execute(command))
@@ -0,0 +1,456 @@
+#!/usr/bin/python
+
+""" Melody emulator.
+
+It contains the MelodyEmulator class, which emulates the ASCII commands of a
+BC127 board (see sr_framework/device/melody.py) on a pseudo-terminal.
+"""
+
+import time
+from sr_framework.device.ble import BleInterface
+from sr_framework.emulator.ble_link import BleLink, BLE_REASON_REMOTE_USER, BLE_REASON_LOCAL_HOST
+from sr_framework.emulator.pty_device import PtyDevice
+
+# Error codes.
+BC127_ERROR_UNKNOWN_COMMAND = 'ERROR 0x0012'
+BC127_ERROR_INVALID_PARAMETER = 'ERROR 0x0014'
+
+# Configuration after RESTORE (GET/SET <config>).
+BC127_DEFAULT_CONFIG = {
+    'BLE_CONFIG': '0 ON 23 OFF',
+    'UART_CONFIG': '9600 OFF 0',
+}
+
+# BLE link identifiers: link index (high nibble) and BLE profile (low nibble).
+BC127_BLE_LINK_IDS = tuple((index << 4) | 0x4 for index in range(1, 8))
+
+# RSSI (in -dBm) of the emulators reported by the scans.
+BC127_DEFAULT_RSSI = 50
+
+
+class MelodyError(Exception):
+    """ Raised by the command handlers to return an error code. """
+    def __init__(self, code=BC127_ERROR_INVALID_PARAMETER):
+        super().__init__(code)
+        self.code = code
+
+
+def _melody_address(addr):
+    """ Convert "00:11:22:AA:BB:CC" to "001122AABBCC". """
+    return addr.replace(':', '')
+
+
+def _standard_address(addr):
+    """ Convert "001122AABBCC" to "00:11:22:AA:BB:CC". """
+    return ':'.join(addr[i:i + 2] for i in range(0, len(addr), 2)).upper()
+
+
+def _hex(data):
+    """ Convert b'\\x00\\x1F' to "001F". """
+    return ''.join('{:02X}'.format(x) for x in data)
+
+
+def _ad_structures(data):
+    """ Returns the AD structures of advertising data, as {ad type: value}. """
+    structures = {}
+    i = 0
+    while i + 1 < len(data) and data[i]:
+        structures[data[i + 1]] = data[i + 2:i + 1 + data[i]]
+        i += 1 + data[i]
+    return structures
+
+
+class MelodyEmulator(PtyDevice):
+    """ BC127 emulator.
+
+        It implements the commands used by the Melody class and the central
+        side of the BLE links (see ble_link.py): the advertisers and the
+        peripheral to connect to are found through the Air.
+
+        The scans report every advertiser (emulators and virtual advertisers)
+        every scan_interval seconds, so that the scan load is reproducible.
+
+        Attributes:
+            bdaddr (str): BLE address.
+            advertising (bool): True if advertising (scans only, the
+                peripheral role is not emulated).
+            adv_data (bytes): Advertising data.
+            scan_resp_data (bytes): Scan response data.
+            advertisers (list of VirtualAdvertiser): Advertisers reported by
+                the scans, in addition to the emulators of the Air.
+            scan_interval (float): Interval between the scan reports of an
+                advertiser (in seconds).
+            time_scale (float): Factor applied to the scan durations, e.g. 0.1
+                to end a 10 seconds scan after 1 second.
+    """
+
+    MANUFACTURER = 'Sierra Wireless'
+    MODEL = 'BC127'
+    REVISION = 'Melody Audio V7.2'
+    BAUDRATE = 9600
+
+    EOL = (b'\r',)
+
+    def __init__(self, bdaddr='20:FA:BB:00:01:80', air=None, advertisers=(),
+                 scan_interval=1.0, time_scale=1.0):
+        super().__init__()
+        self.bdaddr = bdaddr
+        self.air = air
+        self.advertisers = list(advertisers)
+        self.scan_interval = scan_interval
+        self.time_scale = time_scale
+        self._saved_config = dict(BC127_DEFAULT_CONFIG)
+        self._links = {}
+        self._scan_id = 0
+        self._commands = {
+            'RESET': self._cmd_reset,
+            'RESTORE': self._cmd_restore,
+            'WRITE': self._cmd_write,
+            'UNPAIR': lambda args: [],
+            'HELP': self._cmd_help,
+            'VERSION': self._cmd_version,
+            'GET': self._cmd_get,
+            'SET': self._cmd_set,
+            'STATUS': self._cmd_status,
+            'ADVERTISING': self._cmd_advertising,
+            'SSRD': self._cmd_ssrd,
+            'SCAN': self._cmd_scan,
+            'OPEN': self._cmd_open,
+            'CLOSE': self._cmd_close,
+            'BLE_GET_SERV': self._cmd_ble_get_serv,
+            'BLE_GET_CHAR': self._cmd_ble_get_char,
+            'BLE_READ': self._cmd_ble_read,
+            'BLE_WRITE': self._cmd_ble_write,
+            'SEND_RAW': self._cmd_send_raw,
+            'BC_SMART_COMMAND': self._cmd_bc_smart_command,
+        }
+        self._reset()
+        if air:
+            air.register(self)
+
+    def _reset(self):
+        """ Reset the runtime state, as after a reboot. """
+        for link in self._links.values():
+            link.post(self, 'disconnect', BLE_REASON_LOCAL_HOST)
+        self._links = {}
+        self._scan_id += 1
+        self._config = dict(self._saved_config)
+        self.advertising = False
+        self.adv_data = b''
+        self.scan_resp_data = b''
+
+    @property
+    def addr_type(self):
+        """ BLE address type (BLE_CONFIG). """
+        if self._config['BLE_CONFIG'].split()[3] == 'ON':
+            return BleInterface.LE_BDADDR_TYPE_PRIVATE
+        return BleInterface.LE_BDADDR_TYPE_PUBLIC
+
+    @property
+    def local_mtu(self):
+        """ ATT MTU supported (BLE_CONFIG). """
+        return int(self._config['BLE_CONFIG'].split()[2])
+
+    def send_line(self, line):
+        """ Send a response line to the framework. """
+        self.write(line.encode('ascii', errors='backslashreplace') + b'\r')
+
+
+    # COMMANDS.
+
+    def handle_command(self, command):
+        """ Execute a command and send its response. """
+        words = command.strip().split(' ')
+        handler = self._commands.get(words[0].upper())
+        if handler is None:
+            self.send_line(BC127_ERROR_UNKNOWN_COMMAND)
+            return
+        try:
+            lines = handler(words[1:])
+        except MelodyError as error:
+            lines = [error.code]
+        except (ValueError, IndexError, KeyError):
+            lines = [BC127_ERROR_INVALID_PARAMETER]
+        else:
+            if lines is None:
+                # final result sent by the handler
+                return
+            lines = lines + ['OK']
+        for line in lines:
+            self.send_line(line)
+
+    def _pending(self, length, callback):
+        """ Send PENDING and pass the next length bytes received to callback. """
+        self.send_line('PENDING')
+        self.read_raw(length, callback)
+
+    def _cmd_reset(self, args):
+        self._reset()
+        for line in self._version():
+            self.send_line(line)
+        self.send_line('Ready')
+        return None
+
+    def _cmd_restore(self, args):
+        self._saved_config = dict(BC127_DEFAULT_CONFIG)
+        return self._cmd_reset(args)
+
+    def _cmd_write(self, args):
+        self._saved_config = dict(self._config)
+        return []
+
+    def _cmd_help(self, args):
+        return list(self._commands)
+
+    def _version(self):
+        return ['{} Copyright 2018'.format(self.MANUFACTURER), self.REVISION, 'Build: 1']
+
+    def _cmd_version(self, args):
+        return self._version()
+
+    def _cmd_get(self, args):
+        if args[0] == 'LOCAL_ADDR':
+            return ['LOCAL_ADDR={0} {0}'.format(_melody_address(self.bdaddr))]
+        return ['{}={}'.format(args[0], self._config[args[0]])]
+
+    def _cmd_set(self, args):
+        config, value = ' '.join(args).split('=', 1)
+        if config not in self._config or \
+                len(value.split()) != len(self._config[config].split()):
+            raise MelodyError()
+        self._config[config] = value
+        return []
+
+    def _cmd_status(self, args):
+        lines = ['STATE {}'.format('CONNECTED' if self._links else 'IDLE')]
+        lines += ['LINK {:X} CONNECTED BLE {} {}'.format(
+            link_id, _melody_address(link.peripheral.bdaddr), link.mtu)
+                  for link_id, link in sorted(self._links.items()) if link.sessions.get(self)]
+        return lines
+
+    def _cmd_advertising(self, args):
+        if args[0] in ('ON', 'OFF'):
+            self.advertising = args[0] == 'ON'
+            return []
+        self._pending(int(args[0]), self._set_adv_data)
+        return None
+
+    def _set_adv_data(self, data):
+        self.adv_data = data
+        self.send_line('OK')
+
+    def _cmd_ssrd(self, args):
+        self._pending(int(args[0]), self._set_scan_resp_data)
+        return None
+
+    def _set_scan_resp_data(self, data):
+        self.scan_resp_data = data
+        self.send_line('OK')
+
+
+    # SCAN.
+
+    def _scan_lines(self, advertiser, rssi, raw):
+        """ Returns the SCAN (or SCAN_RAW) lines reporting an advertiser. """
+        addr = _melody_address(advertiser.bdaddr)
+        if raw:
+            return ['SCAN_RAW {} {} -{}dBm {} {}'.format(
+                addr, advertiser.addr_type, rssi, len(data),
+                ' '.join('{:02X}'.format(x) for x in data))
+                    for data in (advertiser.adv_data, advertiser.scan_resp_data) if data]
+        structures = _ad_structures(advertiser.adv_data)
+        name = structures.get(0x09) or structures.get(0x08) or b''
+        flags = structures.get(0x01, b'\x00')[0]
+        return ['SCAN {} {} <{}> {:02X} -{}dBm'.format(
+            addr, advertiser.addr_type, name.decode('ascii', errors='replace'), flags, rssi)]
+
+    def _scan_report(self, scan_id, end, raw):
+        """ Report the advertisers, until the end of the scan. """
+        if scan_id != self._scan_id:
+            # scan stopped by a reset
+            return
+        advertisers = [(emulator, BC127_DEFAULT_RSSI)
+                       for emulator in (self.air.advertisers(self) if self.air else [])]
+        advertisers += [(advertiser, advertiser.rssi) for advertiser in self.advertisers]
+        for advertiser, rssi in advertisers:
+            for line in self._scan_lines(advertiser, rssi, raw):
+                self.send_line(line)
+        remaining = end - time.monotonic()
+        if remaining > self.scan_interval:
+            self.schedule(self.scan_interval, self._scan_report, scan_id, end, raw)
+        else:
+            self.schedule(max(remaining, 0), self._scan_complete, scan_id)
+
+    def _scan_complete(self, scan_id):
+        if scan_id == self._scan_id:
+            self.send_line('SCAN_OK')
+
+    def _cmd_scan(self, args):
+        duration = int(args[0]) * self.time_scale
+        raw = len(args) > 1 and args[1] == 'ON'
+        self._scan_id += 1
+        self._scan_report(self._scan_id, time.monotonic() + duration, raw)
+        return None
+
+
+    # BLE LINKS (central side, see ble_link.py).
+
+    def _get_link(self, link_id):
+        link = self._links.get(int(link_id, 16))
+        if link is None or not link.sessions.get(self):
+            raise MelodyError()
+        return link
+
+    def _cmd_open(self, args):
+        addr = _standard_address(args[0])
+        if args[1] != 'BLE':
+            raise MelodyError()
+        link_id = next(i for i in BC127_BLE_LINK_IDS if i not in self._links)
+        peripheral = self.air.find(addr) if self.air else None
+        self.send_line('PENDING')
+        if peripheral is None or not hasattr(peripheral, 'on_connect'):
+            self.send_line('OPEN_ERROR {}'.format(args[0]))
+            return None
+        link = BleLink(self, peripheral, self.local_mtu)
+        # the link is connected when its link id is set
+        link.sessions[self] = None
+        self._links[link_id] = link
+        link.post(self, 'connect')
+        return None
+
+    def _cmd_close(self, args):
+        link_id = int(args[0], 16)
+        link = self._get_link(args[0])
+        del self._links[link_id]
+        self.send_line('OK')
+        link.post(self, 'disconnect', BLE_REASON_REMOTE_USER)
+        self._send_link_line('CLOSE_OK', link_id, link)
+        return None
+
+    def _send_link_line(self, event, link_id, link):
+        """ Send an OPEN_OK or CLOSE_OK line. """
+        self.send_line('{} {:X} BLE {}'.format(
+            event, link_id, _melody_address(link.peripheral.bdaddr)))
+
+    def _link_id(self, link):
+        for link_id, current in self._links.items():
+            if current is link:
+                return link_id
+        return None
+
+    def on_connected(self, link):
+        """ Connection complete. """
+        link_id = self._link_id(link)
+        if link_id is not None:
+            link.sessions[self] = link_id
+            self._send_link_line('OPEN_OK', link_id, link)
+
+    def on_disconnect(self, link, reason):
+        """ Disconnection by the peripheral (or connection refused). """
+        link_id = self._link_id(link)
+        if link_id is None:
+            return
+        del self._links[link_id]
+        if link.sessions.get(self):
+            self._send_link_line('CLOSE_OK', link_id, link)
+        else:
+            self.send_line('OPEN_ERROR {}'.format(_melody_address(link.peripheral.bdaddr)))
+
+
+    # GATT CLIENT.
+
+    def _cmd_ble_get_serv(self, args):
+        self._get_link(args[0]).post(self, 'gatt_discover_services')
+        return None
+
+    def on_gatt_services(self, link, services):
+        """ Primary services discovered, as (uuid, start handle, end handle). """
+        link_id = self._link_id(link)
+        if link_id is not None:
+            for uuid, start, end in services:
+                self.send_line('BLE_SERV {:X} PRIMARY {} {:04X} {:04X}'.format(
+                    link_id, uuid, start, end))
+            self.send_line('OK')
+
+    def _cmd_ble_get_char(self, args):
+        self._get_link(args[0]).post(self, 'gatt_discover_characteristics')
+        return None
+
+    def on_gatt_characteristics(self, link, characteristics):
+        """ Characteristics discovered, as (uuid, properties, value handle). """
+        link_id = self._link_id(link)
+        if link_id is not None:
+            for uuid, properties, handle in characteristics:
+                self.send_line('BLE_CHAR {:X} CHAR {} {:04X} {:02X}'.format(
+                    link_id, uuid, handle, properties))
+            self.send_line('OK')
+
+    def _cmd_ble_read(self, args):
+        link = self._get_link(args[0])
+        self.send_line('PENDING')
+        link.post(self, 'gatt_read', int(args[1], 16))
+        return None
+
+    def _send_value(self, event, link, handle, value):
+        """ Send a BLE_READ_RES, BLE_NOTIFICATION or BLE_INDICATION line. """
+        link_id = self._link_id(link)
+        if link_id is not None:
+            self.send_line('{} {:X} {:04X} {} {}'.format(
+                event, link_id, handle, len(value), _hex(value)))
+
+    def on_gatt_read_response(self, link, handle, value):
+        """ Read response, value is None if the read is rejected. """
+        if value is not None:
+            self._send_value('BLE_READ_RES', link, handle, value)
+        elif self._link_id(link) is not None:
+            self.send_line('ERROR')
+
+    def _cmd_ble_write(self, args):
+        link = self._get_link(args[0])
+        handle = int(args[1], 16)
+        self._pending(int(args[2], 16),
+                      lambda value: link.post(self, 'gatt_write', handle, value, True))
+        return None
+
+    def on_gatt_write_response(self, link, handle, accepted):
+        """ Write response. """
+        if self._link_id(link) is not None:
+            self.send_line('OK' if accepted else 'ERROR')
+
+    def on_gatt_notification(self, link, handle, value):
+        """ Notification of the peripheral. """
+        self._send_value('BLE_NOTIFICATION', link, handle, value)
+
+    def on_gatt_indication(self, link, handle, value):
+        """ Indication of the peripheral (confirmed automatically). """
+        self._send_value('BLE_INDICATION', link, handle, value)
+
+
+    # BC SMART CLIENT.
+
+    def _cmd_send_raw(self, args):
+        link = self._get_link(args[0])
+        self._pending(int(args[1], 16), lambda data: self._send_raw(link, data))
+        return None
+
+    def _send_raw(self, link, data):
+        link.post(self, 'bc_smart_data', data)
+        self.send_line('OK')
+
+    def on_bc_smart_data(self, link, data):
+        """ BC Smart data sent by the peripheral. """
+        link_id = self._link_id(link)
+        if link_id is not None:
+            # raw data, which may contain end of line characters
+            self.write(b'\r\nRECV %X %d ' % (link_id, len(data)) + bytes(data) + b'\r\n')
+
+    def _cmd_bc_smart_command(self, args):
+        self._get_link(args[0]).post(self, 'remote_command', ' '.join(args[1:]))
+        return []
+
+    def on_remote_command_response(self, link, lines):
+        """ Response lines of a BC Smart remote command. """
+        link_id = self._link_id(link)
+        if link_id is not None:
+            for line in lines:
+                self.send_line('BC_SMART_CMD_RESP {:X} {} {}'.format(link_id, len(line), line))
@@ -0,0 +1,158 @@
+#!/usr/bin/python
+
+""" Pseudo-terminal device.
+
+This module contains the PtyDevice class, the base class of the board
+emulators. The emulated board is exposed on a pseudo-terminal, which is
+opened by the framework (SerialPort) as any serial port (Linux only).
+"""
+
+import collections
+import heapq
+import os
+import select
+import threading
+import time
+import tty
+from sr_framework.utils.device_manager import Device
+
+# Maximum number of bytes read from the pseudo-terminal at once.
+PTY_READ_SIZE = 4096
+
+
+class PtyDevice:
+    """ Board emulator exposed on a pseudo-terminal.
+
+        All the emulator code runs in the device thread: the data received
+        from the pseudo-terminal is passed to receive(), the functions posted
+        (post()) and the timers scheduled (schedule()) are called from it.
+        Other threads (e.g. other emulators) shall only call post(), so the
+        emulator state does not need any lock.
+
+        Attributes:
+            port (str): Path of the pseudo-terminal, to be opened by the framework.
+    """
+
+    MANUFACTURER = ''
+    MODEL = ''
+    REVISION = ''
+    BAUDRATE = 115200
+
+    # Line terminators of the commands received.
+    EOL = (b'\r', b'\n')
+
+    def __init__(self):
+        self._master, self._slave = os.openpty()
+        # the slave is kept open so the master can be read while the framework
+        # closes and opens the serial port.
+        tty.setraw(self._slave)
+        self.port = os.ttyname(self._slave)
+        self._wakeup_r, self._wakeup_w = os.pipe()
+        self._calls = collections.deque()
+        self._timers = []
+        self._timer_seq = 0
+        self._rx = bytearray()
+        self._raw_length = 0
+        self._raw_callback = None
+        self._running = False
+        self._thread = None
+
+    def device(self):
+        """ Returns the Device to register in the DeviceManager. """
+        return Device(self.MANUFACTURER, self.MODEL, self.REVISION, self.port, str(self.BAUDRATE))
+
+    def start(self):
+        """ Start the device thread. """
+        if self._thread and self._thread.is_alive():
+            return
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name=self.port)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        """ Stop the device thread and close the pseudo-terminal. """
+        self._running = False
+        self._wakeup()
+        if self._thread:
+            self._thread.join()
+        for fd in (self._master, self._slave, self._wakeup_r, self._wakeup_w):
+            os.close(fd)
+
+    def post(self, function, *args):
+        """ Call function(*args) from the device thread (thread safe). """
+        self._calls.append((function, args))
+        self._wakeup()
+
+    def schedule(self, delay, function, *args):
+        """ Call function(*args) from the device thread in delay seconds.
+        Shall be called from the device thread. """
+        self._timer_seq += 1
+        heapq.heappush(self._timers, (time.monotonic() + delay, self._timer_seq, function, args))
+
+    def write(self, data):
+        """ Write data (bytes) to the framework. """
+        view = memoryview(data)
+        while view:
+            written = os.write(self._master, view)
+            view = view[written:]
+
+    def send_line(self, line):
+        """ Send a response line to the framework. """
+        self.write(b'\r\n' + line.encode('ascii', errors='backslashreplace') + b'\r\n')
+
+    def read_raw(self, length, callback):
+        """ Pass the next length bytes received to callback(data), instead of
+        splitting them in command lines. Shall be called from the device thread. """
+        self._raw_length = length
+        self._raw_callback = callback
+
+    def receive(self, data):
+        """ Handle the data received from the framework, split in command lines
+        (or passed to the read_raw() callback). """
+        self._rx += data
+        while True:
+            if self._raw_callback:
+                if len(self._rx) < self._raw_length:
+                    return
+                raw = bytes(self._rx[:self._raw_length])
+                del self._rx[:self._raw_length]
+                callback, self._raw_callback = self._raw_callback, None
+                callback(raw)
+                continue
+            eol = min((pos for pos in (self._rx.find(char) for char in self.EOL) if pos >= 0),
+                      default=-1)
+            if eol < 0:
+                return
+            line = bytes(self._rx[:eol])
+            del self._rx[:eol + 1]
+            if line:
+                self.handle_command(line.decode('ascii', errors='backslashreplace'))
+
+    def handle_command(self, command):
+        """ Handle a command line received from the framework. """
+        raise NotImplementedError
+
+    def _wakeup(self):
+        try:
+            os.write(self._wakeup_w, b'\0')
+        except OSError:
+            pass
+
+    def _run(self):
+        while self._running:
+            timeout = None
+            if self._timers:
+                timeout = max(self._timers[0][0] - time.monotonic(), 0)
+            readable, _, _ = select.select([self._master, self._wakeup_r], [], [], timeout)
+            if self._wakeup_r in readable:
+                os.read(self._wakeup_r, PTY_READ_SIZE)
+            while self._calls:
+                function, args = self._calls.popleft()
+                function(*args)
+            if self._master in readable:
+                self.receive(os.read(self._master, PTY_READ_SIZE))
+            now = time.monotonic()
+            while self._timers and self._timers[0][0] <= now:
+                _, _, function, args = heapq.heappop(self._timers)
+                function(*args)
@@ -0,0 +1,311 @@
+#!/usr/bin/python
+
+""" AT command engine.
+
+This module contains the AtCommandEngine class, which sends AT commands over a
+serial port and returns an AtTransaction per command, holding the response
+lines received between the command and its final result code.
+"""
+
+from sr_framework.utils.rx_buffer import RxBuffer, compile_regex, decode_groups, findall_result
+
+# Default maximum number of pipelined commands waiting for their final result code.
+DEFAULT_PIPELINE_DEPTH = 4
+
+
+def format_execute(command):
+    """ Returns the execute AT command, e.g. 'AT+SRBLE'. """
+    return 'AT{}'.format(command)
+
+
+def format_query(command):
+    """ Returns the read AT command, e.g. 'AT+SRBLE?'. """
+    return 'AT{}?'.format(command)
+
+
+def format_write(command, args):
+    """ Returns the write AT command, e.g. 'AT+SRBLE=1,,2'. """
+    return 'AT{}={}'.format(command, ','.join(
+        (str(x) if x is not None else '') for x in args))
+
+
+def _echo(command):
+    """ Returns the echo of a command, as received (bytes). """
+    return command.encode('ascii', errors='backslashreplace')
+
+
+class AtTransaction:
+    """ AT command sent and its response.
+
+        Attributes:
+            command (str): Command sent, without end of line character.
+            result (int): Index of the final result code received, in the final
+                result codes of the command. None if the command timed out.
+            final (str): Final result code line received, None on timeout.
+            lines (list of bytes): Lines received between the command (echo)
+                and its final result code.
+            start (int): Absolute index of the first line of the response in
+                the serial rx buffer.
+            end (int): Absolute index following the final result code.
+    """
+    def __init__(self, command, start):
+        self.command = command
+        self.result = None
+        self.final = None
+        self.lines = []
+        self.start = start
+        self.end = start
+        self._data = None
+
+    @property
+    def data(self):
+        """ The response lines, joined (bytes). """
+        if self._data is None:
+            self._data = b''.join(self.lines)
+        return self._data
+
+    @property
+    def text(self):
+        """ The response lines, decoded to text. """
+        return RxBuffer.decode(self.data)
+
+    def append(self, line):
+        """ Append a line (bytes) to the response. """
+        self.lines.append(line)
+        self._data = None
+
+    def search(self, regex):
+        """ Search the regular expression regex in the response.
+        Returns match groups if found, None otherwise. """
+        match = compile_regex(regex).search(self.data)
+        if match:
+            return decode_groups(match)
+        return None
+
+    def search_all(self, regex):
+        """ Search all the occurrences of the regular expression regex in the response.
+        Returns list of matches, in the re.findall() format. """
+        pattern = compile_regex(regex)
+        return findall_result(pattern, pattern.finditer(self.data))
+
+    def __str__(self):
+        return 'AtTransaction: command="%s", result=%s, final="%s"' % (
+            self.command, self.result, self.final)
+
+
+class AtCommandEngine:
+    """ Sends AT commands and correlates each command with its response.
+
+        The position of the serial rx buffer is recorded before sending the
+        command, and only the lines received after it are checked for the final
+        result codes, each line once. The rx buffer does not need to be cleared.
+
+        Attributes:
+            eol (str): End of line character appended to the commands.
+            timeout (float): Default command timeout (in seconds).
+    """
+    def __init__(self, serial_port, eol='\r', timeout=2):
+        self._serial = serial_port
+        self.eol = eol
+        self.timeout = timeout
+
+    def send(self, command, final_results, timeout=None):
+        """ Send a command and wait for its final result code.
+
+        Args:
+            command: Command to send (str), without end of line character.
+            final_results: Prefixes of the final result codes of the command
+                (e.g. ('OK', 'ERROR', '+CME')). The first prefix matching is
+                the result of the transaction.
+            timeout: Command timeout (in seconds), the engine timeout if None.
+
+        Returns:
+            AtTransaction: The transaction, result is None on timeout.
+        """
+        transaction = self.start(command)
+        self.read_response(transaction, final_results, timeout)
+        return transaction
+
+    def start(self, command):
+        """ Send a command without waiting for its final result code, the response
+        is read with read_response() or iter_response().
+
+        Args:
+            command: Command to send (str), without end of line character.
+
+        Returns:
+            AtTransaction: The transaction, result is None until the response is read.
+        """
+        transaction = AtTransaction(command, self._serial.serial_rx_mark())
+        self._serial.serial_write_data(command + self.eol)
+        return transaction
+
+    def read_response(self, transaction, final_results, timeout=None):
+        """ Wait for the final result code of a transaction started with start(),
+        reading its response from the last line read (see iter_response()).
+        See send() for final_results and timeout. """
+        self._read_response(transaction, final_results,
+                            self.timeout if timeout is None else timeout,
+                            {_echo(transaction.command)})
+
+    def iter_response(self, transaction, final_results, timeout=None):
+        """ Yield the response lines (bytes, without the echo) of a transaction started
+        with start() as they arrive, until its final result code or timeout.
+        See send() for final_results and timeout.
+
+        The transaction is updated with each line read. If the iteration is stopped
+        before the final result code, its result is None and the rest of the
+        response can be read with read_response().
+        """
+        echo = _echo(transaction.command)
+        prefixes = [prefix.encode('ascii') for prefix in final_results]
+        for index, line in self._serial.serial_iter_lines(
+                transaction.end, self.timeout if timeout is None else timeout):
+            transaction.end = index + 1
+            for i, prefix in enumerate(prefixes):
+                if line.startswith(prefix):
+                    transaction.result = i
+                    transaction.final = RxBuffer.decode(line.strip())
+                    return
+            if line.strip() != echo:
+                transaction.append(line)
+                yield line
+
+    def send_pipelined(self, commands, depth=DEFAULT_PIPELINE_DEPTH):
+        """ Send commands without waiting for the final result code of the previous
+        ones, with at most depth commands in flight. The responses are correlated with
+        the commands in order: each final result code completes the oldest command in flight.
+
+        The final result codes of the commands shall not be empty: any line (e.g. the
+        echo of the next command) would complete the command, and its final result
+        code the next one. The commands resetting the device shall not be pipelined
+        either (see AtBatch): the commands sent after them would be lost.
+
+        Args:
+            commands: List of tuples (command, final_results, timeout), see send().
+            depth: Maximum number of commands sent and waiting for their final result code.
+
+        Returns:
+            list of AtTransaction: The transactions, in the order of the commands. If a
+            command times out, the responses of the following commands can not be
+            correlated anymore: no more commands are sent and the result of the
+            following transactions is None.
+
+        Raises:
+            ValueError: If a final result code of a command is empty, nothing is sent.
+        """
+        for command, final_results, _ in commands:
+            if not all(final_results):
+                raise ValueError('%s can not be pipelined (empty final result code)' % command)
+        transactions = []
+        start = self._serial.serial_rx_mark()
+        sent = 0
+        for i, (command, final_results, timeout) in enumerate(commands):
+            if sent - i < depth and sent < len(commands):
+                # fill the pipeline, with a single write
+                window = commands[sent:i + depth]
+                self._serial.serial_write_data(
+                    ''.join(pending[0] + self.eol for pending in window))
+                sent += len(window)
+            transaction = AtTransaction(command, start)
+            transactions.append(transaction)
+            # the echoes of the commands in flight might be received in any response
+            echoes = {_echo(pending[0]) for pending in commands[i:sent]}
+            self._read_response(transaction, final_results,
+                                self.timeout if timeout is None else timeout, echoes)
+            if transaction.result is None:
+                break
+            start = transaction.end
+        transactions.extend(AtTransaction(command, start)
+                            for command, _, _ in commands[len(transactions):])
+        return transactions
+
+    def _read_response(self, transaction, final_results, timeout, echoes):
+        """ Wait for the final result code of the transaction and store its response,
+        without the echo lines. """
+        result, lines, final, end = self._serial.serial_read_response(
+            transaction.end, final_results, timeout)
+        transaction.result = result
+        for line in lines:
+            if line.strip() not in echoes:
+                transaction.append(line)
+        transaction.end = end
+        if final is not None:
+            transaction.final = RxBuffer.decode(final.strip())
+
+
+class AtBatch:
+    """ Queue of AT commands, sent pipelined (see AtCommandEngine.send_pipelined)
+        when the batch exits, or when send() is called.
+
+        Usage:
+            with dut.batch() as batch:
+                batch.write('+KGPIOCFG', [14, 1, 1])
+                batch.write('+KGPIOCFG', [16, 1, 1])
+            assert all(result == EDD_RESULT_SUCCESS for result in batch.results)
+
+        Attributes:
+            transactions (list of AtTransaction): Transactions of the commands sent.
+            results (list of int): Result codes of the commands sent, in the order
+                of the commands.
+    """
+    def __init__(self, engine, get_final_results, get_result, depth=DEFAULT_PIPELINE_DEPTH,
+                 prepare_command=None):
+        """
+        Args:
+            engine: AtCommandEngine used to send the commands.
+            get_final_results: Function returning the final result code prefixes of a command.
+            get_result: Function returning the result code of an AtTransaction.
+            depth: Maximum number of commands in flight.
+            prepare_command: Function called with each command (e.g. '+RST') before the
+                commands are sent, raising ValueError for the commands which can not be
+                pipelined. None if all the commands can be pipelined.
+        """
+        self._engine = engine
+        self._get_final_results = get_final_results
+        self._get_result = get_result
+        self._depth = depth
+        self._prepare_command = prepare_command
+        self._commands = []
+        self.transactions = []
+        self.results = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.send()
+        return False
+
+    def _queue(self, command, at_command, timeout):
+        self._commands.append((command, at_command, self._get_final_results(command), timeout))
+        return len(self.transactions) + len(self._commands) - 1
+
+    def execute(self, command, timeout=None):
+        """ Queue an execute AT command. Returns the index of its result. """
+        return self._queue(command, format_execute(command), timeout)
+
+    def query(self, command, timeout=None):
+        """ Queue a read AT command. Returns the index of its result. """
+        return self._queue(command, format_query(command), timeout)
+
+    def write(self, command, args, timeout=None):
+        """ Queue a write AT command. Returns the index of its result. """
+        return self._queue(command, format_write(command, args), timeout)
+
+    def send(self):
+        """ Send the commands queued, and wait for their final result codes.
+        Returns the result codes of all the commands sent by the batch.
+        Raises ValueError if a command can not be pipelined, none of the commands
+        queued is sent. """
+        commands, self._commands = self._commands, []
+        if self._prepare_command is not None:
+            for command, _, _, _ in commands:
+                self._prepare_command(command)
+        transactions = self._engine.send_pipelined(
+            [(at_command, final_results, timeout)
+             for _, at_command, final_results, timeout in commands], self._depth)
+        self.transactions.extend(transactions)
+        self.results.extend(self._get_result(transaction) for transaction in transactions)
+        return self.results
@@ -0,0 +1,247 @@
+#!/usr/bin/python
+
+""" Device discovery module.
+
+This module is used to discover the devices connected to the serial ports:
+the ports are probed in parallel (one thread per port) at the known
+baudrates, and the boards identified with +FMI/+FMM/+FMR (Eddington, Euler)
+or VERSION (Melody).
+
+The devices discovered are kept in an inventory file (same format as
+devices.json), keyed by the USB serial number of their port: the ports of
+the inventory are not probed again on the next runs, even if renumbered.
+The processes discovering devices with the same inventory file (e.g. the
+pytest-xdist workers) run one at a time, the next ones reading the devices
+discovered by the first one.
+
+Usage:
+    python3 -m sr_framework.utils.device_discovery --inventory inventory.json
+"""
+
+import argparse
+import json
+import os
+import re
+import tempfile
+import time
+import warnings
+from concurrent.futures import ThreadPoolExecutor
+import serial
+import serial.tools.list_ports
+from sr_framework.utils.device_manager import DEFAULT_LEASE_DIR, LEASE_POLL_INTERVAL, \
+    DeviceLease
+
+# Baudrates tried, most frequent first.
+DEFAULT_BAUDRATES = (115200, 9600, 57600, 38400, 19200, 230400, 460800, 921600)
+# Response timeout of a probe command (in seconds).
+PROBE_TIMEOUT = 0.3
+# Maximum number of ports probed at the same time.
+MAX_PROBE_WORKERS = 32
+# Time to wait for a port leased by another process and not in the inventory (in seconds).
+LEASED_PORT_TIMEOUT = 30
+
+BC127_VERSION_REGEX = re.compile(r'([\w| ]+) Copyright \d+$')
+
+
+def _command(ser, command, timeout):
+    """ Send a command and returns its response lines (final result included),
+    None if no final result is received within timeout. """
+    ser.reset_input_buffer()
+    ser.write((command + '\r').encode('ascii'))
+    data = b''
+    end = time.monotonic() + timeout
+    while time.monotonic() < end:
+        data += ser.read(max(ser.in_waiting, 1))
+        lines = [line.strip() for line in
+                 re.split(r'[\r\n]+', data.decode('ascii', errors='replace'))]
+        lines = [line for line in lines if line and line != command]
+        if any(line == 'OK' or line.startswith(('ERROR', '+CME ERROR')) for line in lines):
+            return lines
+    return None
+
+
+def _identify_at(ser, timeout):
+    """ Returns (manufacturer, model, revision) of an Eddington or Euler board, None if not one. """
+    identity = []
+    for command in ('+FMI', '+FMM', '+FMR'):
+        lines = _command(ser, 'AT' + command, timeout)
+        if not lines or lines[-1] != 'OK' or len(lines) < 2:
+            return None
+        # response with or without the command prefix
+        identity.append(lines[0].split(command + ':', 1)[-1].strip())
+    return tuple(identity)
+
+
+def _identify_bc127(ser, timeout):
+    """ Returns (manufacturer, model, revision) of a Melody board, None if not one. """
+    lines = _command(ser, 'VERSION', timeout)
+    if not lines or lines[-1] != 'OK':
+        return None
+    for i, line in enumerate(lines[:-1]):
+        match = BC127_VERSION_REGEX.match(line)
+        if match and i + 1 < len(lines) - 1:
+            return match.group(1), 'BC127', lines[i + 1]
+    return None
+
+
+def probe_port(port, baudrates=DEFAULT_BAUDRATES, timeout=PROBE_TIMEOUT):
+    """ Identify the board connected to a serial port.
+
+    Args:
+        port: Serial port (e.g. 'COM35').
+        baudrates: Baudrates tried, in order.
+        timeout: Response timeout of each probe command (in seconds).
+
+    Returns:
+        dict: Device entry (devices.json format), None if no board identified.
+    """
+    for baudrate in baudrates:
+        try:
+            ser = serial.Serial(port, baudrate, timeout=timeout)
+        except (serial.SerialException, OSError):
+            return None
+        try:
+            # terminate the data received by the board at the previous baudrate
+            ser.write(b'\r')
+            time.sleep(0.05)
+            identity = _identify_at(ser, timeout) or _identify_bc127(ser, timeout)
+        except (serial.SerialException, OSError):
+            identity = None
+        finally:
+            try:
+                ser.rts = False  # if this is not set to False, BX310x resets
+            except (serial.SerialException, OSError):
+                pass  # no modem control lines (e.g. pseudo-terminal of an emulator)
+            ser.close()
+        if identity:
+            manufacturer, model, revision = identity
+            return {'manufacturer': manufacturer, 'model': model, 'revision': revision,
+                    'port': port, 'baud': str(baudrate)}
+    return None
+
+
+def _candidate_ports():
+    """ Returns {port: USB serial number (None if not USB)} of the serial ports of the host. """
+    return {info.device: info.serial_number for info in serial.tools.list_ports.comports()}
+
+
+def _load_inventory(inventory_file):
+    if not inventory_file or not os.path.exists(inventory_file):
+        return []
+    with open(inventory_file) as file:
+        return json.load(file)['devices']
+
+
+def _save_inventory(inventory_file, devices):
+    """ Write the inventory file atomically: the other processes never read a
+    partially written file. """
+    directory = os.path.dirname(os.path.abspath(inventory_file))
+    with tempfile.NamedTemporaryFile('w', dir=directory, suffix='.tmp', delete=False) as file:
+        json.dump({'devices': devices}, file, indent=4)
+    os.replace(file.name, inventory_file)
+
+
+def _lock_inventory(inventory_file):
+    """ Lock the inventory file, waiting for the other processes discovering the
+    devices. Returns the lock (DeviceLease) to release. """
+    path = os.path.abspath(inventory_file)
+    lock = DeviceLease(os.path.dirname(path), os.path.basename(path))
+    while not lock.acquire():
+        time.sleep(LEASE_POLL_INTERVAL)
+    return lock
+
+
+def discover_devices(ports=None, baudrates=DEFAULT_BAUDRATES, inventory_file=None,
+                     refresh=False, lease_dir=DEFAULT_LEASE_DIR,
+                     leased_port_timeout=LEASED_PORT_TIMEOUT):
+    """ Discover the devices connected to the serial ports.
+
+    The ports are probed in parallel, except the ports of the inventory (found
+    by USB serial number) unless refresh is True, and the ports leased by other
+    processes (see DeviceLease), whose inventory entries are kept. The ports
+    leased and not in the inventory are probed once released.
+
+    Args:
+        ports: Ports to probe, all the serial ports of the host if None.
+        baudrates: Baudrates tried, in order.
+        inventory_file: Inventory file (JSON), read and updated. None for no inventory.
+        refresh: True to probe the ports of the inventory again.
+        lease_dir: Directory of the lease lock files.
+        leased_port_timeout: Time to wait for a port leased by another process and
+            not in the inventory (in seconds).
+
+    Returns:
+        List of device entries (devices.json format, with the 'serial_number' of the port).
+    """
+    if not inventory_file:
+        return _discover_devices(ports, baudrates, None, refresh, lease_dir,
+                                 leased_port_timeout)
+    lock = _lock_inventory(inventory_file)
+    try:
+        return _discover_devices(ports, baudrates, inventory_file, refresh, lease_dir,
+                                 leased_port_timeout)
+    finally:
+        lock.release()
+
+
+def _discover_devices(ports, baudrates, inventory_file, refresh, lease_dir,
+                      leased_port_timeout):
+    serial_numbers = _candidate_ports()
+    if ports is not None:
+        serial_numbers = {port: serial_numbers.get(port) for port in ports}
+    inventory = {entry.get('serial_number') or entry['port']: entry
+                 for entry in _load_inventory(inventory_file)}
+    devices = []
+    to_probe = []
+    for port, serial_number in serial_numbers.items():
+        entry = inventory.get(serial_number or port)
+        if entry and not refresh:
+            devices.append(dict(entry, port=port))
+        else:
+            to_probe.append(port)
+
+    def probe(port):
+        lease = DeviceLease(lease_dir, port)
+        entry = inventory.get(serial_numbers[port] or port)
+        end = time.monotonic() + leased_port_timeout
+        while not lease.acquire():
+            # in use by another process
+            if entry:
+                return entry
+            if time.monotonic() >= end:
+                warnings.warn('%s leased by another process, not probed' % port)
+                return None
+            time.sleep(LEASE_POLL_INTERVAL)
+        try:
+            return probe_port(port, baudrates)
+        finally:
+            lease.release()
+
+    if to_probe:
+        with ThreadPoolExecutor(max_workers=min(len(to_probe), MAX_PROBE_WORKERS)) as executor:
+            for port, entry in zip(to_probe, executor.map(probe, to_probe)):
+                if entry:
+                    devices.append(dict(entry, port=port, serial_number=serial_numbers[port]))
+
+    if inventory_file:
+        _save_inventory(inventory_file, devices)
+    return devices
+
+
+def main():
+    """ Discover the devices and print them. """
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--inventory', help='inventory file (JSON), read and updated')
+    parser.add_argument('--refresh', action='store_true',
+                        help='probe the ports of the inventory again')
+    parser.add_argument('--port', action='append', dest='ports',
+                        help='port to probe (all the serial ports if not set)')
+    args = parser.parse_args()
+    for entry in discover_devices(args.ports, inventory_file=args.inventory,
+                                  refresh=args.refresh):
+        print('%(port)s: %(manufacturer)s %(model)s %(revision)s, %(baud)s bauds' % entry)
+
+
+if __name__ == '__main__':
+    main()
@@ -3,21 +3,78 @@
 """ Device Manager module.
 
 This module is used to managed the devices used by the test framework.
+
+The devices are leased across processes (DeviceLease): several test processes
+(e.g. pytest-xdist workers) sharing a devices.json get distinct devices.
 """
 
 import json
+import os
+import tempfile
+import time
+try:
+    import fcntl
+except ImportError:
+    # Windows
+    fcntl = None
+    import msvcrt
+from sr_framework.utils.helpers import get_valid_filename
+
+# Default directory of the lease lock files.
+DEFAULT_LEASE_DIR = os.path.join(tempfile.gettempdir(), 'sr_framework_leases')
+# Polling interval of the devices leased by other processes (in seconds).
+LEASE_POLL_INTERVAL = 0.5
+
+
+class DeviceLease:
+    """Cross-process lease of a device: exclusive lock of a lock file named after
+    its port. The lock is released by the OS when the process ends, even on a crash."""
+
+    def __init__(self, lease_dir, port):
+        self.path = os.path.join(lease_dir, get_valid_filename(port) + '.lock')
+        self._file = None
+
+    def acquire(self):
+        """Lock the device, without waiting. Returns True on success, False if
+        the device is leased by another process."""
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        file = open(self.path, 'a+')
+        try:
+            if fcntl:
+                fcntl.flock(file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            else:
+                file.seek(0)
+                msvcrt.locking(file.fileno(), msvcrt.LK_NBLCK, 1)
+        except OSError:
+            file.close()
+            return False
+        self._file = file
+        return True
+
+    def release(self):
+        """Unlock the device."""
+        file, self._file = self._file, None
+        if file is None:
+            return
+        if not fcntl:
+            file.seek(0)
+            msvcrt.locking(file.fileno(), msvcrt.LK_UNLCK, 1)
+        file.close()
 
 
 class Device:
     """Device class."""
 
-    def __init__(self, manufacturer, model, revision, port, baud):
+    def __init__(self, manufacturer, model, revision, port, baud, rig=None):
         self.manufacturer = manufacturer
         self.model = model
         self.revision = revision
         self.port = port
         self.baud = baud
+        # test rig of the device (e.g. a DUT and its remote device), None if not set.
+        self.rig = rig
         self._is_acquired = False
+        self._lease = None
 
     def __eq__(self, other):
         return (self.manufacturer == other.manufacturer and self.model == other.model and
@@ -31,7 +88,7 @@ class Device:
         return 'Manufacturer: ' + str(self.manufacturer) +\
             ', Model: ' + str(self.model) + ', Revision: ' + str(self.revision) +\
             ', Port: ' + self.port + ', Baud: ' + self.baud +\
-            ', Acquired: ' + str(self._is_acquired)
+            ', Rig: ' + str(self.rig) + ', Acquired: ' + str(self._is_acquired)
 
     def is_acquired(self):
         """Returns True is the device is acquired, False otherwise."""
@@ -42,16 +99,36 @@ class Device:
         self._is_acquired = True
 
     def release(self):
-        """Release device (i.e. unlock)."""
+        """Release device (i.e. unlock), and its lease."""
         self._is_acquired = False
+        if self._lease:
+            self._lease.release()
+            self._lease = None
+
+    def is_leased(self):
+        """Returns True if the device is leased by the current process, False otherwise."""
+        return self._lease is not None
+
+    def lease(self, lease_dir=DEFAULT_LEASE_DIR):
+        """Lease the device for the current process (see DeviceLease).
+        Returns True on success, False if leased by another process."""
+        if self._lease:
+            return True
+        lease = DeviceLease(lease_dir, self.port)
+        if not lease.acquire():
+            return False
+        self._lease = lease
+        return True
 
 
 class DeviceManager:
     """DeviceManager class."""
-    def __init__(self, deviceFile):
+    def __init__(self, deviceFile=None, lease_dir=DEFAULT_LEASE_DIR):
         self.devices = []
-        with open(deviceFile) as file:
-            self._add_devices_from_json(json.load(file))
+        self._lease_dir = lease_dir
+        if deviceFile:
+            with open(deviceFile) as file:
+                self._add_devices_from_json(json.load(file))
 
     def _add_devices_from_json(self, json_file):
         devices = json_file['devices']
@@ -62,7 +139,18 @@ class DeviceManager:
                     dev['model'],
                     dev['revision'],
                     dev['port'],
-                    dev['baud']))
+                    dev['baud'],
+                    dev.get('rig')))
+
+    def discover_devices(self, inventory_file=None, refresh=False, ports=None):
+        """Add the devices discovered on the serial ports (see
+        device_discovery.discover_devices). Returns the number of devices added."""
+        # imported here: device_discovery uses the leases of this module
+        from sr_framework.utils.device_discovery import discover_devices
+        devices = discover_devices(ports, inventory_file=inventory_file, refresh=refresh,
+                                   lease_dir=self._lease_dir)
+        self._add_devices_from_json({'devices': devices})
+        return len(devices)
 
     def _check_if_device_registered(self, device):
         for dev in self.devices:
@@ -76,9 +164,61 @@ class DeviceManager:
             raise Exception('Device already added.')
         self.devices.append(device)
 
-    def get_device(self, model, revision):
-        """Get a Device available from the DeviceManager, for the model and revision specified."""
+    def _rigs(self):
+        rigs = []
+        for dev in self.devices:
+            if dev.rig not in rigs:
+                rigs.append(dev.rig)
+        return rigs
+
+    def get_device(self, model, revision, rig=None):
+        """Get a Device available from the DeviceManager, for the model and revision specified
+        (and the rig, if not None). The device is leased for the current process: it is not
+        available to the other processes until released."""
         for dev in self.devices:
-            if not dev.is_acquired() and dev.model == model and dev.revision == revision:
+            if not dev.is_acquired() and not dev.is_leased() and dev.model == model and \
+                    dev.revision == revision and (rig is None or dev.rig == rig) and \
+                    dev.lease(self._lease_dir):
                 return dev
         return None
+
+    def get_devices(self, specs, timeout=0, rig=None):
+        """Get Devices available from the DeviceManager for all the specs, from the same rig
+        (e.g. a DUT and its remote device), leased for the current process.
+
+        Args:
+            specs: List of tuples (model, revision).
+            timeout: Time to wait for the devices leased by other processes (in seconds).
+            rig: Rig of the devices (e.g. the rig of a DUT leased before its remote
+                device), any rig if None.
+
+        Returns:
+            List of Devices, in the order of specs. None if not available.
+        """
+        end = time.monotonic() + timeout
+        while True:
+            for set_rig in self._rigs() if rig is None else [rig]:
+                devices = []
+                for model, revision in specs:
+                    dev = self.get_device(model, revision, set_rig)
+                    if dev is None:
+                        break
+                    devices.append(dev)
+                else:
+                    return devices
+                for dev in devices:
+                    dev.release()
+            if time.monotonic() >= end:
+                return None
+            time.sleep(LEASE_POLL_INTERVAL)
+
+    def count_device_sets(self, specs):
+        """Returns the number of disjoint sets of Devices for the specs (see get_devices),
+        leased or not, e.g. the number of test processes the devices can run."""
+        specs = [tuple(spec) for spec in specs]
+        count = 0
+        for rig in self._rigs():
+            count += min(sum(1 for dev in self.devices if dev.rig == rig and
+                             (dev.model, dev.revision) == spec) // specs.count(spec)
+                         for spec in set(specs))
+        return count
@@ -0,0 +1,70 @@
+#!/usr/bin/python
+
+""" Payload codec.
+
+This module contains the functions encoding and decoding the payloads of the
+board commands (advertising data, GATT values, BC Smart data):
+    - escaped strings of the AT commands, e.g. "\\01\\02Hi",
+    - hexadecimal strings of the BC127 events, e.g. "0102AB".
+
+The payloads to encode are bytes-like objects (bytes, bytearray, memoryview,
+any object supporting the buffer protocol) or iterables of ints. They are
+converted with bulk bytes operations, not byte per byte.
+"""
+
+import re
+
+# Encodings of the escaped strings (see escape()).
+ENCODING_ESCAPED = 'escaped'    # all the bytes escaped, e.g. '\\48\\69\\0A'
+ENCODING_COMPACT = 'compact'    # printable ASCII characters not escaped, e.g. 'Hi\\0A'
+ENCODINGS = (ENCODING_ESCAPED, ENCODING_COMPACT)
+
+# Escaped byte of an escaped string, e.g. '\\0A'.
+_ESCAPED_BYTE_REGEX = re.compile(r'\\([0-9A-Fa-f]{2})')
+
+# Characters escaped by the compact encoding: control, non ASCII, '\\' and '"'.
+_COMPACT_ESCAPED_REGEX = re.compile(r'[^\x20-\x7E]|[\\"]')
+
+
+def to_bytes(data):
+    """ Returns the payload data (bytes-like object or iterable of ints) as bytes. """
+    return data if isinstance(data, bytes) else bytes(data)
+
+
+def size(data):
+    """ Returns the size (in bytes) of the payload data. """
+    try:
+        return memoryview(data).nbytes
+    except TypeError:
+        return len(data)
+
+
+def escape(data, encoding=ENCODING_ESCAPED):
+    """ Returns the escaped string of data, e.g. [0x01, 0x48] => '\\01\\48', or
+    '\\01H' with ENCODING_COMPACT (up to 3 times shorter for text). """
+    data = to_bytes(data)
+    if encoding == ENCODING_COMPACT:
+        return _COMPACT_ESCAPED_REGEX.sub(lambda match: '\\%02X' % ord(match.group()),
+                                          data.decode('latin-1'))
+    return '\\' + data.hex('\\').upper() if data else ''
+
+
+def quote(data, encoding=ENCODING_ESCAPED):
+    """ Returns the escaped string of data between double quotes (AT command argument). """
+    return '"' + escape(data, encoding) + '"'
+
+
+def unescape(escaped_string):
+    """ Returns the bytes of an escaped string, e.g. '\\00\\01Hi' => b'\\x00\\x01Hi'.
+    The escaped bytes may be mixed with literal characters. """
+    length = len(escaped_string)
+    if length % 3 == 0 and escaped_string[::3] == '\\' * (length // 3):
+        # only escaped bytes
+        return bytes.fromhex(escaped_string.replace('\\', ''))
+    return _ESCAPED_BYTE_REGEX.sub(lambda match: chr(int(match.group(1), 16)),
+                                   escaped_string).encode('latin-1')
+
+
+def from_hex(hex_string):
+    """ Returns the bytes of a hexadecimal string, e.g. '0102AB' or '01 02 AB'. """
+    return bytes.fromhex(hex_string)
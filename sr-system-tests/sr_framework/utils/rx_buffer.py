@@ -0,0 +1,196 @@
+#!/usr/bin/python
+
+""" Serial RX buffer.
+
+This module contains the RxBuffer class, which stores the lines received
+from a serial port.
+"""
+
+import collections
+import functools
+import re
+from itertools import islice
+
+# Default maximum number of bytes kept in the RX buffer.
+DEFAULT_RX_BUFFER_MAX_SIZE = 4 * 1024 * 1024
+
+
+@functools.lru_cache(maxsize=256)
+def compile_regex(regex):
+    """ Compile a regular expression to search the data received (bytes). """
+    if isinstance(regex, str):
+        regex = regex.encode('ascii')
+    # Use flags=RE.DOTALL to make the '.' match any character, including '\n'.
+    return re.compile(regex, re.DOTALL)
+
+
+def decode_groups(match, default=None):
+    """ Returns the groups of a match on the data received, decoded to text. """
+    return tuple(RxBuffer.decode(group) if group is not None else default
+                 for group in match.groups())
+
+
+def findall_result(pattern, matches, decode=True):
+    """ Returns the matches of pattern decoded to text (bytes if decode is False),
+    in the re.findall() format. """
+    if not decode:
+        if pattern.groups == 0:
+            return [match.group(0) for match in matches]
+        if pattern.groups == 1:
+            return [match.group(1) or b'' for match in matches]
+        return [match.groups(b'') for match in matches]
+    if pattern.groups == 0:
+        return [RxBuffer.decode(match.group(0)) for match in matches]
+    if pattern.groups == 1:
+        return [decode_groups(match, '')[0] for match in matches]
+    return [decode_groups(match, '') for match in matches]
+
+
+class RxBuffer:
+    """ Bounded store of the lines received from a serial port.
+
+        Lines are stored as bytes, with their end of line characters, and are
+        only decoded when text is requested (text()). They are identified by an
+        absolute index, which is not modified when the buffer is cleared or
+        when the oldest lines are evicted. The last line might not be complete:
+        the data received next is appended to it.
+
+        The RxBuffer is not thread safe, the caller shall hold a lock.
+
+        Attributes:
+            max_size (int): Maximum number of bytes stored. The oldest lines
+                are evicted when this size is exceeded.
+            base (int): Absolute index of the first line stored.
+            generation (int): Incremented each time the buffer is cleared.
+            size (int): Number of bytes stored.
+    """
+    def __init__(self, max_size=DEFAULT_RX_BUFFER_MAX_SIZE):
+        self.max_size = max_size
+        self.base = 0
+        self.generation = 0
+        self.size = 0
+        self._lines = collections.deque()
+        # True if the last line stored is not complete.
+        self._partial = False
+        # True if the last complete line ended with '\r', which might be followed by '\n'.
+        self._pending_cr = False
+        # True if this line has been stored (i.e. not filtered).
+        self._pending_cr_stored = False
+
+    def __len__(self):
+        return len(self._lines)
+
+    @property
+    def end(self):
+        """ Absolute index following the last line stored. """
+        return self.base + len(self._lines)
+
+    @staticmethod
+    def decode(data):
+        """ Decode data received (bytes) to text. """
+        return data.decode('ascii', errors='backslashreplace')
+
+    def append(self, data, length=None, line_filter=None, raw_length=None):
+        """ Append data received to the buffer, and evict the oldest lines if
+        the maximum size is exceeded.
+
+        Args:
+            data: Data received (bytes or bytearray).
+            length: Number of bytes of data to append, all the data if None.
+            line_filter: Function called with each complete line (bytes). The
+                line is not stored if it returns True.
+            raw_length: Function called with (data, pos, endpos) at the start of
+                each line (data[pos:endpos] received so far, might not be complete),
+                returning the number of bytes from pos which are not split at the end
+                of line characters (header and raw data of the line, e.g. a payload
+                containing '\r'). None if the line has no raw data.
+        """
+        lines = self._lines
+        length = len(data) if length is None else length
+        start = 0
+        if length and self._pending_cr and data[0:1] == b'\n':
+            # '\r\n' end of line split between two reads
+            start = 1
+            if self._pending_cr_stored and lines and not self._partial:
+                lines[-1] += b'\n'
+                self.size += 1
+        if length:
+            self._pending_cr = False
+        if lines and self._partial and start < length:
+            # append to last line, which is not complete
+            last = lines.pop()
+            self.size -= len(last)
+            data = last + data[start:length]
+            length = len(data)
+            start = 0
+            self._partial = False
+        # positions of the next '\r' and '\n' characters (-1 if none)
+        next_cr = data.find(b'\r', start, length)
+        next_lf = data.find(b'\n', start, length)
+        while start < length:
+            raw = raw_length(data, start, length) if raw_length is not None else None
+            if raw is not None:
+                if start + raw >= length:
+                    # raw data (or its end of line) not received yet
+                    next_cr = next_lf = -1
+                else:
+                    if 0 <= next_cr < start + raw:
+                        next_cr = data.find(b'\r', start + raw, length)
+                    if 0 <= next_lf < start + raw:
+                        next_lf = data.find(b'\n', start + raw, length)
+            if next_cr < 0 and next_lf < 0:
+                # last line, not complete
+                eol = length
+                self._partial = True
+            elif next_lf < 0 or 0 <= next_cr < next_lf:
+                eol = next_cr + 1
+                if next_lf == eol:
+                    # '\r\n'
+                    eol += 1
+            else:
+                eol = next_lf + 1
+            line = bytes(data[start:eol])
+            start = eol
+            stored = self._partial or line_filter is None or not line_filter(line)
+            if stored:
+                lines.append(line)
+                self.size += len(line)
+            self._pending_cr = not self._partial and line.endswith(b'\r')
+            self._pending_cr_stored = stored
+            if 0 <= next_cr < start:
+                next_cr = data.find(b'\r', start, length)
+            if 0 <= next_lf < start:
+                next_lf = data.find(b'\n', start, length)
+        while self.size > self.max_size and len(lines) > 1:
+            self.size -= len(lines.popleft())
+            self.base += 1
+
+    def clear(self):
+        """ Remove all the lines stored. """
+        self.base += len(self._lines)
+        self.generation += 1
+        self.size = 0
+        self._lines = collections.deque()
+        self._partial = False
+        self._pending_cr_stored = False
+
+    def last_line(self):
+        """ Returns the last line stored (bytes), None if the buffer is empty. """
+        return self._lines[-1] if self._lines else None
+
+    def lines(self, start=None, end=None):
+        """ Returns a snapshot (list of bytes) of the lines stored between the
+        absolute indexes start (included) and end (excluded). """
+        start = self.base if start is None else max(start, self.base)
+        end = self.end if end is None else min(end, self.end)
+        if start >= end:
+            return []
+        # the lines searched are usually the most recent ones, walk from the right.
+        tail = list(islice(reversed(self._lines), self.end - start))
+        tail.reverse()
+        return tail[:end - start]
+
+    def text(self, start=None, end=None):
+        """ Returns the lines stored between the absolute indexes start (included)
+        and end (excluded), decoded to a single string. """
+        return RxBuffer.decode(b''.join(self.lines(start, end)))
@@ -5,12 +5,58 @@
 This module contains functionalities to send/receive data over a serial port.
 """
 
-import io
 import time
 import re
 import threading
 import binascii
+import functools
+from bisect import bisect_left
+from itertools import accumulate
 import serial
+from sr_framework.utils.rx_buffer import RxBuffer, DEFAULT_RX_BUFFER_MAX_SIZE, \
+    compile_regex, decode_groups, findall_result
+from sr_framework.utils.urc_dispatcher import UrcDispatcher
+
+# Number of lines searched again before the scan cursor, to find the matches
+# straddling the lines already searched and the new lines (patterns which
+# cannot match an end of line character only, see _is_line_bound).
+DEFAULT_SEARCH_OVERLAP = 8
+
+# Escape sequences which never match an end of line character.
+_LINE_BOUND_ESCAPES = re.compile(rb'\\[dwbBAZ]|\\[^a-zA-Z0-9\r\n]')
+
+# Size of the buffer used by the read serial thread (in bytes).
+RX_CHUNK_SIZE = 4096
+
+
+class SerialSearchCursor:
+    """ Scan cursor over the serial rx buffer.
+
+        The cursor keeps track of the data already searched by a waiter so
+        that only the data received since the previous search is searched again.
+
+        Attributes:
+            line (int): Absolute index of the first line not completely searched.
+            match_end (tuple): Absolute line index and column of the end of the
+                last match returned, None if no match has been returned yet.
+            overlap (int): Number of lines searched again before the cursor.
+    """
+    def __init__(self, overlap=DEFAULT_SEARCH_OVERLAP, line=0):
+        self.line = line
+        self.match_end = None
+        self.overlap = overlap
+        # first line searched by the patterns which can match several lines.
+        self.origin = line
+
+
+@functools.lru_cache(maxsize=256)
+def _is_line_bound(pattern):
+    """ Returns True if the compiled pattern cannot match an end of line character
+    (no '.', negated character set, whitespace or '\\r'/'\\n'), i.e. its matches are
+    within one line. Conservative: False if not sure. """
+    source = _LINE_BOUND_ESCAPES.sub(b'', pattern.pattern)
+    return not any(token in source for token in (b'.', b'\\', b'[^', b'\r', b'\n'))
+
 
 class SerialPort:
     """ Generic class to serial interface.
@@ -22,50 +68,99 @@ class SerialPort:
         serial_write_data.
 
         [RX] Data received from the serial interface is automatically stored in
-         rx_data buffer (read_serial thread).
+         rx_data buffer (read_serial thread). rx_data is a RxBuffer, bounded to
+         rx_buffer_max_size bytes. The data is stored as received (bytes) and
+         only decoded when returned by the search functions.
 
         serial_clear clears the buffer.
 
         serial_search_line, serial_search_line_startswith and
         serial_search_regex can be called to retrieve a line from the buffer.
+        A SerialSearchCursor can be given to the regex searches to only search
+        the data received since the previous search.
+
+        [URC] serial_urc_subscribe can be called to receive the unsolicited
+        result codes starting with a set of prefixes. These lines are queued
+        in the UrcSubscription returned, and not stored in rx_data buffer.
 
         Attributes:
             com_port (str): Serial com port.
             logger: Logger object.
+            rx_buffer_max_size (int): Maximum number of bytes kept in the
+                RX buffer, the oldest lines are evicted.
     """
-    def __init__(self, com_port, logger=None):
+    def __init__(self, com_port, logger=None, rx_buffer_max_size=DEFAULT_RX_BUFFER_MAX_SIZE):
         self.com_port = com_port
         self.ser = None
-        self.sio = None
         self.logger = logger
-        self.rx_data = []
+        self.rx_data = RxBuffer(rx_buffer_max_size)
         self.rx_thread = None
         self.rx_lock = threading.Lock()
+        # Notified by the read serial thread each time new data is appended to rx_data.
+        self.rx_cond = threading.Condition(self.rx_lock)
+        self.rx_count = 0
+        self.urc_dispatcher = UrcDispatcher()
+        # headers of the lines carrying raw data (see serial_add_raw_data_header).
+        self._raw_headers = []
         self.stop_evt = threading.Event()
         self.initial_baudrate = 0
 
-    @staticmethod
-    def __read_serial_thread(com_port, sio, rx_data, lock, logger, stop_evt):
+    def __read_serial_thread(self):
         """ Read serial thread. Appends line by line the data received
-        from serial com port to serial rx buffer. """
-        while not stop_evt.isSet():
-            for line in sio.readlines():
-                lock.acquire()
-                # append to last line, which might not be complete so re-split lines in case
-                new_lines = (
-                    rx_data[-1] + line if rx_data else line).splitlines(True)
-                del rx_data[-1:]
-                rx_data += new_lines
-                prefix = com_port + " < "
-                lock.release()
-                logger.debug_rx(prefix + line)
+        from serial com port to serial rx buffer, and wakes up the waiters. """
+        prefix = self.com_port + " < "
+        rx_chunk = bytearray(RX_CHUNK_SIZE)
+        rx_view = memoryview(rx_chunk)
+        while not self.stop_evt.is_set():
+            try:
+                # Read what is available, or wait for at least one byte (read timeout).
+                size = min(max(self.ser.in_waiting, 1), RX_CHUNK_SIZE)
+                length = self.ser.readinto(rx_view[:size])
+            except (serial.SerialException, OSError, TypeError):
+                if self.stop_evt.is_set():
+                    # serial port closed
+                    break
+                raise
+            if not length:
+                continue
+            with self.rx_cond:
+                self.rx_data.append(rx_chunk, length, self.urc_dispatcher.dispatch,
+                                    self._raw_length if self._raw_headers else None)
+                self.rx_count += 1
+                self.rx_cond.notify_all()
+            self.logger.debug_rx(prefix + RxBuffer.decode(rx_chunk[:length]))
+
+    def serial_add_raw_data_header(self, regex):
+        """ Declare the lines starting with the regular expression regex as carrying raw
+        data, e.g. r'RECV [0-9A-F]+ (\d+) '. The group 1 of regex is the decimal length
+        of the raw data following the header, which is kept in the line even if it
+        contains end of line characters. """
+        self._raw_headers.append(compile_regex(regex))
+
+    def _raw_length(self, data, pos, endpos):
+        """ Returns the length of the header and raw data of the line starting at pos
+        (see RxBuffer.append), None if the line has no raw data. """
+        for pattern in self._raw_headers:
+            match = pattern.match(data, pos, endpos)
+            if match:
+                return match.end() - pos + int(match.group(1))
+        return None
+
+    def _wait_for_rx_data(self, rx_count, deadline):
+        """ Wait for data to be appended to the serial rx buffer (rx_cond shall be held).
+        Returns False if the deadline is reached, True otherwise. """
+        while self.rx_count == rx_count:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            self.rx_cond.wait(remaining)
+        return True
 
     def serial_read_thread_start(self):
         """ Start read serial thread. """
         if not self.rx_thread or not self.rx_thread.is_alive():
             self.stop_evt.clear()
-            self.rx_thread = threading.Thread(target=SerialPort.__read_serial_thread, args=(
-                self.com_port, self.sio, self.rx_data, self.rx_lock, self.logger, self.stop_evt))
+            self.rx_thread = threading.Thread(target=self.__read_serial_thread)
             self.rx_thread.daemon = True
             self.rx_thread.start()
 
@@ -81,8 +176,6 @@ class SerialPort:
             return False
         self.ser.flushInput()
         self.ser.flushOutput()
-        self.sio = io.TextIOWrapper(io.BufferedRWPair(
-            self.ser, self.ser), encoding='ascii', errors='backslashreplace', newline='\r')
         self.serial_read_thread_start()
         time.sleep(0.5)  # wait for device to be READY if reset after flashing
         return True
@@ -92,16 +185,17 @@ class SerialPort:
         if self.ser.isOpen() is False:
             return False
         self.serial_read_thread_stop()
-        self.ser.rts = False  # if this is not set to False, BX310x resets
+        try:
+            self.ser.rts = False  # if this is not set to False, BX310x resets
+        except OSError:
+            pass  # no modem control lines (e.g. pseudo-terminal of an emulator)
         self.ser.close()
         return True
 
     def serial_rx_clear(self):
         """ Clear data in serial RX buffer. """
-        for line in self.rx_data[:]:
-            self.rx_lock.acquire()
-            self.rx_data.remove(line)
-            self.rx_lock.release()
+        with self.rx_lock:
+            self.rx_data.clear()
 
     def serial_set_baudrate(self, new_baudrate):
         """ Set a new baudrate. """
@@ -115,72 +209,205 @@ class SerialPort:
         time.sleep(0.5) # Wait for the flow control to be modified.
         return True
 
-    def serial_search_line_startswith(self, prefix, timeout=0):
-        """ Search for the most recent line starting with prefix in the serial rx buffer.
+    def serial_search_line_startswith(self, prefix, timeout=0, cursor=None):
+        """ Search for the most recent line starting with prefix in the serial rx buffer
+        (see serial_search_line_startswith_any).
         Returns the complete line if found, None otherwise. """
-        result = None
-        while timeout >= 0:
-            # search for prefix in rx_data
-            self.rx_lock.acquire()
-            for line in reversed(self.rx_data[:]):
-                if line.startswith(prefix):
-                    result = line.strip()
-                    break
-            self.rx_lock.release()
-            if result:
-                break
-            # timeout?
-            time.sleep(min(0.1, timeout))
-            timeout -= 0.1
-        return result
-
-    def serial_search_regex(self, regex, timeout=0):
+        result = self.serial_search_line_startswith_any((prefix,), timeout, most_recent=True,
+                                                        cursor=cursor)
+        return result[1] if result else None
+
+    def serial_search_line_startswith_any(self, prefixes, timeout=0, most_recent=False,
+                                          cursor=None):
+        """ Search for a line starting with any of the prefixes in the serial rx buffer.
+        The whole rx buffer is searched (lines received before the call included, e.g.
+        the response to a previous command if the buffer has not been cleared), then
+        the new lines as they arrive: the function returns as soon as a matching line
+        is received. If a cursor is given, only the lines after the line of the
+        previous match are searched, and the cursor is moved after the matching line.
+        Returns a tuple (index of the matching prefix, complete line) if found, None otherwise. """
+        deadline = time.monotonic() + timeout
+        prefixes = [prefix.encode('ascii') for prefix in prefixes]
+        with self.rx_cond:
+            # absolute index of the first line which has not been searched yet.
+            start = self.rx_data.base if cursor is None else max(cursor.line, self.rx_data.base)
+            while True:
+                rx_count = self.rx_count
+                lines = self.rx_data.lines(start)
+                indexes = range(start, start + len(lines))
+                for index, line in (zip(reversed(indexes), reversed(lines)) if most_recent
+                                    else zip(indexes, lines)):
+                    for i, prefix in enumerate(prefixes):
+                        if line.startswith(prefix):
+                            if cursor is not None:
+                                cursor.line = index + 1
+                            return (i, RxBuffer.decode(line.strip()))
+                start = max(start, self.rx_data.end)
+                last_line = self.rx_data.last_line()
+                if last_line and not last_line.endswith((b'\r', b'\n')):
+                    # the last line is searched again since it is not complete
+                    start = max(self.rx_data.end - 1, self.rx_data.base)
+                if cursor is not None:
+                    cursor.line = start
+                if not self._wait_for_rx_data(rx_count, deadline):
+                    return None
+
+    def serial_rx_mark(self):
+        """ Returns the absolute index of the next line to be received in the serial rx buffer. """
+        with self.rx_lock:
+            return self.rx_data.end
+
+    def serial_read_response(self, start, prefixes, timeout=0):
+        """ Wait for a final line starting with any of the prefixes, received from the
+        absolute line index start (see serial_rx_mark). Each line is checked once,
+        except the last line which is checked again while it is not complete.
+        Returns a tuple (index of the matching prefix or None on timeout,
+        list of the complete lines (bytes) received before the final line,
+        final line (bytes) or None on timeout, absolute index following the final line). """
+        deadline = time.monotonic() + timeout
+        prefixes = [prefix.encode('ascii') for prefix in prefixes]
+        lines = []
+        with self.rx_cond:
+            while True:
+                rx_count = self.rx_count
+                index = max(start, self.rx_data.base)
+                for line in self.rx_data.lines(index):
+                    for i, prefix in enumerate(prefixes):
+                        if line.startswith(prefix):
+                            return (i, lines, line, index + 1)
+                    if not line.endswith((b'\r', b'\n')):
+                        # the last line is not complete
+                        break
+                    lines.append(line)
+                    index += 1
+                start = index
+                if not self._wait_for_rx_data(rx_count, deadline):
+                    return (None, lines, None, start)
+
+    def serial_iter_lines(self, start, timeout=0):
+        """ Yield the complete lines received from the absolute line index start (see
+        serial_rx_mark) as they arrive, until timeout. The serial rx buffer is not
+        locked while the caller handles a line.
+        Yields tuples (absolute index of the line, line (bytes)). """
+        deadline = time.monotonic() + timeout
+        while True:
+            with self.rx_cond:
+                rx_count = self.rx_count
+                start = max(start, self.rx_data.base)
+                lines = self.rx_data.lines(start)
+                if lines and not lines[-1].endswith((b'\r', b'\n')):
+                    # the last line is not complete
+                    lines.pop()
+                if not lines and not self._wait_for_rx_data(rx_count, deadline):
+                    return
+            for line in lines:
+                yield (start, line)
+                start += 1
+
+    def _search_from_cursor(self, pattern, cursor, find_all, complete_lines_only=False):
+        """ Search pattern in the data received since the cursor (rx_cond shall be held).
+        Only the first match is returned if find_all is False.
+        The cursor is moved after the data searched. The cursor overlap is searched
+        again if the pattern cannot match several lines, all the data from the cursor
+        origin otherwise, since a match might start in any line already searched.
+        Returns list of match objects. """
+        base = self.rx_data.base
+        end = self.rx_data.end
+        last_line = self.rx_data.last_line()
+        if complete_lines_only and last_line and not last_line.endswith((b'\r', b'\n')):
+            # the last line might not be complete, skip it
+            end -= 1
+        if _is_line_bound(pattern):
+            start = max(cursor.line - cursor.overlap, base)
+        else:
+            start = max(min(cursor.origin, cursor.line), base)
+        pos = 0
+        if cursor.match_end is not None and cursor.match_end[0] >= start:
+            start, pos = cursor.match_end
+        if start >= end:
+            return []
+        lines = self.rx_data.lines(start, end)
+        # Convert rx_data list to a string to perform the search on several lines,
+        # instead of line by line. This in case there are /r characters (EOL) in raw data.
+        data = b''.join(lines)
+        if find_all:
+            matches = list(pattern.finditer(data, pos))
+        else:
+            match = pattern.search(data, pos)
+            matches = [match] if match else []
+        if matches:
+            line_ends = list(accumulate(len(line) for line in lines))
+            match_end = matches[-1].end()
+            i = bisect_left(line_ends, match_end)
+            cursor.match_end = (start + i, match_end - (line_ends[i] - len(lines[i])))
+            if not find_all:
+                # the data after the match has not been searched yet.
+                cursor.line = cursor.match_end[0]
+                return matches
+        # the last line is searched again since it might not be complete.
+        cursor.line = end - 1
+        return matches
+
+    def serial_search_regex(self, regex, timeout=0, cursor=None):
         """ Search for the first data matching the regular expression regex in the serial rx buffer.
+        The search is performed again on the new data each time data is received until timeout.
+        If a cursor is given, only the data after the previous match is searched.
+        The matches straddling the data already searched and the new data are found:
+        the overlap of the cursor is searched again if the regex cannot match an end of
+        line character, all the data from the cursor origin otherwise.
         Returns match if found, None otherwise. """
-        result = None
-        while timeout >= 0:
-            # Search for regex in rx_data
-            self.rx_lock.acquire()
-            # Convert rx_data list to a string to perform the search on full rx_data,
-            # instead of line by line. This in case there are /r characters (EOL) in raw data.
-            data = ''.join(self.rx_data)
-            # Use flags=RE.DOTALL to make the '.' match any character, including '\n'.
-            match = re.search(regex, data, re.DOTALL)
-            if match:
-                result = match.groups()
-            self.rx_lock.release()
-            if result is not None:
-                break
-            # timeout?
-            time.sleep(min(0.1, timeout))
-            timeout -= 0.1
-        return result
-
-    def serial_search_regex_all(self, regex, timeout=0):
+        deadline = time.monotonic() + timeout
+        pattern = compile_regex(regex)
+        cursor = cursor or SerialSearchCursor()
+        with self.rx_cond:
+            while True:
+                rx_count = self.rx_count
+                matches = self._search_from_cursor(pattern, cursor, False)
+                if matches:
+                    return decode_groups(matches[0])
+                if not self._wait_for_rx_data(rx_count, deadline):
+                    return None
+
+    def serial_search_regex_all(self, regex, timeout=0, cursor=None):
         """ Search for all the lines matching the regular expression regex in the serial rx buffer.
+        The lines received are searched as they arrive until timeout.
+        If a cursor is given, only the data after the previous match is searched.
+        The matches straddling several lines are found as in serial_search_regex.
         Returns list of line. """
-        # wait for timeout if we want to get all matches
-        time.sleep(timeout)
-        # Search for regex in rx_data
-        self.rx_lock.acquire()
-        # Convert rx_data list to a string to perform the search on full rx_data,
-        # instead of line by line. This in case there are /r characters (EOL) in raw data.
-        data = ''.join(self.rx_data)
-        # Use flags=RE.DOTALL to make the '.' match any character, including '\n'.
-        result = re.findall(regex, data, re.DOTALL)
-        self.rx_lock.release()
-        return result
+        deadline = time.monotonic() + timeout
+        pattern = compile_regex(regex)
+        cursor = cursor or SerialSearchCursor()
+        matches = []
+        with self.rx_cond:
+            # wait for timeout if we want to get all matches
+            while True:
+                rx_count = self.rx_count
+                matches += self._search_from_cursor(pattern, cursor, True, True)
+                if not self._wait_for_rx_data(rx_count, deadline):
+                    break
+            matches += self._search_from_cursor(pattern, cursor, True)
+        return findall_result(pattern, matches)
+
+    def serial_urc_subscribe(self, prefixes, first=False):
+        """ Subscribe to the unsolicited result codes starting with prefixes,
+        queued before the other subscriptions if first is True.
+        Returns the UrcSubscription receiving these URCs. """
+        return self.urc_dispatcher.subscribe(prefixes, first=first)
+
+    def serial_urc_unsubscribe(self, subscription):
+        """ Unsubscribe from unsolicited result codes. """
+        self.urc_dispatcher.unsubscribe(subscription)
 
     def serial_write_data(self, data):
         """ Send data to serial port. """
         prefix = self.com_port + " > "
         if isinstance(data, bytearray):
             self.ser.write(data)
-            self.ser.flushOutput()
+            self.ser.flush()
             self.logger.debug_tx(prefix + str(binascii.hexlify(data)))
         else:
-            self.sio.write(data)
-            self.sio.flush()
+            self.ser.write(data.encode('ascii', errors='backslashreplace'))
+            self.ser.flush()
             self.logger.debug_tx(prefix + data)
         # Wait for data to be sent
         while self.ser.out_waiting:
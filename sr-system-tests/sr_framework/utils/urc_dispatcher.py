@@ -0,0 +1,211 @@
+#!/usr/bin/python
+
+""" Unsolicited Result Code (URC) dispatcher.
+
+This module contains the UrcDispatcher class, which routes the unsolicited
+lines received from a serial port (e.g. '+SRBLE_IND: 1,1', 'OPEN_OK 14 BLE ...')
+to the subscribers of their prefix, instead of storing them with the command
+responses.
+"""
+
+import collections
+import re
+import threading
+import time
+from sr_framework.utils.rx_buffer import RxBuffer, compile_regex, decode_groups, findall_result
+
+# Default maximum number of URCs queued per subscription. The oldest URCs are dropped.
+DEFAULT_URC_QUEUE_SIZE = 1000
+
+# The prefix of a line is its first word, e.g. '+SRBLE_IND' or 'OPEN_OK'.
+_PREFIX_REGEX = re.compile(rb'\s*([^\s:=]+)')
+
+
+class Urc:
+    """ Unsolicited result code received.
+
+        Attributes:
+            prefix (str): Prefix of the URC, e.g. '+SRBLE_IND'.
+            line (bytes): Complete line received.
+            timestamp (float): time.monotonic() when the line was received.
+            seq (int): Sequence number of the URC in its subscription.
+    """
+    def __init__(self, prefix, line, timestamp, seq=0):
+        self.prefix = prefix
+        self.line = line
+        self.timestamp = timestamp
+        self.seq = seq
+
+    @property
+    def text(self):
+        """ The line received decoded to text, without end of line characters. """
+        return RxBuffer.decode(self.line.strip())
+
+    def __str__(self):
+        return 'Urc: prefix="%s", line="%s"' % (self.prefix, self.text)
+
+
+class UrcSubscription:
+    """ Queue of the URCs received for a set of prefixes.
+
+        Waiters wait for a URC matching a regular expression. Matching URCs are
+        removed from the queue (unless consume is False), the other URCs are
+        kept for the next waiters.
+
+        Attributes:
+            prefixes (tuple of str): Prefixes subscribed.
+    """
+    def __init__(self, prefixes, max_size=DEFAULT_URC_QUEUE_SIZE):
+        self.prefixes = tuple(prefixes)
+        self._urcs = collections.deque(maxlen=max_size)
+        self._cond = threading.Condition()
+        self._seq = 0
+
+    def __len__(self):
+        return len(self._urcs)
+
+    @property
+    def count(self):
+        """ Number of URCs received since the subscription. """
+        return self._seq
+
+    def put(self, prefix, line):
+        """ Queue a URC and wake up the waiters. """
+        with self._cond:
+            self._seq += 1
+            self._urcs.append(Urc(prefix, line, time.monotonic(), self._seq))
+            self._cond.notify_all()
+
+    def flush(self):
+        """ Remove all the URCs queued. """
+        with self._cond:
+            self._urcs.clear()
+
+    def _new_urcs(self, last_seq):
+        """ Returns the URCs queued after sequence number last_seq (_cond shall be held). """
+        urcs = []
+        for urc in reversed(self._urcs):
+            if urc.seq <= last_seq:
+                break
+            urcs.append(urc)
+        urcs.reverse()
+        return urcs
+
+    def _wait_for_urc(self, last_seq, deadline):
+        """ Wait for a URC to be queued after sequence number last_seq (_cond shall be held).
+        Returns False if the deadline is reached, True otherwise. """
+        while self._seq == last_seq:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            self._cond.wait(remaining)
+        return True
+
+    def wait(self, regex, timeout=0, consume=True):
+        """ Wait for the first URC matching the regular expression regex.
+        The URC is removed from the queue if consume is True.
+        Returns match groups if found, None otherwise. """
+        deadline = time.monotonic() + timeout
+        pattern = compile_regex(regex)
+        last_seq = 0
+        with self._cond:
+            while True:
+                for urc in self._new_urcs(last_seq):
+                    match = pattern.search(urc.line)
+                    if match:
+                        if consume:
+                            self._urcs.remove(urc)
+                        return decode_groups(match)
+                last_seq = self._seq
+                if not self._wait_for_urc(last_seq, deadline):
+                    return None
+
+    def wait_all(self, regex, timeout=0, until=None, quiet=None, decode=True):
+        """ Wait for timeout, and collect all the URCs matching the regular expression regex.
+        The URCs collected are removed from the queue.
+
+        Args:
+            regex: Regular expression of the URCs to collect.
+            timeout: Maximum time to wait (in seconds).
+            until: Function of the list of matches collected, called for each new
+                match: returns as soon as it returns True. None to wait for timeout.
+            quiet: Returns once no matching URC has been received for quiet seconds,
+                after the first match. None to wait for timeout.
+            decode: True to return the matches decoded to text, False to return
+                them as received (bytes), e.g. raw data.
+
+        Returns:
+            list of matches, in the re.findall() format.
+        """
+        end = deadline = time.monotonic() + timeout
+        pattern = compile_regex(regex)
+        last_seq = 0
+        results = []
+        with self._cond:
+            while True:
+                for urc in self._new_urcs(last_seq):
+                    match = pattern.search(urc.line)
+                    if match:
+                        self._urcs.remove(urc)
+                        results += findall_result(pattern, [match], decode)
+                        if until is not None and until(results):
+                            return results
+                        if quiet is not None:
+                            deadline = min(end, urc.timestamp + quiet)
+                last_seq = self._seq
+                if not self._wait_for_urc(last_seq, deadline):
+                    return results
+
+
+class UrcDispatcher:
+    """ Routes the URC lines to the subscriptions of their prefix.
+
+        Each line is classified once, with a dictionary lookup of its prefix.
+        dispatch() is called by the read serial thread, the routing table is
+        replaced (not modified) when subscribing so it can be read without lock.
+    """
+    def __init__(self):
+        self._routes = {}
+        self._lock = threading.Lock()
+
+    def subscribe(self, prefixes, max_size=DEFAULT_URC_QUEUE_SIZE, first=False):
+        """ Subscribe to the URCs starting with prefixes (e.g. ['+SRBLE_IND', '+KGPIO']).
+        The URCs are queued in the subscription order, or before the other
+        subscriptions if first is True (e.g. a cache, which shall be current
+        when the waiters of the other subscriptions wake up).
+        Returns the UrcSubscription. """
+        subscription = UrcSubscription(prefixes, max_size)
+        with self._lock:
+            routes = {key: list(subs) for key, subs in self._routes.items()}
+            for prefix in subscription.prefixes:
+                subs = routes.setdefault(prefix.encode('ascii'), [])
+                subs.insert(0 if first else len(subs), subscription)
+            self._routes = routes
+        return subscription
+
+    def unsubscribe(self, subscription):
+        """ Remove a subscription. """
+        with self._lock:
+            routes = {}
+            for key, subs in self._routes.items():
+                subs = [sub for sub in subs if sub is not subscription]
+                if subs:
+                    routes[key] = subs
+            self._routes = routes
+
+    def dispatch(self, line):
+        """ Route a complete line (bytes) to the subscriptions of its prefix.
+        Returns True if the line is a URC, False otherwise. """
+        routes = self._routes
+        if not routes:
+            return False
+        match = _PREFIX_REGEX.match(line)
+        if not match:
+            return False
+        subscriptions = routes.get(match.group(1))
+        if not subscriptions:
+            return False
+        prefix = RxBuffer.decode(match.group(1))
+        for subscription in subscriptions:
+            subscription.put(prefix, line)
+        return True
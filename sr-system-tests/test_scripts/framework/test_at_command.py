@@ -0,0 +1,174 @@
+import pytest
+from sr_framework.device.eddington import Eddington, EDD_RESULT_SUCCESS
+from sr_framework.utils.at_command import AtBatch, AtCommandEngine
+from sr_framework.utils.serial_port import SerialPort
+
+FINAL_RESULTS = ('OK', 'ERROR', '+CME')
+
+
+class ScriptedSerialPort(SerialPort):
+    """ Serial port (not opened) answering each command written with its echo and
+    a scripted response, received immediately. No response if not scripted. """
+    def __init__(self, responses, echo_first=False):
+        super().__init__('TEST')
+        self.responses = responses
+        self.echo_first = echo_first
+        self.writes = []
+
+    def serial_write_data(self, data):
+        self.writes.append(data)
+        commands = data.split('\r')[:-1]
+        if self.echo_first:
+            # echoes of all the commands received before their responses
+            self.rx_data.append(b''.join(command.encode() + b'\r' for command in commands))
+        for command in commands:
+            response = b'' if self.echo_first else command.encode() + b'\r'
+            for line in self.responses.get(command, ()):
+                response += b'\r\n' + line.encode() + b'\r\n'
+            self.rx_data.append(response)
+
+
+def _engine(responses, echo_first=False):
+    serial_port = ScriptedSerialPort(responses, echo_first)
+    return serial_port, AtCommandEngine(serial_port, timeout=0.05)
+
+
+def test_at_command_send_pipelined_window():
+    """ Verify at most depth commands are in flight, and the responses correlated in order. """
+    responses = {'AT+C%d' % i: ['+C: %d' % i, 'OK'] for i in range(5)}
+    serial_port, engine = _engine(responses)
+    transactions = engine.send_pipelined(
+        [('AT+C%d' % i, FINAL_RESULTS, None) for i in range(5)], depth=2)
+    assert serial_port.writes == ['AT+C0\rAT+C1\r', 'AT+C2\r', 'AT+C3\r', 'AT+C4\r']
+    assert [transaction.result for transaction in transactions] == [0] * 5
+    assert [transaction.search(r'\+C: (\d)')[0] for transaction in transactions] == \
+        ['0', '1', '2', '3', '4']
+
+
+def test_at_command_send_pipelined_echoes():
+    """ Verify the echoes of the commands in flight are not in the responses. """
+    responses = {'AT+C%d' % i: ['+C: %d' % i, 'OK'] for i in range(3)}
+    _, engine = _engine(responses, echo_first=True)
+    transactions = engine.send_pipelined([('AT+C%d' % i, FINAL_RESULTS, None) for i in range(3)])
+    for i, transaction in enumerate(transactions):
+        assert [line.strip() for line in transaction.lines if line.strip()] == \
+            [b'+C: %d' % i]
+
+
+def test_at_command_send_pipelined_timeout():
+    """ Verify no more commands are sent after a command timing out. """
+    # the device does not answer anymore after AT+C0
+    serial_port, engine = _engine({'AT+C0': ['OK']})
+    transactions = engine.send_pipelined(
+        [('AT+C%d' % i, FINAL_RESULTS, None) for i in range(4)], depth=2)
+    assert [transaction.result for transaction in transactions] == [0, None, None, None]
+    assert serial_port.writes == ['AT+C0\rAT+C1\r', 'AT+C2\r']
+
+
+def test_at_command_send_pipelined_empty_final_result():
+    """ Verify a command with an empty final result code is not pipelined. """
+    serial_port, engine = _engine({})
+    with pytest.raises(ValueError):
+        engine.send_pipelined([('AT+C0', FINAL_RESULTS, None), ('AT&F', ('', 'ERROR'), None)])
+    assert serial_port.writes == []
+
+
+class BatchBoard:
+    """ Board state changed by Eddington._prepare_batch_command. """
+    def __init__(self):
+        self._dirty = set()
+        self.invalidations = []
+        self._sessions = self
+
+    def invalidate(self):
+        self.invalidations.append('sessions')
+
+    def _invalidate_identity(self, event):
+        self.invalidations.append(event)
+
+    def prepare_batch_command(self, command):
+        return Eddington._prepare_batch_command(self, command)
+
+
+def test_at_command_batch_restore_to_defaults():
+    """ Verify a batch with &F in the middle of the commands is not sent. """
+    serial_port, engine = _engine({'AT+FMM': ['BC310X', 'OK'], 'AT&F': ['OK']})
+    batch = AtBatch(engine, Eddington._get_final_results, Eddington._get_result_code,
+                    prepare_command=BatchBoard().prepare_batch_command)
+    with pytest.raises(ValueError):
+        with batch:
+            batch.execute('+FMM')
+            batch.execute('&F')
+            batch.execute('+FMM')
+    assert serial_port.writes == []
+    batch.execute('+FMM')
+    assert batch.send() == [EDD_RESULT_SUCCESS]
+
+
+def test_at_command_batch_invalidation():
+    """ Verify a batch marks the board dirty and invalidates the caches changed by its commands. """
+    responses = {'AT+FMM': ['BC310X', 'OK'], 'AT+SRBLECFG="20:FA:BB:00:01:80"': ['OK'],
+                 'AT&W': ['OK']}
+    _, engine = _engine(responses)
+    board = BatchBoard()
+    with AtBatch(engine, Eddington._get_final_results, Eddington._get_result_code,
+                 prepare_command=board.prepare_batch_command) as batch:
+        batch.execute('+FMM')
+    assert board._dirty == {'batch'}
+    assert board.invalidations == []
+    with batch:
+        batch.write('+SRBLECFG', ['"20:FA:BB:00:01:80"'])
+        batch.execute('&W')
+    assert batch.results == [EDD_RESULT_SUCCESS] * 3
+    assert board.invalidations == ['sessions', 'save']
+
+
+def test_at_command_send_echo():
+    """ Verify the echo of the command is not in the response. """
+    serial_port, engine = _engine({'AT+FMM': ['BC310X', 'OK']})
+    transaction = engine.send('AT+FMM', FINAL_RESULTS)
+    assert serial_port.writes == ['AT+FMM\r']
+    assert transaction.result == 0
+    assert transaction.final == 'OK'
+    assert b'AT+FMM' not in transaction.data
+    assert transaction.search(r'(\w+)') == ('BC310X',)
+
+
+def test_at_command_send_error():
+    """ Verify the index of the final result code matching. """
+    _, engine = _engine({'AT+X': ['+CME ERROR: 4']})
+    transaction = engine.send('AT+X', FINAL_RESULTS)
+    assert transaction.result == 2
+    assert transaction.final == '+CME ERROR: 4'
+
+
+def test_at_command_send_timeout():
+    """ Verify the result of a command timing out. """
+    _, engine = _engine({})
+    transaction = engine.send('AT+X', FINAL_RESULTS)
+    assert transaction.result is None
+    assert transaction.final is None
+
+
+def test_at_command_previous_response():
+    """ Verify only the lines received after the command are its response. """
+    serial_port, engine = _engine({'AT+A': ['+A: 1', 'OK'], 'AT+B': ['+B: 2', 'OK']})
+    engine.send('AT+A', FINAL_RESULTS)
+    transaction = engine.send('AT+B', FINAL_RESULTS)
+    assert transaction.search_all(r'\+(\w): (\d)') == [('B', '2')]
+    assert transaction.start > 0
+
+
+def test_at_command_iter_response():
+    """ Verify the response lines are yielded without the echo, and the rest read after. """
+    _, engine = _engine({'AT+SCAN': ['+S: 1', '+S: 2', 'OK']})
+    transaction = engine.start('AT+SCAN')
+    lines = engine.iter_response(transaction, FINAL_RESULTS)
+    # '\r\n' before each response line
+    assert next(lines).strip() == b''
+    assert next(lines).strip() == b'+S: 1'
+    lines.close()
+    assert transaction.result is None
+    engine.read_response(transaction, FINAL_RESULTS)
+    assert transaction.result == 0
+    assert transaction.search_all(r'\+S: (\d)') == ['1', '2']
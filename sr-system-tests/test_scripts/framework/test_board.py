@@ -0,0 +1,147 @@
+import re
+import pytest
+from sr_framework import Eddington, Euler, Melody
+from sr_framework.device.ble import BleInterface
+from sr_framework.device.board import Board, cached_identity
+
+EVENTS = ('restore', 'save')
+
+
+class IdentityBoard(Board):
+    """ Board without device, whose identity attributes count the reads of the board. """
+    def __init__(self):
+        self._identity_cache = {}
+        self.reads = dict.fromkeys(Board.IDENTITY_INVALIDATION, 0)
+
+    def __del__(self):
+        pass
+
+    def read(self, name):
+        self.reads[name] += 1
+        return name
+
+    @cached_identity('manufacturer_id')
+    def common_get_manufacturer_id(self):
+        return self.read('manufacturer_id')
+
+    @cached_identity('model_id')
+    def common_get_model_id(self):
+        return self.read('model_id')
+
+    @cached_identity('revision_id')
+    def common_get_revision_id(self):
+        return self.read('revision_id')
+
+    @cached_identity('supported_command_list')
+    def common_get_supported_command_list(self):
+        return [self.read('supported_command_list')]
+
+    @cached_identity('local_address')
+    def ble_get_local_address(self):
+        return self.read('local_address')
+
+    @cached_identity('local_mtu_size')
+    def ble_get_local_mtu_size(self):
+        return self.read('local_mtu_size')
+
+    def read_all(self):
+        self.common_get_manufacturer_id()
+        self.common_get_model_id()
+        self.common_get_revision_id()
+        self.common_get_supported_command_list()
+        self.ble_get_local_address()
+        self.ble_get_local_mtu_size()
+
+
+def test_identity_invalidation_events():
+    """ Verify all the identity attributes are invalidated by known events only. """
+    for name, events in Board.IDENTITY_INVALIDATION.items():
+        assert set(events) <= set(EVENTS), name
+
+
+def test_identity_cached():
+    """ Verify the identity attributes are read from the board once. """
+    board = IdentityBoard()
+    board.read_all()
+    board.read_all()
+    assert all(count == 1 for count in board.reads.values())
+    # the lists returned are copies of the cached ones
+    board.common_get_supported_command_list().append('X')
+    assert board.common_get_supported_command_list() == ['supported_command_list']
+
+
+@pytest.mark.parametrize('event', EVENTS)
+def test_invalidate_identity(event):
+    """ Verify an event invalidates the identity attributes mapped to it only. """
+    board = IdentityBoard()
+    board.read_all()
+    board._invalidate_identity(event)
+    board.read_all()
+    for name, events in Board.IDENTITY_INVALIDATION.items():
+        assert board.reads[name] == (2 if event in events else 1), name
+
+
+def test_invalidate_identity_restore_all():
+    """ Verify a restore to defaults invalidates all the identity attributes. """
+    board = IdentityBoard()
+    board.read_all()
+    board._invalidate_identity('restore')
+    assert not board._identity_cache
+
+
+def test_invalidate_identity_not_cached():
+    """ Verify an event invalidates the attributes not read yet without error. """
+    board = IdentityBoard()
+    board.ble_get_local_address()
+    board._invalidate_identity('save')
+    board.read_all()
+    assert board.reads['local_address'] == 2
+    assert board.reads['model_id'] == 1
+
+
+def test_clear_identity_cache():
+    """ Verify clear_identity_cache invalidates all the identity attributes. """
+    board = IdentityBoard()
+    board.read_all()
+    board.clear_identity_cache()
+    board.read_all()
+    assert all(count == 2 for count in board.reads.values())
+
+
+# Board methods changing the state of the board (see changes_state).
+STATE_CHANGING_METHODS = re.compile(r'(hw_set_|hw_gpio_configure$|hw_gpio_write$|hw_save_|'
+                                    r'ble_set_|ble_create_session$|ble_delete_session$|'
+                                    r'ble_gatt_add_|ble_gatt_profile_setup$|'
+                                    r'common_set_remote_controller$)')
+
+
+@pytest.mark.parametrize('cls', [Eddington, Euler, Melody])
+def test_changes_state_decorators(cls):
+    """ Verify the methods changing the state of the board record it in the dirty
+    state (restore_clean_state skips the reset of a clean board). """
+    methods = [name for name in vars(cls) if STATE_CHANGING_METHODS.match(name)]
+    assert methods
+    for name in methods:
+        # wrapper of changes_state
+        assert 'state' in getattr(cls, name).__code__.co_freevars, '%s.%s' % (cls.__name__, name)
+
+
+class DiscoveryBoard:
+    """ Euler GATT client state used by Euler._is_a_characteristic, the session
+    being unknown to the session cache (no cached database). """
+    def __init__(self, chars):
+        self.chars = chars
+
+    def ble_gatt_discover_all_characteristics(self, session_id):
+        return self.chars
+
+    def _gatt_database(self, session_id):
+        return None
+
+
+def test_is_a_characteristic_not_cached():
+    """ Verify the characteristics discovered are used when the database is not cached. """
+    board = DiscoveryBoard([BleInterface.GattCharacteristic('2A00', 3, 0x02)])
+    assert Euler._is_a_characteristic(board, 1, 3)
+    assert not Euler._is_a_characteristic(board, 1, 4)
+    assert not Euler._is_a_characteristic(DiscoveryBoard(None), 1, 3)
@@ -0,0 +1,98 @@
+import json
+import os
+import threading
+import time
+import pytest
+from sr_framework.utils import device_discovery
+from sr_framework.utils.device_manager import DeviceLease
+
+DUT_ENTRY = {'manufacturer': 'Sierra', 'model': 'BC310X', 'revision': 'Beta.1.0', 'baud': '115200'}
+
+
+@pytest.fixture
+def ports(monkeypatch):
+    """ Serial ports of the host (port: USB serial number), boards identified by
+    probe_port (port: device entry), and the ports probed. """
+    host = {'P1': 'SN1', 'P2': 'SN2'}
+    boards = {'P1': dict(DUT_ENTRY, port='P1'), 'P2': dict(DUT_ENTRY, port='P2')}
+    probed = []
+
+    def probe_port(port, baudrates=None):
+        probed.append(port)
+        return boards.get(port)
+
+    monkeypatch.setattr(device_discovery, '_candidate_ports', lambda: dict(host))
+    monkeypatch.setattr(device_discovery, 'probe_port', probe_port)
+    monkeypatch.setattr(device_discovery, 'LEASE_POLL_INTERVAL', 0.01)
+    return host, boards, probed
+
+
+def _discover(tmp_path, **kwargs):
+    return device_discovery.discover_devices(inventory_file=str(tmp_path / 'inventory.json'),
+                                             lease_dir=str(tmp_path / 'leases'), **kwargs)
+
+
+def test_discover_devices_inventory(tmp_path, ports):
+    """ Verify the ports of the inventory are not probed again. """
+    _, _, probed = ports
+    assert sorted(entry['port'] for entry in _discover(tmp_path)) == ['P1', 'P2']
+    assert sorted(probed) == ['P1', 'P2']
+    with open(str(tmp_path / 'inventory.json')) as file:
+        assert len(json.load(file)['devices']) == 2
+    assert len(_discover(tmp_path)) == 2
+    assert len(probed) == 2
+    # no temporary file left
+    assert sorted(os.listdir(str(tmp_path))) == ['inventory.json', 'inventory.json.lock',
+                                                   'leases']
+
+
+def test_discover_devices_leased_port(tmp_path, ports):
+    """ Verify a port leased by another process and not in the inventory is probed once released. """
+    _, _, probed = ports
+    lease = DeviceLease(str(tmp_path / 'leases'), 'P2')
+    assert lease.acquire()
+    timer = threading.Timer(0.2, lease.release)
+    timer.start()
+    try:
+        devices = _discover(tmp_path, leased_port_timeout=5)
+    finally:
+        timer.join()
+    assert sorted(entry['port'] for entry in devices) == ['P1', 'P2']
+    assert sorted(probed) == ['P1', 'P2']
+
+
+def test_discover_devices_leased_port_timeout(tmp_path, ports):
+    """ Verify a port leased by another process is kept if in the inventory, and
+    dropped with a warning if not released within the timeout. """
+    _, _, probed = ports
+    _discover(tmp_path, ports=['P1'])
+    lease1 = DeviceLease(str(tmp_path / 'leases'), 'P1')
+    lease2 = DeviceLease(str(tmp_path / 'leases'), 'P2')
+    assert lease1.acquire() and lease2.acquire()
+    try:
+        with pytest.warns(UserWarning):
+            devices = _discover(tmp_path, refresh=True, leased_port_timeout=0.1)
+    finally:
+        lease1.release()
+        lease2.release()
+    assert [entry['port'] for entry in devices] == ['P1']
+    assert probed == ['P1']
+
+
+def test_discover_devices_one_process_at_a_time(tmp_path, ports):
+    """ Verify the discoveries with the same inventory run one at a time, the
+    next one reading the devices discovered. """
+    _, _, probed = ports
+    lock = DeviceLease(str(tmp_path), 'inventory.json')
+    assert lock.acquire()
+    results = []
+    thread = threading.Thread(target=lambda: results.append(_discover(tmp_path)))
+    thread.start()
+    time.sleep(0.2)
+    # waiting for the lock
+    assert results == [] and probed == []
+    lock.release()
+    thread.join()
+    assert len(results[0]) == 2
+    assert len(_discover(tmp_path)) == 2
+    assert len(probed) == 2
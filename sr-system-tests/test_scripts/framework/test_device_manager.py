@@ -0,0 +1,44 @@
+from sr_framework.utils.device_manager import Device, DeviceManager
+
+DUT_SPEC = ('BC310X', 'Beta.1.0')
+REMOTE_SPEC = ('BC127', 'Melody Audio V7.2')
+
+
+def _device_manager(tmp_path, devices):
+    """ Returns a DeviceManager of the devices (model, revision, port, rig). """
+    device_manager = DeviceManager(lease_dir=str(tmp_path))
+    for model, revision, port, rig in devices:
+        device_manager.add_device_to_list(Device('Sierra', model, revision, port, '115200', rig))
+    return device_manager
+
+
+def test_device_manager_get_devices_rig(tmp_path):
+    """ Verify the devices are leased from the rig requested only. """
+    device_manager = _device_manager(tmp_path, [DUT_SPEC + ('P1', 'A'), REMOTE_SPEC + ('P2', 'A'),
+                                                DUT_SPEC + ('P3', 'B'), REMOTE_SPEC + ('P4', 'B')])
+    dut = device_manager.get_devices([DUT_SPEC])[0]
+    remote = device_manager.get_devices([REMOTE_SPEC], rig=dut.rig)[0]
+    assert (dut.port, remote.port) == ('P1', 'P2')
+    assert device_manager.get_devices([REMOTE_SPEC], rig='A') is None
+    assert device_manager.get_devices([REMOTE_SPEC], rig='B')[0].port == 'P4'
+    remote.release()
+    assert device_manager.get_devices([REMOTE_SPEC], rig='A')[0].port == 'P2'
+
+
+def test_device_manager_get_devices_leased(tmp_path):
+    """ Verify the devices leased by another DeviceManager (process) are not available. """
+    devices = [DUT_SPEC + ('P1', None), REMOTE_SPEC + ('P2', None)]
+    device_manager = _device_manager(tmp_path, devices)
+    other = _device_manager(tmp_path, devices)
+    assert other.get_devices([REMOTE_SPEC]) is not None
+    assert device_manager.get_devices([DUT_SPEC, REMOTE_SPEC], timeout=0.1) is None
+    # the devices of an incomplete set are released
+    assert device_manager.get_devices([DUT_SPEC])[0].port == 'P1'
+
+
+def test_device_manager_count_device_sets(tmp_path):
+    """ Verify the DUT-only sets and the DUT-remote pairs of each rig are counted. """
+    device_manager = _device_manager(tmp_path, [DUT_SPEC + ('P1', 'A'), DUT_SPEC + ('P2', 'A'),
+                                                REMOTE_SPEC + ('P3', 'A'), DUT_SPEC + ('P4', 'B')])
+    assert device_manager.count_device_sets([DUT_SPEC]) == 3
+    assert device_manager.count_device_sets([DUT_SPEC, REMOTE_SPEC]) == 1
@@ -0,0 +1,50 @@
+import pytest
+from sr_framework.utils import payload
+
+ALL_BYTES = bytes(range(256))
+
+
+@pytest.mark.parametrize('encoding', payload.ENCODINGS)
+@pytest.mark.parametrize('data', [b'', b'Hi', b'\x00\x01\xff', b'\\"', ALL_BYTES])
+def test_payload_escape_unescape(encoding, data):
+    """ Verify unescape(escape(data)) returns data, for both encodings. """
+    assert payload.unescape(payload.escape(data, encoding)) == data
+
+
+def test_payload_escape():
+    """ Verify the escaped strings of both encodings. """
+    data = b'Hi\n\x80"\\'
+    assert payload.escape(data) == '\\48\\69\\0A\\80\\22\\5C'
+    assert payload.escape(data, payload.ENCODING_COMPACT) == 'Hi\\0A\\80\\22\\5C'
+
+
+def test_payload_escape_compact_ascii_only():
+    """ Verify the compact encoding only contains printable ASCII characters. """
+    escaped = payload.escape(ALL_BYTES, payload.ENCODING_COMPACT)
+    assert all(0x20 <= ord(char) <= 0x7E for char in escaped)
+    assert '"' not in escaped
+
+
+@pytest.mark.parametrize('data', [[0x01, 0x48], bytearray(b'\x01H'), memoryview(b'\x01H')])
+def test_payload_escape_types(data):
+    """ Verify the payloads given as lists of ints and bytes-like objects. """
+    assert payload.escape(data) == '\\01\\48'
+    assert payload.size(data) == 2
+
+
+def test_payload_quote():
+    """ Verify the quoted string of an AT command argument. """
+    assert payload.quote(b'\x01') == '"\\01"'
+    assert payload.quote(b'A"', payload.ENCODING_COMPACT) == '"A\\22"'
+
+
+def test_payload_unescape_mixed():
+    """ Verify the escaped bytes mixed with literal characters, lower case hex included. """
+    assert payload.unescape('\\00\\01Hi\\ff') == b'\x00\x01Hi\xff'
+
+
+@pytest.mark.parametrize('hex_string', ['0102AB80FF', '01 02 ab 80 ff'])
+def test_payload_from_hex(hex_string):
+    """ Verify the hexadecimal strings of the BC127 events. """
+    assert payload.from_hex(hex_string) == b'\x01\x02\xab\x80\xff'
+    assert payload.from_hex(ALL_BYTES.hex()) == ALL_BYTES
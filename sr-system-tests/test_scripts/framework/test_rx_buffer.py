@@ -0,0 +1,122 @@
+import re
+import pytest
+from sr_framework.utils.rx_buffer import RxBuffer
+
+
+@pytest.mark.parametrize('chunks', [
+    [b'OK\r\nERROR\r\n'],
+    [b'OK\r', b'\nERROR\r\n'],
+    [b'OK', b'\r', b'\n', b'ERR', b'OR\r\n'],
+])
+def test_rx_buffer_crlf_split(chunks):
+    """ Verify a '\\r\\n' end of line split between two chunks ends one line. """
+    rx_buffer = RxBuffer()
+    for chunk in chunks:
+        rx_buffer.append(chunk)
+    assert rx_buffer.lines() == [b'OK\r\n', b'ERROR\r\n']
+
+
+def test_rx_buffer_cr_lf_eol():
+    """ Verify the '\\r' and '\\n' ends of line, alone or in a chunk. """
+    rx_buffer = RxBuffer()
+    rx_buffer.append(b'A\rB\nC\r')
+    rx_buffer.append(b'D\n')
+    assert rx_buffer.lines() == [b'A\r', b'B\n', b'C\r', b'D\n']
+    assert rx_buffer.text() == 'A\rB\nC\rD\n'
+
+
+def test_rx_buffer_partial_line():
+    """ Verify the data received next is appended to a line not complete. """
+    rx_buffer = RxBuffer()
+    rx_buffer.append(b'+SRBLE')
+    assert rx_buffer.last_line() == b'+SRBLE'
+    rx_buffer.append(b'CFG: 1\r\n')
+    assert rx_buffer.lines() == [b'+SRBLECFG: 1\r\n']
+    assert rx_buffer.end == 1
+
+
+def test_rx_buffer_length():
+    """ Verify only length bytes of the chunk are appended. """
+    rx_buffer = RxBuffer()
+    rx_buffer.append(bytearray(b'OK\r\nGARBAGE'), 4)
+    assert rx_buffer.lines() == [b'OK\r\n']
+
+
+def test_rx_buffer_max_size():
+    """ Verify the oldest lines are evicted, keeping the absolute indexes. """
+    rx_buffer = RxBuffer(max_size=10)
+    for i in range(5):
+        rx_buffer.append(b'L%d\r\n' % i)
+    assert rx_buffer.size <= 10
+    assert rx_buffer.base == 3
+    assert rx_buffer.end == 5
+    assert rx_buffer.lines(0) == [b'L3\r\n', b'L4\r\n']
+    assert rx_buffer.lines(4, 5) == [b'L4\r\n']
+
+
+def test_rx_buffer_max_size_keeps_last_line():
+    """ Verify a line larger than max_size is kept. """
+    rx_buffer = RxBuffer(max_size=4)
+    rx_buffer.append(b'0123456789\r\n')
+    assert rx_buffer.lines() == [b'0123456789\r\n']
+
+
+def test_rx_buffer_clear():
+    """ Verify clear keeps the absolute indexes. """
+    rx_buffer = RxBuffer()
+    rx_buffer.append(b'A\r\nB\r\n')
+    rx_buffer.clear()
+    assert len(rx_buffer) == 0
+    assert rx_buffer.base == rx_buffer.end == 2
+    assert rx_buffer.generation == 1
+    rx_buffer.append(b'C\r\n')
+    assert rx_buffer.lines(2) == [b'C\r\n']
+
+
+def test_rx_buffer_line_filter():
+    """ Verify the lines filtered are not stored, complete lines only. """
+    filtered = []
+
+    def line_filter(line):
+        if line.startswith(b'+URC'):
+            filtered.append(line)
+            return True
+        return False
+
+    rx_buffer = RxBuffer()
+    rx_buffer.append(b'+URC: 1\r', line_filter=line_filter)
+    rx_buffer.append(b'\nOK\r\n+UR', line_filter=line_filter)
+    # the '\n' of the line filtered is not appended to the previous line
+    assert rx_buffer.lines() == [b'OK\r\n', b'+UR']
+    rx_buffer.append(b'C: 2\r\n', line_filter=line_filter)
+    assert filtered == [b'+URC: 1\r', b'+URC: 2\r\n']
+    assert rx_buffer.lines() == [b'OK\r\n']
+
+
+def _raw_length(data, pos, endpos):
+    """ Lines 'RAW <decimal length> <raw data>'. """
+    header = re.compile(rb'RAW (\d+) ').match(data, pos, endpos)
+    return header.end() - pos + int(header.group(1)) if header else None
+
+
+@pytest.mark.parametrize('chunks', [
+    [b'RAW 4 \r\n\x80\n\r\nOK\r\n'],
+    [b'RAW', b' 4 \r', b'\n\x80', b'\n\r', b'\nOK\r\n'],
+    [b'RAW 4 \r\n\x80\n', b'\r', b'\n', b'OK\r\n'],
+])
+def test_rx_buffer_raw_length(chunks):
+    """ Verify the raw data of a line is not split at its end of line characters. """
+    rx_buffer = RxBuffer()
+    for chunk in chunks:
+        rx_buffer.append(chunk, raw_length=_raw_length)
+    assert rx_buffer.lines() == [b'RAW 4 \r\n\x80\n\r\n', b'OK\r\n']
+
+
+def test_rx_buffer_raw_length_line_filter():
+    """ Verify the line filter is called with the complete line, raw data included. """
+    filtered = []
+    rx_buffer = RxBuffer()
+    rx_buffer.append(b'RAW 2 \r', line_filter=filtered.append, raw_length=_raw_length)
+    assert filtered == []
+    rx_buffer.append(b'\n\r\n', line_filter=filtered.append, raw_length=_raw_length)
+    assert filtered == [b'RAW 2 \r\n\r\n']
@@ -0,0 +1,61 @@
+from sr_framework.utils.serial_port import SerialPort, SerialSearchCursor
+
+
+def _serial_port(*chunks):
+    """ Serial port (not opened) with chunks received in its rx buffer. """
+    serial_port = SerialPort('TEST')
+    for chunk in chunks:
+        serial_port.rx_data.append(chunk)
+    return serial_port
+
+
+def test_serial_search_line_startswith_any_whole_buffer():
+    """ Verify the lines received before the call are searched without cursor. """
+    serial_port = _serial_port(b'OK\r\n', b'ERROR\r\n')
+    assert serial_port.serial_search_line_startswith_any(('ERROR', 'OK')) == (1, 'OK')
+    assert serial_port.serial_search_line_startswith('OK') == 'OK'
+
+
+def test_serial_search_line_startswith_any_cursor():
+    """ Verify a cursor does not return the lines of a previous match again. """
+    serial_port = _serial_port(b'OK\r\n')
+    cursor = SerialSearchCursor()
+    assert serial_port.serial_search_line_startswith_any(('OK',), cursor=cursor) == (0, 'OK')
+    assert serial_port.serial_search_line_startswith_any(('OK',), cursor=cursor) is None
+    serial_port.rx_data.append(b'O')
+    assert serial_port.serial_search_line_startswith_any(('OK',), cursor=cursor) is None
+    serial_port.rx_data.append(b'K\r\n')
+    assert serial_port.serial_search_line_startswith_any(('OK',), cursor=cursor) == (0, 'OK')
+
+
+def test_serial_search_regex_cursor_straddling_match():
+    """ Verify a match spanning more lines than the cursor overlap is found. """
+    serial_port = _serial_port(b'BEGIN\r\n', *[b'line %d\r\n' % i for i in range(20)])
+    cursor = SerialSearchCursor()
+    assert serial_port.serial_search_regex(r'BEGIN(.*?)END', cursor=cursor) is None
+    serial_port.rx_data.append(b'END\r\n')
+    match = serial_port.serial_search_regex(r'BEGIN(.*?)END', cursor=cursor)
+    assert match[0].count('line') == 20
+    assert serial_port.serial_search_regex(r'BEGIN(.*?)END', cursor=cursor) is None
+
+
+def test_serial_search_regex_all_cursor():
+    """ Verify the matches are returned once with a cursor. """
+    serial_port = _serial_port(b'+EVT: 1\r\n+EVT: 2\r\n')
+    cursor = SerialSearchCursor()
+    assert serial_port.serial_search_regex_all(r'\+EVT: (\d)', cursor=cursor) == ['1', '2']
+    serial_port.rx_data.append(b'+EVT: 3\r\n')
+    assert serial_port.serial_search_regex_all(r'\+EVT: (\d)', cursor=cursor) == ['3']
+
+
+def test_serial_raw_data_urc():
+    """ Verify a URC carrying raw data is routed complete, and matched on bytes. """
+    serial_port = SerialPort('TEST')
+    serial_port.serial_add_raw_data_header(r'RECV [0-9A-F]+ (\d+) ')
+    subscription = serial_port.serial_urc_subscribe(['RECV'])
+    for chunk in (b'\r\nRECV 1 5 \r\n\x80', b'\xff\r\r\n', b'\r\nOK\r\n'):
+        serial_port.rx_data.append(chunk, None, serial_port.urc_dispatcher.dispatch,
+                                   serial_port._raw_length)
+    assert subscription.wait_all(r'RECV 1 (\d+) (.*)', decode=False) == \
+        [(b'5', b'\r\n\x80\xff\r\r\n')]
+    assert [line.strip() for line in serial_port.rx_data.lines() if line.strip()] == [b'OK']
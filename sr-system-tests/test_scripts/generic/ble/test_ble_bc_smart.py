@@ -1,37 +1,39 @@
 import pytest
-import time
 
 
 @pytest.fixture(scope='function')
-def ble_connection(dut, remote):
-    # Connection
+def ble_connection(dut, remote, ble_link_pool):
+    # Connection, shared by the tests of the module
     global dut_session_id, remote_session_id
-    dut_bdaddr = dut.ble_get_local_address()
-    remote_bdaddr = remote.ble_get_local_address()
-    assert dut.ble_set_advertising_enable(True)
-    remote_session = remote.ble_create_session(dut_bdaddr)
-    assert remote.ble_connect(remote_session.session_id)
-    assert dut.ble_wait_for_connection()
-    dut_session_id = dut.ble_get_session_id_from_bdaddr(remote_bdaddr)
-    assert dut_session_id is not None
-    remote_session_id = remote_session.session_id
     # wait for BC Smart service discovery, and client to enables BC Smart notifications.
-    time.sleep(1)
-    yield
-    # Disconnection
-    assert remote.ble_disconnect(remote_session.session_id)
-    assert dut.ble_wait_for_disconnection(dut_session_id)
+    link = ble_link_pool.acquire(dut, remote, 'bc_smart', settle=1)
+    assert link
+    dut_session_id = link.dut_session_id
+    remote_session_id = link.remote_session_id
 
 def test_bc_smart_server_01(dut, remote, ble_connection):
     """Verify DUT can send data, in command mode, to a BC Smart client. """
     # GIVEN
     global dut_session_id, remote_session_id
-    data = [0x48, 0x65, 0x6c, 0x6c, 0x6f, 0x21, 0x20, 0x54, 0x68, 0x69, 0x73, 0x20, 0x69, 0x73, 0x20,
-            0x61, 0x20, 0x74, 0x65, 0x73]  # , 0x74, 0x2e] an error is return is data length > MTU - 3 (20)
+    data = bytes([0x48, 0x65, 0x6c, 0x6c, 0x6f, 0x21, 0x20, 0x54, 0x68, 0x69, 0x73, 0x20, 0x69, 0x73, 0x20,
+                  0x61, 0x20, 0x74, 0x65, 0x73])  # , 0x74, 0x2e] an error is return is data length > MTU - 3 (20)
     # WHEN
     assert dut.bc_smart_server_send_data(dut_session_id, data)
     # THEN
-    data_received = remote.bc_smart_client_wait_for_client_data(remote_session_id)
+    data_received = remote.bc_smart_client_wait_for_client_data(remote_session_id, size=len(data))
+    assert data_received == data
+
+
+def test_bc_smart_server_06(dut, remote, ble_connection):
+    """Verify DUT can send binary data (end of line characters, bytes >= 0x80) to a BC Smart client. """
+    # GIVEN
+    global dut_session_id, remote_session_id
+    data = bytes([0x00, 0x0d, 0x0a, 0x0d, 0x80, 0xff, 0x52, 0x45, 0x43, 0x56, 0x0a, 0x0d,
+                  0x0a, 0xc3, 0xa9, 0x5c, 0x22, 0x7f, 0x01, 0x0d])
+    # WHEN
+    assert dut.bc_smart_server_send_data(dut_session_id, data)
+    # THEN
+    data_received = remote.bc_smart_client_wait_for_client_data(remote_session_id, size=len(data))
     assert data_received == data
 
 
@@ -40,16 +42,17 @@ def test_bc_smart_server_02(dut, remote, ble_connection):
     """Verify DUT can receive data, in command mode, from a BC Smart client. """
     # GIVEN
     global dut_session_id, remote_session_id
-    data = [0x48, 0x65, 0x6c, 0x6c, 0x6f, 0x21, 0x20, 0x54, 0x68, 0x69, 0x73,
-            0x20, 0x69, 0x73, 0x20, 0x61, 0x20, 0x74, 0x65, 0x73]  # , 0x74, 0x2e]
+    data = bytes([0x48, 0x65, 0x6c, 0x6c, 0x6f, 0x21, 0x20, 0x54, 0x68, 0x69, 0x73,
+                  0x20, 0x69, 0x73, 0x20, 0x61, 0x20, 0x74, 0x65, 0x73])  # , 0x74, 0x2e]
     # WHEN
     assert remote.bc_smart_client_send_data(remote_session_id, data)
     # THEN
-    data_received = dut.bc_smart_server_wait_for_data(dut_session_id)
+    data_received = dut.bc_smart_server_wait_for_data(dut_session_id, size=len(data))
     assert data_received == data
 
 
 @pytest.mark.skip(reason='TODO: EDDINGTON PROFILE INIT')
+@pytest.mark.link_destructive
 def test_bc_smart_server_05(dut, remote, ble_connection):
     """Verify DUT can receive remote commands from a BC Smart client, and send back command responses. """
     # GIVEN
@@ -1,6 +1,7 @@
 import pytest
 import sr_framework.utils.helpers
 from sr_framework.device.ble import BleInterface
+from sr_framework.device.scan_aggregator import ScanAggregator
 import time
 import warnings
 
@@ -12,9 +13,10 @@ def test_ble_gap_peripheral_disc_02_1(dut, remote):
     # WHEN
     assert dut.ble_set_advertising_enable(True)
     # THEN
-    scan_results = remote.ble_scan(10)
-    assert [res for res in scan_results if (
-        res.addr == dut_bdaddr.addr) and (res.addr_type == dut_bdaddr.addr_type)]
+    def is_dut(res):
+        return (res.addr == dut_bdaddr.addr) and (res.addr_type == dut_bdaddr.addr_type)
+    scan = ScanAggregator(remote.ble_scan_iter(10, stop_when=is_dut))
+    assert (dut_bdaddr.addr, dut_bdaddr.addr_type) in scan
 
 
 def test_ble_gap_peripheral_disc_02_2(dut, remote):
@@ -25,9 +27,8 @@ def test_ble_gap_peripheral_disc_02_2(dut, remote):
     # WHEN
     assert dut.ble_set_advertising_enable(False)
     # THEN
-    scan_results = remote.ble_scan(10)
-    assert not [res for res in scan_results if (
-        res.addr == dut_bdaddr.addr) and (res.addr_type == dut_bdaddr.addr_type)]
+    scan = ScanAggregator(remote.ble_scan_iter(10))
+    assert (dut_bdaddr.addr, dut_bdaddr.addr_type) not in scan
 
 
 def test_ble_gap_peripheral_disc_03_3(dut, remote):
@@ -35,12 +36,15 @@ def test_ble_gap_peripheral_disc_03_3(dut, remote):
     # GIVEN
     dut_bdaddr = dut.ble_get_local_address()
     # WHEN
-    adv_data = [0x02, 0x01, 0x06, 0x05, 0x09, 0x54, 0x65, 0x73, 0x74]
+    adv_data = bytes([0x02, 0x01, 0x06, 0x05, 0x09, 0x54, 0x65, 0x73, 0x74])
     assert dut.ble_set_advertising_enable(True, adv_data)
     # THEN
-    scan_raw_results = remote.ble_scan(10, BleInterface.SCAN_RESULT_FORMAT_RAW_DATA)
-    assert [res for res in scan_raw_results if(res.addr == dut_bdaddr.addr) and (
-        res.addr_type == dut_bdaddr.addr_type) and sr_framework.utils.helpers.contains_sublist(res.raw_data, adv_data)]
+    def is_dut_adv(res):
+        return (res.addr == dut_bdaddr.addr) and (res.addr_type == dut_bdaddr.addr_type) and \
+            sr_framework.utils.helpers.contains_sublist(res.raw_data, adv_data)
+    scan_raw_results = list(remote.ble_scan_iter(10, BleInterface.SCAN_RESULT_FORMAT_RAW_DATA,
+                                                 stop_when=is_dut_adv))
+    assert [res for res in scan_raw_results if is_dut_adv(res)]
 
 
 def test_ble_gap_peripheral_disc_04(dut, remote):
@@ -48,15 +52,18 @@ def test_ble_gap_peripheral_disc_04(dut, remote):
     # GIVEN
     dut_bdaddr = dut.ble_get_local_address()
     # WHEN
-    adv_data = [0x02, 0x01, 0x06, 0x05, 0x09, 0x54, 0x65, 0x73, 0x74]
-    scan_resp_data = [0x05, 0x14, 0xAA, 0xBB, 0xCC, 0xDD]
+    adv_data = bytes([0x02, 0x01, 0x06, 0x05, 0x09, 0x54, 0x65, 0x73, 0x74])
+    scan_resp_data = bytes([0x05, 0x14, 0xAA, 0xBB, 0xCC, 0xDD])
     assert dut.ble_set_advertising_enable(True, adv_data, scan_resp_data)
     # THEN
-    scan_raw_results = remote.ble_scan(10, True)
-    assert [res for res in scan_raw_results if (res.addr == dut_bdaddr.addr) and (
-        res.addr_type == dut_bdaddr.addr_type) and sr_framework.utils.helpers.contains_sublist(res.raw_data, adv_data)]
-    assert [res for res in scan_raw_results if (res.addr == dut_bdaddr.addr) and (
-        res.addr_type == dut_bdaddr.addr_type) and sr_framework.utils.helpers.contains_sublist(res.raw_data, scan_resp_data)]
+    def is_dut_complete(record):
+        return (record.addr == dut_bdaddr.addr) and (record.addr_type == dut_bdaddr.addr_type) \
+            and record.adv_data is not None and record.scan_resp_data is not None
+    scan = ScanAggregator().add_all(remote.ble_scan_iter(10, True), until=is_dut_complete)
+    record = scan.get(dut_bdaddr.addr, dut_bdaddr.addr_type)
+    assert record
+    assert record.contains(adv_data)
+    assert record.contains(scan_resp_data)
 
 
 def test_ble_gap_peripheral_disc_05_2(dut):
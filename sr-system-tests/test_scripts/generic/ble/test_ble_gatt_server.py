@@ -20,7 +20,7 @@ CUSTOM_CHAR_A_PERMISSION =\
     BleInterface.AttPermissions.WRITE
 CUSTOM_CHAR_A_MAX_LEN = 20
 CUSTOM_CHAR_A_VAR_LEN = 1
-CUSTOM_CHAR_A_VALUE = [0x32, 0x33, 0x35]
+CUSTOM_CHAR_A_VALUE = bytes([0x32, 0x33, 0x35])
 # Characteristic A descriptor custom
 CUSTOM_CHAR_A_DESC_UUID = '9876'
 CUSTOM_CHAR_A_DESC_PERMISSION =\
@@ -28,7 +28,7 @@ CUSTOM_CHAR_A_DESC_PERMISSION =\
     BleInterface.AttPermissions.WRITE
 CUSTOM_CHAR_A_DESC_MAX_LEN = 2
 CUSTOM_CHAR_A_DESC_VAR_LEN = 0
-CUSTOM_CHAR_A_DESC_VALUE = [0x00, 0x00]
+CUSTOM_CHAR_A_DESC_VALUE = bytes([0x00, 0x00])
 # Characteristic B
 CUSTOM_CHAR_B_UUID = 'EEFF'
 CUSTOM_CHAR_B_PROPERTIES =\
@@ -42,7 +42,7 @@ CUSTOM_CHAR_B_PERMISSION =\
     BleInterface.AttPermissions.READ_AUTHORIZATION
 CUSTOM_CHAR_B_MAX_LEN = 0
 CUSTOM_CHAR_B_VAR_LEN = 1
-CUSTOM_CHAR_B_VALUE = []
+CUSTOM_CHAR_B_VALUE = b''
 # Characteristic C
 CUSTOM_CHAR_C_UUID = '569A1101-B87F-490C-92CB-00000000EEFF'
 CUSTOM_CHAR_C_PROPERTIES =\
@@ -56,7 +56,7 @@ CUSTOM_CHAR_C_PERMISSION =\
     BleInterface.AttPermissions.READ_AUTHORIZATION
 CUSTOM_CHAR_C_MAX_LEN = 0
 CUSTOM_CHAR_C_VAR_LEN = 1
-CUSTOM_CHAR_C_VALUE = []
+CUSTOM_CHAR_C_VALUE = b''
 CUSTOM_CHAR_C_READ_AUTH = 1
 CUSTOM_CHAR_C_WRITE_AUTH = 1
 # Characteristic C descriptor CCCD
@@ -66,10 +66,10 @@ CUSTOM_CHAR_C_DESC_PERMISSION =\
     BleInterface.AttPermissions.WRITE
 CUSTOM_CHAR_C_DESC_MAX_LEN = 2
 CUSTOM_CHAR_C_DESC_VAR_LEN = 0
-CUSTOM_CHAR_C_DESC_VALUE = [0x00, 0x00]
+CUSTOM_CHAR_C_DESC_VALUE = bytes([0x00, 0x00])
 
-@pytest.fixture(scope='function')
 def custom_db(dut):
+    """Add the custom GATT database to the DUT (setup of the BLE link)."""
     global  char_a_handle, char_a_desc_handle, char_b_handle,\
             char_c_handle, char_c_desc_handle
     # add service
@@ -124,23 +124,24 @@ def custom_db(dut):
     char_c_desc_handle = int(responses[5][1])
 
 
-@pytest.fixture(scope='function')
-def ble_connection(dut, remote):
-    # Connection
+def _acquire_link(dut, remote, ble_link_pool, key, setup=None):
     global dut_session_id, remote_session_id
-    dut_bdaddr = dut.ble_get_local_address()
-    remote_bdaddr = remote.ble_get_local_address()
-    assert dut.ble_set_advertising_enable(True)
-    remote_session = remote.ble_create_session(dut_bdaddr)
-    assert remote.ble_connect(remote_session.session_id)
-    assert dut.ble_wait_for_connection()
-    dut_session_id = dut.ble_get_session_id_from_bdaddr(remote_bdaddr)
-    assert dut_session_id is not None
-    remote_session_id = remote_session.session_id
-    yield
-    # Disconnection
-    assert remote.ble_disconnect(remote_session.session_id)
-    assert dut.ble_wait_for_disconnection(dut_session_id)
+    link = ble_link_pool.acquire(dut, remote, key, setup)
+    assert link
+    dut_session_id = link.dut_session_id
+    remote_session_id = link.remote_session_id
+
+
+@pytest.fixture(scope='function')
+def ble_connection(dut, remote, ble_link_pool):
+    # Connection, shared by the tests of the module
+    _acquire_link(dut, remote, ble_link_pool, 'gatt_server')
+
+
+@pytest.fixture(scope='function')
+def custom_db_connection(dut, remote, ble_link_pool):
+    # Connection to the custom GATT database, shared by the tests of the module
+    _acquire_link(dut, remote, ble_link_pool, 'gatt_server_custom_db', custom_db)
 
 
 def test_ble_gatt_server_01_1(dut, remote, ble_connection):
@@ -182,7 +183,7 @@ def test_ble_gatt_server_02(dut, remote, ble_connection):
     assert remote.ble_get_exchanged_mtu_size(remote_session_id) == expected_mtu
 
 
-def test_ble_gatt_server_03_1(dut, remote, custom_db, ble_connection):
+def test_ble_gatt_server_03_1(dut, remote, custom_db_connection):
     """Verify DUT can reply to a GATT Read request from a remote Client
     by sending a GATT Read Response (Read Request handled by the
     user). """
@@ -194,7 +195,7 @@ def test_ble_gatt_server_03_1(dut, remote, custom_db, ble_connection):
     # THEN
     assert dut.ble_gatt_wait_for_read_request(dut_session_id,
                                               char_b_handle)
-    value = [0x00, 0x01, 0x02, 0x03, 0x04]
+    value = bytes([0x00, 0x01, 0x02, 0x03, 0x04])
     assert dut.ble_gatt_read_response(dut_session_id,
                                       char_b_handle,
                                       True,
@@ -205,7 +206,7 @@ def test_ble_gatt_server_03_1(dut, remote, custom_db, ble_connection):
                                                    char_b_handle)
 
 
-def test_ble_gatt_server_03_2(dut, remote, custom_db, ble_connection):
+def test_ble_gatt_server_03_2(dut, remote, custom_db_connection):
     """Verify DUT can reject a GATT Read request from a remote Client
     by sending an Error Response (Read Request handled by the user). """
     # GIVEN
@@ -224,7 +225,7 @@ def test_ble_gatt_server_03_2(dut, remote, custom_db, ble_connection):
                                                   ) is None
 
 
-def test_ble_gatt_server_03_3(dut, remote, custom_db, ble_connection):
+def test_ble_gatt_server_03_3(dut, remote, custom_db_connection):
     """Verify DUT can reply to a GATT Read request from a remote Client
     by sending a GATT Read Response (Read Request automatically
     handled). """
@@ -240,14 +241,14 @@ def test_ble_gatt_server_03_3(dut, remote, custom_db, ble_connection):
                                                    CUSTOM_CHAR_A_VALUE
 
 
-def test_ble_gatt_server_04_1(dut, remote, custom_db, ble_connection):
+def test_ble_gatt_server_04_1(dut, remote, custom_db_connection):
     """Verify DUT can reply to a GATT Write request from a remote Client
     and send GATT Write Response (Write Request handled by the
     user). """
     # GIVEN
     global dut_session_id, remote_session_id
     # WHEN
-    value = [0x00, 0x01, 0x02, 0x03, 0x04, 0x05]
+    value = bytes([0x00, 0x01, 0x02, 0x03, 0x04, 0x05])
     assert remote.ble_gatt_write_request(remote_session_id,
                                          char_b_handle,
                                          value,
@@ -264,14 +265,14 @@ def test_ble_gatt_server_04_1(dut, remote, custom_db, ble_connection):
                                                    char_b_handle)
 
 
-def test_ble_gatt_server_04_2(dut, remote, custom_db, ble_connection):
+def test_ble_gatt_server_04_2(dut, remote, custom_db_connection):
     """Verify DUT can reject a GATT Write request from a remote Client
     by sending an Error Response (Write Request handled by the
     user). """
     # GIVEN
     global dut_session_id, remote_session_id
     # WHEN
-    value = [0x00, 0x01, 0x02, 0x03, 0x04, 0x05]
+    value = bytes([0x00, 0x01, 0x02, 0x03, 0x04, 0x05])
     assert remote.ble_gatt_write_request(remote_session_id,
                                          char_b_handle,
                                          value,
@@ -289,14 +290,15 @@ def test_ble_gatt_server_04_2(dut, remote, custom_db, ble_connection):
                                                 char_b_handle)
 
 
-def test_ble_gatt_server_04_3(dut, remote, custom_db, ble_connection):
+@pytest.mark.link_destructive
+def test_ble_gatt_server_04_3(dut, remote, custom_db_connection):
     """Verify DUT can reply to a GATT Write request from a remote
     Client and send GATT Write Response. (Write Request automatically
     handled). """
     # GIVEN
     global dut_session_id, remote_session_id
     # WHEN
-    value = [0x00, 0x01, 0x02, 0x03, 0x04, 0x05]
+    value = bytes([0x00, 0x01, 0x02, 0x03, 0x04, 0x05])
     assert remote.ble_gatt_write_request(remote_session_id,
                                          char_a_handle,
                                          value,
@@ -311,12 +313,12 @@ def test_ble_gatt_server_04_3(dut, remote, custom_db, ble_connection):
 
 
 @pytest.mark.skip(reason='TODO: BC127-181')
-def test_ble_gatt_server_05(dut, remote, custom_db, ble_connection):
+def test_ble_gatt_server_05(dut, remote, custom_db_connection):
     """Verify DUT can receive GATT Write without response request from a remote Client. """
     # GIVEN
     global dut_session_id, remote_session_id
     # WHEN
-    value = [0x00, 0x01, 0x02, 0x03, 0x04, 0x05]
+    value = bytes([0x00, 0x01, 0x02, 0x03, 0x04, 0x05])
     assert remote.ble_gatt_write_request(remote_session_id, char_a_handle, value, False)
     # THEN
     write_req = dut.ble_gatt_wait_for_write_request(dut_session_id, char_a_handle)
@@ -325,7 +327,8 @@ def test_ble_gatt_server_05(dut, remote, custom_db, ble_connection):
     assert remote.ble_gatt_wait_for_write_response(remote_session_id, char_a_handle)
 
 
-def test_ble_gatt_server_06(dut, remote, custom_db, ble_connection):
+@pytest.mark.link_destructive
+def test_ble_gatt_server_06(dut, remote, custom_db_connection):
     """Verify DUT can send GATT Notifications to a remote Client. """
     # GIVEN
     global dut_session_id, remote_session_id
@@ -336,7 +339,7 @@ def test_ble_gatt_server_06(dut, remote, custom_db, ble_connection):
     assert remote.ble_gatt_wait_for_write_response(remote_session_id,
                                                    char_c_desc_handle)
     # WHEN
-    value = [0x00, 0x01, 0x02, 0x03, 0x04, 0x05]
+    value = bytes([0x00, 0x01, 0x02, 0x03, 0x04, 0x05])
     assert dut.ble_gatt_notification_request(remote_session_id,
                                              char_c_handle,
                                              value)
@@ -345,7 +348,8 @@ def test_ble_gatt_server_06(dut, remote, custom_db, ble_connection):
                                                  char_c_handle) == value
 
 
-def test_ble_gatt_server_07(dut, remote, custom_db, ble_connection):
+@pytest.mark.link_destructive
+def test_ble_gatt_server_07(dut, remote, custom_db_connection):
     """Verify DUT can send GATT Indications to a remote Client. """
     # GIVEN
     global dut_session_id, remote_session_id
@@ -356,7 +360,7 @@ def test_ble_gatt_server_07(dut, remote, custom_db, ble_connection):
     assert remote.ble_gatt_wait_for_write_response(remote_session_id,
                                                    char_c_desc_handle)
     # WHEN
-    value = [0x00, 0x01, 0x02, 0x03, 0x04, 0x05]
+    value = bytes([0x00, 0x01, 0x02, 0x03, 0x04, 0x05])
     assert dut.ble_gatt_indication_request(remote_session_id,
                                            char_c_handle,
                                            value)
@@ -369,7 +373,7 @@ def test_ble_gatt_server_07(dut, remote, custom_db, ble_connection):
                                                      char_c_handle)
 
 
-def test_ble_gatt_server_08(dut, remote, custom_db, ble_connection):
+def test_ble_gatt_server_08(dut, remote, custom_db_connection):
     """Verify DUT can set a custom GATT database (Primary services,
     characteristics and characteristic descriptors). """
     # GIVEN
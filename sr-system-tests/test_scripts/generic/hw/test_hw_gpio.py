@@ -82,11 +82,11 @@ def test_hw_gpio_03(dut, GPIO_in, GPIO_out):
     # WHEN
     assert dut.hw_gpio_write(GPIO_out, 1)
     # THEN
-    assert [item for item in dut.hw_gpio_wait_for_event(GPIO_in) if (GPIO_in, 1) == item]
+    assert [item for item in dut.hw_gpio_wait_for_event(GPIO_in, state=1) if (GPIO_in, 1) == item]
     # WHEN
     assert dut.hw_gpio_write(GPIO_out, 0)
     # THEN
-    assert [item for item in dut.hw_gpio_wait_for_event(GPIO_in) if (GPIO_in, 0) == item]
+    assert [item for item in dut.hw_gpio_wait_for_event(GPIO_in, state=0) if (GPIO_in, 0) == item]
 
 
 @pytest.mark.parametrize("GPIO_out",[
@@ -160,11 +160,11 @@ def test_hw_gpio_05(dut, GPIO_A, GPIO_B):
     # WHEN
     assert dut.hw_gpio_configure(GPIO_B, HWInterface.GPIO_INPUT, HWInterface.PULL_DOWN)
     # THEN
-    assert [item for item in dut.hw_gpio_wait_for_event(GPIO_A) if (GPIO_A, 1) == item]
+    assert [item for item in dut.hw_gpio_wait_for_event(GPIO_A, state=1) if (GPIO_A, 1) == item]
     # WHEN
     assert dut.hw_gpio_configure(GPIO_B, HWInterface.GPIO_INPUT, HWInterface.PULL_UP)
     # THEN
-    assert [item for item in dut.hw_gpio_wait_for_event(GPIO_A) if (GPIO_A, 0) == item]
+    assert [item for item in dut.hw_gpio_wait_for_event(GPIO_A, state=0) if (GPIO_A, 0) == item]
 
 
 @pytest.mark.parametrize("GPIOs_in,GPIOs_out",[
@@ -200,11 +200,11 @@ def test_hw_gpio_06(dut, GPIOs_in, GPIOs_out):
         # WHEN
         assert dut.hw_gpio_write(GPIOs_out[id], 1)
         # THEN
-        assert [item for item in dut.hw_gpio_wait_for_event(GPIOs_in[id]) if (GPIOs_in[id], 1) == item]
+        assert [item for item in dut.hw_gpio_wait_for_event(GPIOs_in[id], state=1) if (GPIOs_in[id], 1) == item]
         # WHEN
         assert dut.hw_gpio_write(GPIOs_out[id], 0)
         # THEN
-        assert [item for item in dut.hw_gpio_wait_for_event(GPIOs_in[id]) if (GPIOs_in[id], 0) == item]
+        assert [item for item in dut.hw_gpio_wait_for_event(GPIOs_in[id], state=0) if (GPIOs_in[id], 0) == item]
 
 @pytest.mark.parametrize("GPIO_in,GPIO_out",[
     (42, 19)])
@@ -220,4 +220,4 @@ def test_hw_gpio_07(dut, GPIO_in, GPIO_out):
         value = not value
         assert dut.hw_gpio_write(GPIO_out, int(value))
         # THEN
-        assert [item for item in dut.hw_gpio_wait_for_event(GPIO_in) if (GPIO_in, int(value)) == item]
+        assert [item for item in dut.hw_gpio_wait_for_event(GPIO_in, state=int(value)) if (GPIO_in, int(value)) == item]